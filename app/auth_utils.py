@@ -4,10 +4,14 @@ from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import models, database, schemas
+from . import models, database, schemas, shards, user_context
+from app.cache import TTLCache
+from app.workers import BoundedPool, PoolOverloaded
 from app.schemas import TokenData
 
 
@@ -16,14 +20,59 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_TIMEOUT_SECONDS", "5"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes below BCRYPT_ROUNDS are reported by needs_update() and upgraded on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
 
-def hash_password(password: str) -> str:
+# bcrypt is pure CPU; running it in separate processes keeps a login burst from
+# holding the GIL and the request threadpool that every other route shares.
+password_pool = BoundedPool(
+    "password_hashing",
+    max_workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+)
+
+
+def _hash(password: str) -> str:
     return pwd_context.hash(password)
 
+
+def _verify_and_update(plain_password: str, hashed_password: str):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _run_password_job(fn, *args):
+    try:
+        return password_pool.run(fn, *args, timeout=PASSWORD_HASH_TIMEOUT_SECONDS)
+    except PoolOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
+
+def hash_password(password: str) -> str:
+    return _run_password_job(_hash, password)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    verified, _ = _run_password_job(_verify_and_update, plain_password, hashed_password)
+    return verified
+
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Returns (verified, new_hash); new_hash is set when the stored hash uses outdated settings."""
+    return _run_password_job(_verify_and_update, plain_password, hashed_password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -35,7 +84,52 @@ def create_access_token(data: dict):
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> models.User:
+# Verified user id -> snapshot of the user's profile columns. The JWT signature is
+# still checked on every request; the cache only saves the users-table lookup.
+# Entries are dropped by the profile/password/account handlers in this worker and
+# expire after USER_CACHE_TTL_SECONDS everywhere else.
+user_cache = TTLCache(maxsize=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+_CACHED_USER_FIELDS = ("id", "name", "phonenumber", "email", "profileimage", "address", "created_at")
+
+
+def invalidate_user(user_id: int):
+    user_cache.pop(user_id)
+
+
+def load_user_row(db: Session, current_user: models.User) -> models.User:
+    """Fetch the persistent row for a (possibly cached) current user into db."""
+    user = db.get(models.User, current_user.id)
+    if user is None:
+        invalidate_user(current_user.id)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+
+async def _route_to_shard(request: Request, db, user_id: int):
+    """Send the request's sessions to the user's shard; writes wait while the user is being moved."""
+    shard, moving = await shards.resolve(db, user_id)
+    user_context.note_user(user_id, shard)
+    if moving and request.method not in ("GET", "HEAD", "OPTIONS"):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Your data is being moved, please try again shortly",
+            headers={"Retry-After": "5"},
+        )
+
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme),
+                           db: AsyncSession = Depends(database.get_async_db)) -> models.User:
+    """
+    Resolve the bearer token to a user and route the request to their shard.
+    Cached users come back as detached models.User instances without
+    password_hash; handlers that modify the user must load it into their own
+    session with db.get().
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -43,13 +137,26 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = payload.get("sub")
         email: str = payload.get("email")
-        if email is None:
+        if user_id is None and email is None:
             raise credentials_exception
-    except JWTError:
+        user_id = int(user_id) if user_id is not None else None
+    except (JWTError, ValueError):
         raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    if user_id is not None:
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            await _route_to_shard(request, db, user_id)
+            return models.User(**cached)
+        user = await db.get(models.User, user_id)
+    else:
+        # tokens issued before user ids were added to the claims
+        user = await db.scalar(select(models.User).where(models.User.email == email))
+
     if user is None:
         raise credentials_exception
+    await _route_to_shard(request, db, user.id)
+    user_cache.set(user.id, {field: getattr(user, field) for field in _CACHED_USER_FIELDS})
     return user
@@ -0,0 +1,174 @@
+"""
+Recurring bill reminders.
+
+A reminder is open until its status is "paid". One with a repeat_cycle
+(weekly, monthly or yearly) stands for a series: the stored row is the current
+occurrence and later ones are projected from its due_date. /bill-reminders/upcoming
+works that out at read time; the batch job keeps the stored rows current for
+every user with a few bulk statements:
+
+    python -m app.bill_scheduler run                     # as of today
+    python -m app.bill_scheduler run --today 2025-03-01
+
+It marks open reminders past their due date as "overdue" and moves paid
+recurring reminders on to their next occurrence (status back to "pending").
+Both steps are idempotent, so the job can be run from cron as often as wanted.
+"""
+import argparse
+import calendar
+import heapq
+import os
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import bindparam, select, update
+
+from app import models, rollups, shards
+
+CYCLES = ("weekly", "monthly", "yearly")
+BILL_SCHEDULER_BATCH_SIZE = int(os.getenv("BILL_SCHEDULER_BATCH_SIZE", "5000"))
+
+
+def add_months(day: date, months: int) -> date:
+    """Same day of the month `months` later, clamped to the last day of shorter months."""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def next_due(day: date, cycle: str):
+    """The occurrence after `day` for a repeat_cycle, or None if the bill does not repeat."""
+    if cycle == "weekly":
+        return day + timedelta(days=7)
+    if cycle == "monthly":
+        return add_months(day, 1)
+    if cycle == "yearly":
+        return add_months(day, 12)
+    return None
+
+
+def _occurrence(bill, due_date, today, projected):
+    return {
+        "bill_id": bill.id,
+        "title": bill.title,
+        "amount": bill.amount,
+        "due_date": due_date,
+        "repeat_cycle": bill.repeat_cycle,
+        "status": "pending" if projected else bill.status,
+        "overdue": due_date < today,
+        "projected": projected,
+        "days_until": (due_date - today).days,
+    }
+
+
+def _series(bill, today, horizon):
+    yield _occurrence(bill, bill.due_date, today, projected=False)
+    due = next_due(bill.due_date, bill.repeat_cycle)
+    while due is not None and due <= horizon:
+        # an overdue bill is listed once; cycles missed since then are not repeated
+        if due >= today:
+            yield _occurrence(bill, due, today, projected=True)
+        due = next_due(due, bill.repeat_cycle)
+
+
+def expand_upcoming(bills, today: date, horizon: date):
+    """
+    Occurrences of the open `bills` (rows with id, title, amount, due_date,
+    repeat_cycle, status) due on or before `horizon`, soonest first. Each bill
+    yields its own ascending series; a min-heap merges them lazily.
+    """
+    return heapq.merge(*(_series(bill, today, horizon) for bill in bills), key=lambda item: item["due_date"])
+
+
+def upcoming_query(user_id: int, horizon: date):
+    """Open reminders due by `horizon`; matches the ix_bill_reminders_open_user_due partial index."""
+    bill = models.BillReminder
+    return (
+        select(bill.id, bill.title, bill.amount, bill.due_date, bill.repeat_cycle, bill.status)
+        .where(bill.user_id == user_id, bill.status != "paid", bill.due_date <= horizon)
+        .order_by(bill.due_date, bill.id)
+    )
+
+
+def _mark_overdue(db, today, skip_users=()):
+    bill = models.BillReminder
+    count, user_ids = 0, set()
+    while True:
+        batch = (
+            select(bill.id)
+            .where(bill.status == "pending", bill.due_date < today, bill.user_id.not_in(skip_users))
+            .limit(BILL_SCHEDULER_BATCH_SIZE)
+            .scalar_subquery()
+        )
+        result = db.execute(
+            update(bill).where(bill.id.in_(batch)).values(status="overdue").returning(bill.user_id),
+            execution_options={"synchronize_session": False},
+        )
+        changed = result.scalars().all()
+        db.commit()
+        if not changed:
+            return count, user_ids
+        count += len(changed)
+        user_ids.update(changed)
+
+
+def _roll_forward(db, skip_users=()):
+    bill = models.BillReminder
+    count, user_ids = 0, set()
+    stmt = (
+        update(bill.__table__)
+        .where(bill.__table__.c.id == bindparam("bill_id"))
+        .values(due_date=bindparam("next_due"), status="pending")
+    )
+    while True:
+        rows = db.execute(
+            select(bill.id, bill.user_id, bill.due_date, bill.repeat_cycle)
+            .where(bill.status == "paid", bill.repeat_cycle.in_(CYCLES), bill.user_id.not_in(skip_users))
+            .order_by(bill.due_date)
+            .limit(BILL_SCHEDULER_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return count, user_ids
+        db.execute(stmt, [
+            {"bill_id": row.id, "next_due": next_due(row.due_date, row.repeat_cycle)} for row in rows
+        ])
+        db.commit()
+        count += len(rows)
+        user_ids.update(row.user_id for row in rows)
+
+
+def run(today: date = None, out=sys.stdout) -> dict:
+    """
+    Roll paid recurring reminders forward, then mark overdue ones, for all
+    users on every shard. Users being moved between shards are skipped; the
+    next run picks them up.
+    """
+    today = today or date.today()
+    rolled = overdue = 0
+    user_ids = set()
+    with shards.session_for(shards.DIRECTORY) as directory:
+        moving = shards.moving_user_ids(directory)
+    for shard in shards.shard_ids():
+        with shards.session_for(shard) as db:
+            shard_rolled, rolled_users = _roll_forward(db, moving)
+            shard_overdue, overdue_users = _mark_overdue(db, today, moving)
+            shard_users = rolled_users | overdue_users
+            if shard_users:
+                db.execute(rollups.bills_version_upsert(), [{"user_id": user_id} for user_id in sorted(shard_users)])
+                db.commit()
+        rolled += shard_rolled
+        overdue += shard_overdue
+        user_ids |= shard_users
+    result = {"rolled_forward": rolled, "marked_overdue": overdue, "users": len(user_ids)}
+    print(f"{rolled} rolled forward, {overdue} marked overdue, {len(user_ids)} user(s) affected", file=out)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="process every user's due bill reminders")
+    run_parser.add_argument("--today", type=date.fromisoformat, help="treat this date (YYYY-MM-DD) as today")
+    args = parser.parse_args()
+
+    run(today=args.today)
@@ -0,0 +1,155 @@
+import csv
+import json
+import os
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError
+
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", "1000"))
+# Only the first errors are listed in the report; the failed count keeps going
+BULK_IMPORT_MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", "1000"))
+
+
+def _body_format(request: Request) -> str:
+    content_type = request.headers.get("content-type", "").lower()
+    if "csv" in content_type:
+        return "csv"
+    if "ndjson" in content_type or "jsonl" in content_type or "json-seq" in content_type:
+        return "ndjson"
+    raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson")
+
+
+async def _iter_lines(request: Request):
+    """Yield decoded lines from the request body as it streams in."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig", errors="replace").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8-sig", errors="replace").rstrip("\r")
+
+
+async def _iter_csv_records(request: Request):
+    header = None
+    record_lines = []
+    row_number = 0
+    async for line in _iter_lines(request):
+        record_lines.append(line)
+        # an odd number of quotes means a quoted field continues on the next line
+        if sum(part.count('"') for part in record_lines) % 2:
+            continue
+        text = "\n".join(record_lines)
+        record_lines = []
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row_number += 1
+        if len(values) != len(header):
+            yield row_number, None, f"expected {len(header)} columns, got {len(values)}"
+            continue
+        yield row_number, {name: (value if value != "" else None) for name, value in zip(header, values)}, None
+
+
+async def _iter_ndjson_records(request: Request):
+    row_number = 0
+    async for line in _iter_lines(request):
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield row_number, None, f"invalid JSON: {exc}"
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, "expected a JSON object"
+            continue
+        yield row_number, record, None
+
+
+class _ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < BULK_IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def as_dict(self):
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def _insert_chunk(db, model, chunk, report, on_insert=None, prepare=None):
+    """Insert one chunk in its own transaction; on a database error fall back to row-by-row to pinpoint bad rows."""
+    rows = [row for _, row in chunk]
+    if prepare:
+        await prepare(rows)
+    try:
+        await db.execute(insert(model), rows)
+        if on_insert:
+            await on_insert(rows)
+        await db.commit()
+        report.inserted += len(rows)
+        return
+    except DBAPIError:
+        await db.rollback()
+
+    for row_number, row in chunk:
+        try:
+            await db.execute(insert(model), [row])
+            if on_insert:
+                await on_insert([row])
+            await db.commit()
+            report.inserted += 1
+        except DBAPIError as exc:
+            await db.rollback()
+            report.fail(row_number, str(exc.orig).strip())
+
+
+async def import_records(request: Request, db, schema, model, to_row, on_insert=None, prepare=None) -> dict:
+    """
+    Stream a CSV (header row required) or NDJSON body, validate each record with
+    `schema`, and insert valid rows in chunks of BULK_IMPORT_CHUNK_SIZE using
+    multi-row INSERTs, one transaction per chunk. `to_row` maps a validated item
+    to a column dict; `prepare(rows)` may fill in further columns before each
+    chunk is inserted; `on_insert(rows)` runs inside each chunk's transaction.
+    """
+    body_format = _body_format(request)
+    records = _iter_csv_records(request) if body_format == "csv" else _iter_ndjson_records(request)
+
+    report = _ImportReport()
+    chunk = []
+    async for row_number, record, error in records:
+        if error:
+            report.fail(row_number, error)
+            continue
+        try:
+            item = schema.model_validate(record)
+        except ValidationError as exc:
+            report.fail(row_number, "; ".join(
+                f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in exc.errors()
+            ))
+            continue
+        chunk.append((row_number, to_row(item)))
+        if len(chunk) >= BULK_IMPORT_CHUNK_SIZE:
+            await _insert_chunk(db, model, chunk, report, on_insert, prepare)
+            chunk = []
+
+    if chunk:
+        await _insert_chunk(db, model, chunk, report, on_insert, prepare)
+    return report.as_dict()
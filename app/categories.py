@@ -0,0 +1,133 @@
+"""
+Expense categories.
+
+Expenses reference their category by id (expenses.category_id) and keep the
+name in expenses.category as well, so the API's string `category` field and
+old clients keep working. Names are mapped to ids with one query per request
+(cached per process where the caller knows the user's data_version); writes
+create unknown names on the fly.
+
+Rows written by code that predates category_id can be linked afterwards:
+
+    python -m app.categories backfill
+"""
+import argparse
+import os
+import sys
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import database, models, shards
+from app.cache import TTLCache
+
+CATEGORY_CACHE_TTL_SECONDS = float(os.getenv("CATEGORY_CACHE_TTL_SECONDS", "300"))
+CATEGORY_CACHE_MAX_SIZE = int(os.getenv("CATEGORY_CACHE_MAX_SIZE", "50000"))
+BACKFILL_BATCH_SIZE = 10_000
+
+# (user_id, data_version, name) -> category id. Renaming or deleting a category
+# bumps the user's data_version, so no server worker can hit a stale entry.
+category_cache = TTLCache(maxsize=CATEGORY_CACHE_MAX_SIZE, ttl=CATEGORY_CACHE_TTL_SECONDS)
+
+
+async def _lookup(db, user_id: int, names) -> dict:
+    result = await db.execute(
+        select(models.Category.name, models.Category.id)
+        .where(models.Category.user_id == user_id, models.Category.name.in_(names))
+    )
+    return dict(result.all())
+
+
+async def _create(user_id: int, names):
+    # in a session of its own, so the caller's pending work is not committed
+    # early; it routes to the request user's shard like the caller's
+    insert = postgresql.insert if database.engine.dialect.name == "postgresql" else sqlite.insert
+    async with database.open_async_session() as own:
+        await own.execute(
+            insert(models.Category)
+            .values([{"user_id": user_id, "name": name, "created_at": func.now()} for name in names])
+            .on_conflict_do_nothing(index_elements=[models.Category.user_id, models.Category.name])
+        )
+        await own.commit()
+
+
+async def resolve_category_ids(db, user_id: int, names, create: bool = True, data_version: int = None) -> dict:
+    """
+    Map category names to ids for one user, with one query for all names not
+    cached. The cache is only used with the user's current `data_version`.
+    Missing categories are created and committed separately when `create` is
+    set, so the caller's transaction is left alone.
+    """
+    names = {name for name in names if name is not None}
+    ids = {}
+    missing = []
+    for name in names:
+        category_id = category_cache.get((user_id, data_version, name)) if data_version is not None else None
+        if category_id is None:
+            missing.append(name)
+        else:
+            ids[name] = category_id
+
+    if missing:
+        found = await _lookup(db, user_id, missing)
+        new_names = [name for name in missing if name not in found]
+        if new_names and create:
+            await _create(user_id, new_names)
+            found.update(await _lookup(db, user_id, new_names))
+        for name, category_id in found.items():
+            if data_version is not None:
+                category_cache.set((user_id, data_version, name), category_id)
+            ids[name] = category_id
+    return ids
+
+
+async def resolve_category_id(db, user_id: int, name, create: bool = True, data_version: int = None):
+    if name is None:
+        return None
+    return (await resolve_category_ids(db, user_id, [name], create, data_version)).get(name)
+
+
+def backfill(batch_size: int = BACKFILL_BATCH_SIZE, out=sys.stdout) -> int:
+    """
+    Create missing categories and set category_id on expenses that lack it,
+    one id range per transaction, on every shard.
+    """
+    linked = sum(_backfill_shard(shard, batch_size) for shard in shards.shard_ids())
+    print(f"{linked} expense(s) linked", file=out)
+    return linked
+
+
+def _backfill_shard(shard: int, batch_size: int) -> int:
+    linked = 0
+    with shards.session_for(shard) as db:
+        db.execute(text("""
+            INSERT INTO categories (user_id, name, created_at)
+            SELECT DISTINCT e.user_id, e.category, CURRENT_TIMESTAMP
+            FROM expenses e
+            WHERE e.category IS NOT NULL AND e.category_id IS NULL
+              AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.user_id = e.user_id AND c.name = e.category)
+        """))
+        db.commit()
+        low, high = db.execute(select(func.min(models.Expense.id), func.max(models.Expense.id))).one()
+        if low is None:
+            return 0
+        for start in range(low, high + 1, batch_size):
+            result = db.execute(text("""
+                UPDATE expenses
+                SET category_id = (SELECT c.id FROM categories c
+                                   WHERE c.user_id = expenses.user_id AND c.name = expenses.category)
+                WHERE id >= :start AND id < :stop AND category IS NOT NULL AND category_id IS NULL
+            """), {"start": start, "stop": start + batch_size})
+            db.commit()
+            linked += result.rowcount
+    return linked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = sub.add_parser("backfill", help="link expenses to categories by name")
+    backfill_parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+
+    backfill(batch_size=args.batch_size)
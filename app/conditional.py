@@ -0,0 +1,47 @@
+"""Helpers for conditional GET: ETag generation and If-None-Match handling."""
+import hashlib
+
+from fastapi import Request, Response
+
+# clients may keep the body but must revalidate before reusing it
+REVALIDATE = "private, no-cache"
+
+
+def make_etag(*parts, weak: bool = True) -> str:
+    digest = hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()[:32]
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """Weak comparison as specified for If-None-Match (RFC 9110, 13.1.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(_opaque(candidate) == _opaque(etag) for candidate in if_none_match.split(","))
+
+
+def not_modified(etag: str, headers: dict = None) -> Response:
+    return Response(status_code=304, headers={**(headers or {}), "ETag": etag})
+
+
+def version_etag(request: Request, resource: str, user_id: int, version: int) -> str:
+    """ETag for a per-user resource at a given write version, specific to the query parameters."""
+    return make_etag(resource, user_id, version, sorted(request.query_params.multi_items()))
+
+
+def check_not_modified(request: Request, response: Response, etag: str):
+    """
+    Put the validator on `response`. Returns a 304 response to send instead
+    when the client's If-None-Match already matches, otherwise None.
+    """
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag, {"Cache-Control": REVALIDATE})
+    return None
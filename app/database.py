@@ -1,20 +1,293 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.expression import UpdateBase
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
 
+from app import query_diagnostics, replicas, user_context
+from app.pool_metrics import TimedAsyncAdaptedQueuePool, TimedQueuePool, instrument_pool
+from app.request_metrics import instrument_engine
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# "sync" runs the async-style routes on a regular Session via the threadpool;
+# "async" gives them a real AsyncSession on an asyncio driver (asyncpg).
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+
+
+def to_async_url(url: str) -> str:
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# Comma-separated databases holding users' rows besides DATABASE_URL, which is
+# shard 0 and the directory (see app.shards)
+DATABASE_SHARD_URLS = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+ASYNC_DATABASE_SHARD_URLS = [
+    url.strip() for url in os.getenv("ASYNC_DATABASE_SHARD_URLS", "").split(",") if url.strip()
+] or [to_async_url(url) for url in DATABASE_SHARD_URLS]
+
+# Comma-separated read replicas of shard 0 for the read-only handlers (see app.replicas)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+ASYNC_DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("ASYNC_DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+] or [to_async_url(url) for url in DATABASE_REPLICA_URLS]
+
+# Connection pool settings, per engine and per server worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+def pool_options(url: str, asynchronous: bool = False) -> dict:
+    if url.startswith("sqlite"):
+        # local development database; keep SQLAlchemy's sqlite pooling defaults
+        return {}
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if asynchronous else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _instrument(engine, name: str):
+    instrument_pool(engine, name)
+    instrument_engine(engine, name)
+    query_diagnostics.install(engine, name)
+
+
+class RoutingSession(Session):
+    """
+    Session that picks the database per statement:
+
+    - the users and user_shards tables always live in the directory database
+      (DATABASE_URL);
+    - everything else lives on the shard of info["shard"] if given, else of
+      the request's user (see app.shards and app.user_context), else shard 0;
+    - on shard 0, sessions created with info={"read_only": True} run their
+      reads on a replica when one is usable (see app.replicas). Flushes and
+      INSERT/UPDATE/DELETE statements still go to the primary, and a session
+      sticks to the replica it picked first. A read whose replica goes down
+      under it runs once more on the primary, as do the rest of the session's.
+
+    Without shards or replicas configured, everything goes to DATABASE_URL.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        directory = super().get_bind(mapper, clause=clause, **kwargs)
+        asynchronous = directory is not engine
+        if _table_name(mapper, clause) in DIRECTORY_TABLES:
+            return directory
+        shard = self.info.get("shard")
+        if shard is None:
+            shard = user_context.current_shard() or 0
+        if shard:
+            return async_shard_engines[shard].sync_engine if asynchronous else shard_engines[shard]
+        if not self.info.get("read_only") or self._flushing or isinstance(clause, UpdateBase):
+            return directory
+        if "replica" not in self.info:
+            self.info["replica"] = replicas.choose_for_read()
+        replica = self.info["replica"]
+        if replica is None:
+            return directory
+        return replica.async_engine.sync_engine if asynchronous else replica.engine
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _read_on_primary_after_replica_failure(state):
+    if not state.is_select or not state.session.info.get("read_only") or not replicas.replica_set:
+        return None
+    try:
+        return state.invoke_statement()
+    except DBAPIError:
+        # the replica's handle_error hook has marked it down if it was a
+        # disconnect or a failure to connect; anything else is the query's fault
+        replica = state.session.info.get("replica")
+        if replica is None or replica.healthy:
+            raise
+    # no rollback: it would expire what the session has loaded so far. The
+    # dropped replica connection is released when the session is closed
+    state.session.info["replica"] = None
+    replicas.read_sessions_total.inc(target="primary", reason="replica_failed")
+    return state.invoke_statement()
+
+
+DIRECTORY_TABLES = ("users", "user_shards")
+
+
+def _table_name(mapper, clause):
+    if mapper is not None:
+        return getattr(mapper.persist_selectable, "name", None)
+    return getattr(getattr(clause, "table", None), "name", None)
+
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
+_instrument(engine, "primary")
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = None
+if DB_MODE == "async":
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, asynchronous=True))
+    _instrument(async_engine, "primary_async")
+# expire_on_commit=False: attribute access after commit must not trigger implicit I/O
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False
+)
+
+# Shard 0 is DATABASE_URL itself
+shard_engines = [engine]
+async_shard_engines = [async_engine]
+for _number, _url in enumerate(DATABASE_SHARD_URLS, start=1):
+    _shard_engine = create_engine(_url, **pool_options(_url))
+    _instrument(_shard_engine, f"shard{_number}")
+    shard_engines.append(_shard_engine)
+    _shard_async_engine = None
+    if DB_MODE == "async":
+        _async_url = ASYNC_DATABASE_SHARD_URLS[_number - 1]
+        _shard_async_engine = create_async_engine(_async_url, **pool_options(_async_url, asynchronous=True))
+        _instrument(_shard_async_engine, f"shard{_number}_async")
+    async_shard_engines.append(_shard_async_engine)
+
+for _number, _url in enumerate(DATABASE_REPLICA_URLS):
+    _replica_engine = create_engine(_url, **pool_options(_url))
+    _instrument(_replica_engine, f"replica{_number}")
+    _replica_async_engine = None
+    if DB_MODE == "async":
+        _async_url = ASYNC_DATABASE_REPLICA_URLS[_number]
+        _replica_async_engine = create_async_engine(_async_url, **pool_options(_async_url, asynchronous=True))
+        _instrument(_replica_async_engine, f"replica{_number}_async")
+    replicas.replica_set.add(f"replica{_number}", _replica_engine, _replica_async_engine)
+if DATABASE_REPLICA_URLS:
+    replicas.track_writes(engine)
+    if async_engine is not None:
+        replicas.track_writes(async_engine)
+
+ReadSessionLocal = sessionmaker(
+    class_=RoutingSession, autocommit=False, autoflush=False, bind=engine, info={"read_only": True}
+)
+AsyncReadSessionLocal = async_sessionmaker(
+    async_engine, sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False,
+    info={"read_only": True},
+)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+class SyncSessionAdapter:
+    """
+    The subset of the AsyncSession API used by the routes, backed by a regular
+    Session whose blocking calls are sent to the threadpool. Lets the same
+    `async def` handlers run when DB_MODE=sync. The session must be made with
+    expire_on_commit=False, like AsyncSessionLocal: attributes read on the
+    event loop after a commit must not lazy-load.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    @property
+    def info(self):
+        return self.sync_session.info
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def scalars(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalars, statement, params, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+@asynccontextmanager
+async def open_async_session():
+    """A session for async code in either DB_MODE, closed on exit."""
+    if DB_MODE == "async":
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SyncSessionAdapter(SessionLocal(expire_on_commit=False))
+        try:
+            yield db
+        finally:
+            await db.close()
+
+
+async def get_async_db():
+    async with open_async_session() as db:
+        yield db
+
+
+def get_read_db():
+    """Like get_db, for handlers that only read: queries may run on a replica."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    """Like get_async_db, for handlers that only read: queries may run on a replica."""
+    if DB_MODE == "async":
+        async with AsyncReadSessionLocal() as db:
+            yield db
+    else:
+        db = SyncSessionAdapter(ReadSessionLocal(expire_on_commit=False))
+        try:
+            yield db
+        finally:
+            await db.close()
@@ -1,28 +1,45 @@
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from app import models, database
 # import auth route here
 from app.routes import auth, users, expenses, incomes, bill_reminders, summary
-from fastapi.middleware.cors import CORSMiddleware
-from app.routes import reports
+from app.routes import internal, categories, metrics
+from app.middleware import install_middleware
+
+# "local" serves /reports from this app. "remote" leaves it to app.reports_main,
+# run as a separate worker class behind the same proxy, so API workers never
+# load the report stack.
+REPORTS_ROUTER = os.getenv("REPORTS_ROUTER", "local").lower()
+# Load the PDF toolchain at startup instead of on the first PDF report
+REPORTS_PRELOAD = os.getenv("REPORTS_PRELOAD", "false").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if REPORTS_ROUTER == "local" and REPORTS_PRELOAD:
+        from app.pdf_report import preload
+        preload()
+    yield
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["https://etvel.netlify.app"],  # React dev server
-    # allow_origins=["*"],  # Local React dev server
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+install_middleware(app)
 
 app.include_router(auth.router)     # include auth
 app.include_router(users.router)    # include user routes (optional for now)
 app.include_router(expenses.router)
+app.include_router(categories.router)
 app.include_router(incomes.router)
 app.include_router(bill_reminders.router)
 app.include_router(summary.router)
-app.include_router(reports.router)
+if REPORTS_ROUTER == "local":
+    from app.routes import reports
+    app.include_router(reports.router)
+app.include_router(internal.router)
+app.include_router(metrics.router)
 
 
 @app.get("/")
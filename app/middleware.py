@@ -0,0 +1,25 @@
+from fastapi.middleware.cors import CORSMiddleware
+
+from app.pagination import NEXT_CURSOR_HEADER
+from app.query_diagnostics import QueryDiagnosticsMiddleware
+from app.replicas import ReadYourWritesMiddleware
+from app.request_metrics import RequestMetricsMiddleware
+from app.user_context import UserContextMiddleware
+
+
+def install_middleware(app):
+    """The middleware stack shared by the API app (app.main) and the reports app (app.reports_main)."""
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["https://etvel.netlify.app"],  # React dev server
+        # allow_origins=["*"],  # Local React dev server
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
+    )
+    app.add_middleware(ReadYourWritesMiddleware)
+    app.add_middleware(UserContextMiddleware)
+    app.add_middleware(QueryDiagnosticsMiddleware)
+    # added last so it is outermost and times everything, CORS included
+    app.add_middleware(RequestMetricsMiddleware)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Numeric, Date, Text, ForeignKey, TIMESTAMP
+from sqlalchemy import Column, Integer, BigInteger, Boolean, String, Numeric, Date, Text, ForeignKey, TIMESTAMP, Index, UniqueConstraint, text
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import datetime
@@ -33,6 +33,11 @@ class Income(Base):
 
     user = relationship("User", back_populates="incomes")
 
+    __table_args__ = (
+        # per-user listing, keyset pagination and date-range reports
+        Index("ix_incomes_user_date_id", "user_id", "received_date", "id"),
+    )
+
 
 class Expense(Base):
     __tablename__ = "expenses"
@@ -41,12 +46,21 @@ class Expense(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     title = Column(String(255), nullable=False)
     amount = Column(Numeric(10, 2), nullable=False)
+    # the category's name, kept alongside category_id for the API's string field
     category = Column(String(100))
+    category_id = Column(Integer, ForeignKey("categories.id", ondelete="SET NULL"))
     expense_date = Column(Date, nullable=False)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
 
     user = relationship("User", back_populates="expenses")
 
+    __table_args__ = (
+        # per-user listing, keyset pagination and date-range reports
+        Index("ix_expenses_user_date_id", "user_id", "expense_date", "id"),
+        # category filters and per-category breakdowns
+        Index("ix_expenses_user_category_date", "user_id", "category_id", "expense_date"),
+    )
+
 
 class BillReminder(Base):
     __tablename__ = "bill_reminders"
@@ -63,6 +77,19 @@ class BillReminder(Base):
 
     user = relationship("User", back_populates="reminders")
 
+    __table_args__ = (
+        Index("ix_bill_reminders_user_due_id", "user_id", "due_date", "id"),
+        # open (unpaid) reminders, pending ones included: /bill-reminders/upcoming per user, the overdue sweep
+        Index("ix_bill_reminders_open_user_due", "user_id", "due_date", postgresql_where=text("status <> 'paid'")),
+        Index("ix_bill_reminders_open_due", "due_date", postgresql_where=text("status <> 'paid'")),
+        # paid occurrences of recurring bills, waiting to be rolled forward by app.bill_scheduler
+        Index(
+            "ix_bill_reminders_paid_recurring",
+            "due_date",
+            postgresql_where=text("status = 'paid' AND repeat_cycle IN ('weekly', 'monthly', 'yearly')"),
+        ),
+    )
+
 
 class Category(Base):
     __tablename__ = "categories"
@@ -74,3 +101,34 @@ class Category(Base):
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
 
     user = relationship("User", back_populates="categories")
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "name", name="uq_categories_user_name"),
+    )
+
+
+# Running totals per user, updated in the same transaction as every income/expense
+# write (see app/rollups.py) so /summary/ is a primary-key lookup.
+class UserTotals(Base):
+    __tablename__ = "user_totals"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    total_income = Column(Numeric(14, 2), nullable=False, default=0)
+    total_expenses = Column(Numeric(14, 2), nullable=False, default=0)
+    # bumped on every income/expense write; cache keys derived from it change with the data
+    data_version = Column(BigInteger, nullable=False, default=0)
+    # same for bill reminder writes
+    bills_version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Which database holds a user's rows (see app/shards.py); users without a row
+# are on shard 0. Lives in the directory database next to users.
+class UserShard(Base):
+    __tablename__ = "user_shards"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(Integer, nullable=False, default=0)
+    # set while app.shards moves the user; their writes are refused meanwhile
+    moving = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,53 @@
+import base64
+import json
+from datetime import date
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(row_date: date, row_id: int) -> str:
+    raw = json.dumps([row_date.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        row_date, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return date.fromisoformat(row_date), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def apply_keyset(query, date_column, id_column, cursor=None, order="desc", limit=None):
+    """
+    Order a query by (date, id) and seek past the cursor instead of using OFFSET,
+    so every page is an index range scan no matter how deep the client scrolls.
+    Fetches one extra row so split_page can tell whether another page exists.
+    """
+    key = tuple_(date_column, id_column)
+    if cursor:
+        cursor_key = decode_cursor(cursor)
+        query = query.where(key < cursor_key if order == "desc" else key > cursor_key)
+
+    if order == "desc":
+        query = query.order_by(date_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(date_column.asc(), id_column.asc())
+
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query
+
+
+def split_page(rows, limit, date_attr):
+    """Trim the look-ahead row and build the cursor for the next page, if any."""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, date_attr), last.id)
@@ -0,0 +1,116 @@
+"""
+Chunked PDF rendering for reports.
+
+xhtml2pdf is slow and single-threaded, and its cost grows faster than linearly
+with document size. Rows are therefore cut into page-sized chunks, each chunk
+is rendered to its own small PDF on a process pool, and the pieces are
+concatenated in order with pypdf. The request thread only waits on futures.
+"""
+import html
+import os
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from io import BytesIO
+
+from app.workers import BoundedPool, PoolOverloaded
+
+PDF_ROWS_PER_CHUNK = int(os.getenv("PDF_ROWS_PER_CHUNK", "400"))
+PDF_MAX_ROWS = int(os.getenv("PDF_MAX_ROWS", "50000"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_MAX_PENDING = int(os.getenv("PDF_MAX_PENDING", "8"))
+PDF_CHUNK_TIMEOUT_SECONDS = float(os.getenv("PDF_CHUNK_TIMEOUT_SECONDS", "60"))
+
+pdf_pool = BoundedPool("pdf_rendering", max_workers=PDF_WORKERS, max_pending=PDF_MAX_PENDING)
+
+_TABLE_HEADER = "<table border='1'><tr><th>Type</th><th>Amount</th><th>Source/Title</th><th>Date</th></tr>"
+
+
+def _cell(value) -> str:
+    return "" if value is None else html.escape(str(value))
+
+
+def render_chunk(rows, title=None) -> bytes:
+    """Render one chunk of (type, amount, source/title, date) rows as a standalone PDF."""
+    from xhtml2pdf import pisa
+
+    parts = []
+    if title:
+        parts.append(f"<h2>{html.escape(title)}</h2>")
+    parts.append(_TABLE_HEADER)
+    parts.extend(
+        f"<tr><td>{_cell(kind)}</td><td>{_cell(amount)}</td><td>{_cell(label)}</td><td>{_cell(day)}</td></tr>"
+        for kind, amount, label, day in rows
+    )
+    parts.append("</table>")
+
+    output = BytesIO()
+    pisa.CreatePDF("".join(parts), dest=output)
+    return output.getvalue()
+
+
+def preload():
+    """
+    Import xhtml2pdf and pypdf now rather than on the first report; they take
+    about a second and tens of MB to load. Pool workers forked afterwards
+    inherit them.
+    """
+    import pypdf  # noqa: F401 - imported only to load it
+    import xhtml2pdf.pisa  # noqa: F401 - imported only to load it
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def render_pdf(rows, title="Expense Tracker Report") -> BytesIO:
+    """
+    Render `rows` (any iterable, consumed lazily) into one PDF. At most
+    PDF_WORKERS chunks of a report are in flight at once, so a single large
+    report cannot take every slot of the shared pool. Raises
+    app.workers.PoolOverloaded when the pool is saturated.
+    """
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    in_flight = deque()
+    window = max(PDF_WORKERS, 1)
+
+    def submit(chunk, chunk_title):
+        if PDF_WORKERS == 0:
+            future = Future()
+            future.set_result(render_chunk(chunk, chunk_title))
+            return future
+        return pdf_pool.submit(render_chunk, chunk, chunk_title)
+
+    def collect_oldest():
+        try:
+            pdf_bytes = in_flight.popleft().result(timeout=PDF_CHUNK_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            raise PoolOverloaded("PDF chunk did not finish in time")
+        writer.append(BytesIO(pdf_bytes))
+
+    try:
+        for index, chunk in enumerate(_chunks(rows, PDF_ROWS_PER_CHUNK)):
+            in_flight.append(submit(chunk, title if index == 0 else None))
+            if len(in_flight) >= window:
+                collect_oldest()
+        while in_flight:
+            collect_oldest()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+    if not writer.pages:
+        writer.append(BytesIO(render_chunk([], title)))
+
+    output = BytesIO()
+    writer.write(output)
+    output.seek(0)
+    return output
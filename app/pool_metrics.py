@@ -0,0 +1,107 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.metrics import Counter, Gauge, Histogram
+
+pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    ["pool"],
+)
+pool_connections_opened = Counter("db_pool_connections_opened_total", "New DBAPI connections", ["pool"])
+pool_connections_closed = Counter("db_pool_connections_closed_total", "Closed DBAPI connections", ["pool"])
+pool_connections_invalidated = Counter(
+    "db_pool_connections_invalidated_total", "Connections discarded as broken or stale", ["pool"]
+)
+pool_checkouts = Counter("db_pool_checkouts_total", "Connection checkouts", ["pool"])
+pool_timeouts = Counter("db_pool_timeouts_total", "Checkouts that gave up after pool_timeout", ["pool"])
+pool_waiting = Gauge("db_pool_waiting", "Checkouts waiting for a connection to be returned", ["pool"])
+
+_engines = {}
+
+
+class _TimedCheckoutMixin:
+    # SQLAlchemy has no "before checkout" event, so the wait for a free slot is
+    # measured around the pool's own get.
+    _metrics_name = "default"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        # no idle connection and no room to open one: this checkout queues
+        queued = self.checkedin() == 0 and 0 <= self._max_overflow <= self.overflow()
+        if queued:
+            pool_waiting.inc(pool=self._metrics_name)
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            pool_timeouts.inc(pool=self._metrics_name)
+            raise
+        finally:
+            if queued:
+                pool_waiting.dec(pool=self._metrics_name)
+            pool_checkout_wait.observe(time.perf_counter() - start, pool=self._metrics_name)
+
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_pool(engine, name: str):
+    """Attach the metric listeners to an engine's pool and register it for pool_stats()."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    pool = sync_engine.pool
+    pool._metrics_name = name
+    _engines[name] = sync_engine
+
+    @event.listens_for(pool, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        pool_connections_opened.inc(pool=name)
+
+    @event.listens_for(pool, "close")
+    def _on_close(dbapi_connection, connection_record):
+        pool_connections_closed.inc(pool=name)
+
+    @event.listens_for(pool, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        pool_connections_invalidated.inc(pool=name)
+
+    @event.listens_for(pool, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_checkouts.inc(pool=name)
+
+
+def pool_stats() -> dict:
+    stats = {}
+    for name, engine in _engines.items():
+        pool = engine.pool
+        entry = {"status": pool.status()}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                waiting=pool_waiting.snapshot().get((name,), 0),
+            )
+        entry.update(
+            checkouts=pool_checkouts.snapshot().get((name,), 0),
+            timeouts=pool_timeouts.snapshot().get((name,), 0),
+            opened=pool_connections_opened.snapshot().get((name,), 0),
+            closed=pool_connections_closed.snapshot().get((name,), 0),
+            invalidated=pool_connections_invalidated.snapshot().get((name,), 0),
+            checkout_wait_seconds=pool_checkout_wait.summary(pool=name),
+        )
+        stats[name] = entry
+    return stats
+
+
+def waiting() -> int:
+    """Checkouts queued on the busiest pool of this process right now."""
+    return int(max(pool_waiting.snapshot().values(), default=0))
@@ -0,0 +1,32 @@
+"""
+Directories and files only the server's own OS user can read.
+
+Rendered reports and report jobs hold users' financial data and default to
+the shared temp directory, so their directories are created 0700 and their
+files 0600. A directory that already exists must belong to this user; one
+left more open by an older release is tightened.
+"""
+import os
+import stat
+
+
+def ensure_dir(path: str) -> str:
+    """Create `path` (0700) or check an existing one. Raises PermissionError if another user could get at it."""
+    try:
+        os.makedirs(path, mode=0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{path} is not a directory")
+    if hasattr(os, "geteuid"):
+        if info.st_uid != os.geteuid():
+            raise PermissionError(f"{path} belongs to another user; set a directory of this user's instead")
+        if info.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
+
+
+def open_new(path: str, mode: str = "wb"):
+    """Open `path` for writing, creating it readable and writable by this user only (0600)."""
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), mode)
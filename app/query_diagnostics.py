@@ -0,0 +1,348 @@
+"""
+Slow-query log and repeated-query detector.
+
+Every statement an instrumented engine runs is reduced to a fingerprint: the
+SQL text with literals and expanded IN / VALUES lists collapsed, so
+`WHERE id IN (?, ?, ?)` and `WHERE id IN (?, ?)` count as one statement.
+Fingerprints are recorded per request (on app.request_metrics.RequestStats)
+and, when the request ends, two patterns are flagged:
+
+- n_plus_one: one SELECT fingerprint run QUERY_N_PLUS_ONE_THRESHOLD or more
+  times, typically a query inside a loop over the rows of another one
+  (repeated writes, such as bulk-import chunks, are batching by design);
+- duplicate: the same statement with the same parameters run
+  QUERY_DUPLICATE_THRESHOLD or more times, i.e. work the handler could reuse.
+
+Statements slower than SLOW_QUERY_MS are logged to the "app.slow_query"
+logger with the database's plan. Bound parameters (emails, password hashes,
+amounts...) are left out unless SLOW_QUERY_LOG_PARAMS is set. The plan is
+fetched on a background thread (the "query_explain" pool, see
+/internal/workers) over a separate, unpooled connection, so the slow request
+does not also wait for EXPLAIN and a failing EXPLAIN cannot break its
+transaction. Each fingerprint is explained at most once per
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS; when the pool is busy the query is
+logged without its plan.
+
+Totals per fingerprint are kept in process (bounded by
+QUERY_STATS_MAX_FINGERPRINTS) and served, worst first, by
+GET /internal/queries.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.request_metrics import RequestStats, current_request, route_template
+from app.workers import BoundedPool, PoolOverloaded
+
+QUERY_DIAGNOSTICS = os.getenv("QUERY_DIAGNOSTICS", "true").lower() in ("1", "true", "yes")
+QUERY_N_PLUS_ONE_THRESHOLD = int(os.getenv("QUERY_N_PLUS_ONE_THRESHOLD", "5"))
+QUERY_DUPLICATE_THRESHOLD = int(os.getenv("QUERY_DUPLICATE_THRESHOLD", "3"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_PARAMS = os.getenv("SLOW_QUERY_LOG_PARAMS", "false").lower() in ("1", "true", "yes")
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() in ("1", "true", "yes")
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", "300"))
+QUERY_STATS_MAX_FINGERPRINTS = int(os.getenv("QUERY_STATS_MAX_FINGERPRINTS", "1000"))
+
+MAX_LOGGED_PARAMS_CHARS = 2000
+MAX_FLAGGED_ROUTES = 10
+
+slow_query_log = logging.getLogger("app.slow_query")
+repeated_query_log = logging.getLogger("app.repeated_query")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+# ? (sqlite), %s / %(name)s (psycopg2), $1 (asyncpg), :name (text())
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)"
+_PLACEHOLDER_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)")
+_VALUES_LIST = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def normalize(statement: str) -> str:
+    """SQL text with literals replaced by ? and placeholder lists collapsed to (...)."""
+    text = _WHITESPACE.sub(" ", statement).strip()
+    text = _STRING_LITERAL.sub("?", text)
+    text = _NUMBER_LITERAL.sub("?", text)
+    text = _PLACEHOLDER_LIST.sub("(...)", text)
+    return _VALUES_LIST.sub(r"\1", text)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    return hashlib.sha1(normalize(statement).encode()).hexdigest()[:16]
+
+
+class _QueryTotals:
+    __slots__ = ("statement", "count", "seconds", "max_seconds", "slow", "n_plus_one", "duplicate", "routes")
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.slow = 0
+        # requests in which this fingerprint was flagged
+        self.n_plus_one = 0
+        self.duplicate = 0
+        self.routes = {}
+
+    def as_dict(self, fp):
+        return {
+            "fingerprint": fp,
+            "statement": self.statement,
+            "count": self.count,
+            "total_ms": round(self.seconds * 1000, 3),
+            "mean_ms": round(self.seconds * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "slow": self.slow,
+            "n_plus_one_requests": self.n_plus_one,
+            "duplicate_requests": self.duplicate,
+            "routes": dict(sorted(self.routes.items(), key=lambda item: -item[1])),
+        }
+
+
+explain_pool = BoundedPool("query_explain", max_workers=1, max_pending=16, kind="thread")
+
+_lock = threading.Lock()
+_totals = {}
+_dropped = 0
+_last_explained = {}
+_explain_engines = {}
+
+SORT_KEYS = {
+    "total_time": lambda item: item[1].seconds,
+    "count": lambda item: item[1].count,
+    "max_time": lambda item: item[1].max_seconds,
+    "n_plus_one": lambda item: (item[1].n_plus_one, item[1].seconds),
+    "duplicate": lambda item: (item[1].duplicate, item[1].seconds),
+}
+
+
+def _totals_for(fp, statement):
+    global _dropped
+    entry = _totals.get(fp)
+    if entry is None:
+        if len(_totals) >= QUERY_STATS_MAX_FINGERPRINTS:
+            _dropped += 1
+            return None
+        entry = _totals[fp] = _QueryTotals(normalize(statement))
+    return entry
+
+
+def _params_key(parameters):
+    try:
+        return hash(repr(parameters))
+    except Exception:
+        return None
+
+
+def _format_params(parameters) -> str:
+    if not SLOW_QUERY_LOG_PARAMS:
+        return "<hidden>"
+    text = repr(parameters)
+    return text if len(text) <= MAX_LOGGED_PARAMS_CHARS else text[:MAX_LOGGED_PARAMS_CHARS] + "..."
+
+
+def _explain_engine(sync_engine, asynchronous):
+    # a pool-less twin of the engine: the plan is fetched outside the request's
+    # transaction, without taking one of the request pool's connections
+    engine = _explain_engines.get(sync_engine)
+    if engine is None:
+        url = sync_engine.url
+        if asynchronous:
+            engine = create_async_engine(url, poolclass=NullPool)
+        else:
+            engine = create_engine(url, poolclass=NullPool)
+        _explain_engines[sync_engine] = engine
+    return engine
+
+
+async def _explain_async(engine, sql, parameters):
+    async with engine.connect() as conn:
+        return (await conn.exec_driver_sql(sql, parameters)).all()
+
+
+def explain(sync_engine, statement, parameters, asynchronous=False) -> str:
+    """The plan of `statement` as text, or why it could not be fetched. Blocks; not for the request path."""
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+        return "(not explainable)"
+    prefix = "EXPLAIN QUERY PLAN " if sync_engine.dialect.name == "sqlite" else "EXPLAIN "
+    engine = _explain_engine(sync_engine, asynchronous)
+    try:
+        if asynchronous:
+            # on the explain thread, which has no event loop of its own
+            rows = asyncio.run(_explain_async(engine, prefix + statement, parameters))
+        else:
+            with engine.connect() as conn:
+                rows = conn.exec_driver_sql(prefix + statement, parameters).all()
+    except Exception as exc:
+        return f"(EXPLAIN failed: {exc.__class__.__name__}: {exc})"
+    return "\n".join(" | ".join(str(value) for value in row) for row in rows)
+
+
+def _write_slow_log(where, fp, statement, parameters, elapsed, plan=None):
+    slow_query_log.warning(
+        "slow query %.1f ms (%s) fingerprint=%s\n%s\nparams: %s%s",
+        elapsed * 1000, where, fp, statement, _format_params(parameters),
+        f"\nplan:\n{plan}" if plan is not None else "",
+    )
+
+
+def _explain_and_log(sync_engine, asynchronous, where, fp, statement, parameters, elapsed):
+    plan = explain(sync_engine, statement, parameters, asynchronous)
+    _write_slow_log(where, fp, statement, parameters, elapsed, plan)
+
+
+def _log_slow(sync_engine, asynchronous, fp, statement, parameters, executemany, elapsed, stats):
+    where = f"{stats.method} {stats.route}" if stats is not None else "outside a request"
+    due = False
+    if SLOW_QUERY_EXPLAIN and not executemany:
+        now = time.monotonic()
+        with _lock:
+            due = now - _last_explained.get(fp, float("-inf")) >= SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS
+            if due:
+                _last_explained[fp] = now
+    if due:
+        try:
+            explain_pool.submit(_explain_and_log, sync_engine, asynchronous, where, fp, statement, parameters, elapsed)
+            return
+        except PoolOverloaded:
+            pass
+    _write_slow_log(where, fp, statement, parameters, elapsed)
+
+
+def install(engine, name: str):
+    """Fingerprint, time and check every statement `engine` executes."""
+    if not QUERY_DIAGNOSTICS:
+        return
+    sync_engine = getattr(engine, "sync_engine", engine)
+    asynchronous = sync_engine is not engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._diagnostics_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_diagnostics_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        fp = fingerprint(statement)
+        stats = current_request.get()
+        slow = elapsed * 1000 >= SLOW_QUERY_MS
+
+        with _lock:
+            totals = _totals_for(fp, statement)
+            if totals is not None:
+                totals.count += 1
+                totals.seconds += elapsed
+                totals.max_seconds = max(totals.max_seconds, elapsed)
+                totals.slow += slow
+
+        if stats is not None:
+            if stats.queries is None:
+                stats.queries = {}
+            entry = stats.queries.get(fp)
+            if entry is None:
+                entry = stats.queries[fp] = [statement, 0, {}]
+            entry[1] += 1
+            if not executemany:
+                key = _params_key(parameters)
+                entry[2][key] = entry[2].get(key, 0) + 1
+
+        if slow:
+            _log_slow(sync_engine, asynchronous, fp, statement, parameters, executemany, elapsed, stats)
+
+
+def _is_read(statement: str) -> bool:
+    return statement.lstrip().upper().startswith(("SELECT", "WITH"))
+
+
+def finish_request(stats: RequestStats):
+    """Flag the repeated statements of a finished request, log them and add them to the totals."""
+    if not stats.queries:
+        return
+    where = f"{stats.method} {stats.route}"
+    for fp, (statement, count, by_params) in stats.queries.items():
+        n_plus_one = count >= QUERY_N_PLUS_ONE_THRESHOLD and _is_read(statement)
+        repeats = max(by_params.values(), default=0)
+        duplicate = repeats >= QUERY_DUPLICATE_THRESHOLD
+        if not (n_plus_one or duplicate):
+            continue
+        with _lock:
+            totals = _totals_for(fp, statement)
+            if totals is not None:
+                totals.n_plus_one += n_plus_one
+                totals.duplicate += duplicate
+                if where in totals.routes or len(totals.routes) < MAX_FLAGGED_ROUTES:
+                    totals.routes[where] = totals.routes.get(where, 0) + 1
+        if n_plus_one:
+            repeated_query_log.warning("possible N+1 on %s: %dx fingerprint=%s %s",
+                                       where, count, fp, normalize(statement))
+        if duplicate:
+            repeated_query_log.warning("duplicate query on %s: %dx with the same parameters, fingerprint=%s %s",
+                                       where, repeats, fp, normalize(statement))
+
+
+def top(n: int = 20, order: str = "total_time") -> dict:
+    """The `n` worst fingerprints by `order` (one of SORT_KEYS)."""
+    with _lock:
+        items = sorted(_totals.items(), key=SORT_KEYS[order], reverse=True)[:n]
+        return {
+            "order": order,
+            "fingerprints": len(_totals),
+            "dropped": _dropped,
+            "thresholds": {
+                "slow_query_ms": SLOW_QUERY_MS,
+                "n_plus_one": QUERY_N_PLUS_ONE_THRESHOLD,
+                "duplicate": QUERY_DUPLICATE_THRESHOLD,
+            },
+            "queries": [totals.as_dict(fp) for fp, totals in items],
+        }
+
+
+def reset():
+    global _dropped
+    with _lock:
+        _totals.clear()
+        _last_explained.clear()
+        _dropped = 0
+
+
+class QueryDiagnosticsMiddleware:
+    """
+    Runs finish_request() once the response has been sent. Uses the stats of
+    RequestMetricsMiddleware when that runs outside it, or its own otherwise.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not QUERY_DIAGNOSTICS:
+            await self.app(scope, receive, send)
+            return
+
+        stats = current_request.get()
+        token = None
+        if stats is None:
+            stats = RequestStats(scope["method"], route_template(scope["app"], scope))
+            token = current_request.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if token is not None:
+                current_request.reset(token)
+            finish_request(stats)
@@ -0,0 +1,235 @@
+"""
+Per-user rate limits and load shedding.
+
+Routes take a token from a bucket before they run, through the dependencies
+below:
+
+- limit_crud: the list, detail and write routes, one bucket per user;
+- limit_reports: rendering reports (/reports/stream and POST /reports/jobs),
+  one bucket per user; /reports/full and /range call admit_in_thread() once
+  they know the report is not a 304 revalidation, so those stay free;
+- limit_login: /auth/login, one bucket per client address, and a smaller
+  one per client address and email on top of it, as there is no user yet;
+- limit_register: /auth/register, one bucket per client address.
+
+The client address is the peer of the connection, unless that peer is one of
+TRUSTED_PROXY_IPS (the reverse proxies / load balancers in front of the app,
+"*" for any): then it is the nearest untrusted address in X-Forwarded-For.
+Without it, everyone behind a proxy would share one address.
+
+A bucket holds up to RATE_LIMIT_<BUDGET>_BURST tokens and refills at
+RATE_LIMIT_<BUDGET>_PER_SECOND (0 turns the budget off). An empty bucket
+answers 429 with Retry-After set to the wait for the next token.
+
+Buckets live in the server process (RATE_LIMIT_BACKEND=memory), so with N
+workers a user gets up to N times the budget. RATE_LIMIT_BACKEND=redis keeps
+them in Redis at RATE_LIMIT_REDIS_URL (needs the redis package), shared by
+every worker; when Redis cannot be reached requests are let through.
+
+Load shedding does not depend on the user: while more than
+LOAD_SHED_POOL_WAITERS checkouts are queued on a database pool of this
+process, report requests are refused with 503 + Retry-After, and at twice
+that number every limited route is. Routes stop piling onto a pool whose
+queue would make them time out anyway, cheap routes last.
+"""
+import math
+import os
+import threading
+import time
+
+from anyio import from_thread
+from fastapi import Depends, HTTPException, Request, status
+
+from app import database, models, pool_metrics
+from app.auth_utils import get_current_user
+from app.cache import TTLCache
+from app.metrics import Counter
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+TRUSTED_PROXY_IPS = {ip.strip() for ip in os.getenv("TRUSTED_PROXY_IPS", "").split(",") if ip.strip()}
+LOAD_SHED_POOL_WAITERS = int(os.getenv("LOAD_SHED_POOL_WAITERS", str(database.DB_POOL_SIZE)))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(os.getenv("LOAD_SHED_RETRY_AFTER_SECONDS", "2"))
+
+if RATE_LIMIT_ENABLED and RATE_LIMIT_BACKEND == "redis":
+    import redis.asyncio as redis  # optional: pip install redis
+
+decisions = Counter("rate_limit_decisions_total", "Admission decisions by budget", ["budget", "decision"])
+
+# Refills, takes a token if there is one and returns the wait for the next one
+# (as a string: Lua numbers come back as integers). Uses the Redis clock so
+# workers on different hosts agree.
+_TAKE_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or burst
+local stamp = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - stamp, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+
+class Budget:
+    def __init__(self, name: str, rate: float, burst: float, shed_at: int):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.shed_at = shed_at
+        # a bucket left alone for burst / rate seconds is full again, so an
+        # expired entry and a fresh one are the same
+        self._buckets = TTLCache(maxsize=RATE_LIMIT_MAX_KEYS, ttl=self.burst / rate if rate > 0 else 0)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str, rate: str, burst: str, shed_at: int):
+        prefix = f"RATE_LIMIT_{name.upper()}"
+        return cls(
+            name,
+            rate=float(os.getenv(f"{prefix}_PER_SECOND", rate)),
+            burst=float(os.getenv(f"{prefix}_BURST", burst)),
+            shed_at=shed_at,
+        )
+
+    def take_local(self, key) -> float:
+        """Take a token from this process's bucket; seconds until one is available, 0 if taken."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            self._buckets.set(key, (tokens - 1, now))
+            return 0.0
+
+    def stats(self) -> dict:
+        return {
+            "per_second": self.rate,
+            "burst": self.burst,
+            "shed_at_pool_waiters": self.shed_at or None,
+            "local_buckets": self._buckets.stats(),
+        }
+
+
+budgets = {
+    "crud": Budget.from_env("crud", rate="10", burst="50", shed_at=2 * LOAD_SHED_POOL_WAITERS),
+    "report": Budget.from_env("report", rate="0.2", burst="5", shed_at=LOAD_SHED_POOL_WAITERS),
+    "login": Budget.from_env("login", rate="0.1", burst="10", shed_at=2 * LOAD_SHED_POOL_WAITERS),
+    "login_account": Budget.from_env("login_account", rate="0.02", burst="5", shed_at=2 * LOAD_SHED_POOL_WAITERS),
+    "register": Budget.from_env("register", rate="0.02", burst="5", shed_at=2 * LOAD_SHED_POOL_WAITERS),
+}
+
+_take_script = None
+
+
+def _redis_take_script():
+    # created on first use, so each server worker process has its own connections
+    global _take_script
+    if _take_script is None:
+        _take_script = redis.from_url(RATE_LIMIT_REDIS_URL).register_script(_TAKE_SCRIPT)
+    return _take_script
+
+
+async def _take(budget: Budget, key) -> float:
+    if RATE_LIMIT_BACKEND != "redis":
+        return budget.take_local(key)
+    take = _redis_take_script()
+    return float(await take(keys=[f"rate_limit:{budget.name}:{key}"], args=[budget.rate, budget.burst]))
+
+
+async def admit(budget_name: str, key):
+    """Let the request through, or raise 503 (shedding load) or 429 (key's bucket is empty)."""
+    budget = budgets[budget_name]
+    if budget.shed_at and pool_metrics.waiting() > budget.shed_at:
+        decisions.inc(budget=budget.name, decision="shed")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)},
+        )
+    if not RATE_LIMIT_ENABLED or budget.rate <= 0:
+        return
+    try:
+        wait = await _take(budget, key)
+    except Exception:
+        # a limiter outage must not become an API outage
+        decisions.inc(budget=budget.name, decision="backend_error")
+        return
+    if wait > 0:
+        decisions.inc(budget=budget.name, decision="limited")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(max(math.ceil(wait), 1))},
+        )
+    decisions.inc(budget=budget.name, decision="allowed")
+
+
+def admit_in_thread(budget_name: str, key):
+    """admit() for sync routes, which FastAPI runs in a worker thread."""
+    from_thread.run(admit, budget_name, key)
+
+
+async def limit_crud(current_user: models.User = Depends(get_current_user)):
+    await admit("crud", current_user.id)
+
+
+async def limit_reports(current_user: models.User = Depends(get_current_user)):
+    await admit("report", current_user.id)
+
+
+def _trusted(address: str) -> bool:
+    return "*" in TRUSTED_PROXY_IPS or address in TRUSTED_PROXY_IPS
+
+
+def client_address(request: Request) -> str:
+    """The address of the client, looking past the trusted proxies in front of the app."""
+    address = request.client.host if request.client else "unknown"
+    if not _trusted(address):
+        return address
+    # each proxy appends the address it received the request from
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(forwarded):
+        address = hop
+        if not _trusted(hop):
+            break
+    return address
+
+
+async def limit_login(request: Request):
+    address = client_address(request)
+    # the address alone first, so trying many emails from one client is limited too
+    await admit("login", address)
+    try:
+        # the body is parsed for the route already; Starlette keeps it on the request
+        email = str((await request.json()).get("email", "")).strip().lower()
+    except (ValueError, AttributeError):
+        email = ""
+    await admit("login_account", f"{address}|{email}")
+
+
+async def limit_register(request: Request):
+    await admit("register", client_address(request))
+
+
+def stats() -> dict:
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "backend": RATE_LIMIT_BACKEND,
+        "pool_waiting": pool_metrics.waiting(),
+        "budgets": {name: budget.stats() for name, budget in budgets.items()},
+        "decisions": {
+            f"{budget}:{decision}": count for (budget, decision), count in sorted(decisions.snapshot().items())
+        },
+    }
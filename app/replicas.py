@@ -0,0 +1,235 @@
+"""
+Read replicas.
+
+With DATABASE_REPLICA_URLS set (see app.database), handlers that only read
+(the list and detail routes, /summary/ and /reports/*) take their session from
+get_read_db / get_async_read_db. Such a session runs its queries on one
+replica, picked round-robin among the healthy ones when it first needs a
+connection; flushes and INSERT/UPDATE/DELETE statements still go to the
+primary.
+
+A replica whose connection fails is taken out of rotation for
+REPLICA_RETRY_SECONDS, and the read that hit the failure is run again on the
+primary (see app.database.RoutingSession), so the request still succeeds. A background thread also checks every replica each
+REPLICA_HEALTH_INTERVAL_SECONDS (SELECT 1, and the replay lag on PostgreSQL)
+and skips those more than REPLICA_MAX_LAG_SECONDS behind. When no replica is
+usable, reads go to the primary.
+
+Read-your-writes: once a request of a user has written to the primary, that
+user's reads stay on the primary for REPLICA_STICKY_SECONDS, which should be
+longer than the replicas normally lag. The window is kept per server process,
+so with several workers a read that lands on another worker than the write
+can still be served by a replica.
+"""
+import itertools
+import os
+import threading
+import time
+
+from sqlalchemy import event, text
+
+from app.cache import TTLCache
+from app.metrics import Counter, Gauge
+from app.user_context import current_user
+
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+REPLICA_STICKY_MAX_USERS = int(os.getenv("REPLICA_STICKY_MAX_USERS", "100000"))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+REPLICA_HEALTH_INTERVAL_SECONDS = float(os.getenv("REPLICA_HEALTH_INTERVAL_SECONDS", "10"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+
+# Zero when the standby has replayed everything it received, so an idle
+# primary does not look like lag.
+_POSTGRES_LAG = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+read_sessions_total = Counter(
+    "db_read_sessions_total", "Read-only sessions by the database that served them", ["target", "reason"]
+)
+replica_up = Gauge("db_replica_up", "1 while a replica is in rotation", ["replica"])
+replica_lag = Gauge("db_replica_lag_seconds", "Replay lag at the last health check", ["replica"])
+
+# user id -> True for users who wrote within the last REPLICA_STICKY_SECONDS
+recent_writers = TTLCache(maxsize=REPLICA_STICKY_MAX_USERS, ttl=REPLICA_STICKY_SECONDS)
+
+
+def track_writes(engine):
+    """Start the current user's primary-only window when a request writes through `engine`."""
+
+    @event.listens_for(getattr(engine, "sync_engine", engine), "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if context is None or not (context.isinsert or context.isupdate or context.isdelete):
+            return
+        holder = current_user.get()
+        if holder is not None and holder.user_id is not None:
+            holder.wrote = True
+            recent_writers.set(holder.user_id, True)
+
+
+class Replica:
+    def __init__(self, name: str, engine, async_engine=None):
+        self.name = name
+        self.engine = engine
+        self.async_engine = async_engine
+        self.healthy = True
+        self.down_until = 0.0
+        self.lag_seconds = None
+        self.last_error = None
+
+    def usable(self, now: float) -> bool:
+        # past down_until a failed replica gets traffic again, which is how it
+        # recovers when the health thread is disabled
+        return self.healthy or now >= self.down_until
+
+
+class ReplicaSet:
+    def __init__(self):
+        self.replicas = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def add(self, name: str, engine, async_engine=None) -> Replica:
+        replica = Replica(name, engine, async_engine)
+        for target in (engine, async_engine):
+            if target is not None:
+                event.listen(getattr(target, "sync_engine", target), "handle_error", self._on_error(replica))
+        self.replicas.append(replica)
+        replica_up.set(1, replica=name)
+        return replica
+
+    def _on_error(self, replica):
+        def handle_error(context):
+            # dropped connections and failures to connect at all; query errors
+            # say nothing about the replica's health
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(replica, context.original_exception)
+        return handle_error
+
+    def mark_down(self, replica: Replica, error):
+        replica.healthy = False
+        replica.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        replica.last_error = str(error) or error.__class__.__name__
+        replica_up.set(0, replica=replica.name)
+
+    def mark_up(self, replica: Replica):
+        replica.healthy = True
+        replica.last_error = None
+        replica_up.set(1, replica=replica.name)
+
+    def choose(self):
+        """The next usable replica in round-robin order, or None."""
+        self._start_checker()
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica.usable(now)]
+        if not candidates:
+            return None
+        return candidates[next(self._counter) % len(candidates)]
+
+    def check(self):
+        """Probe every replica once and update its health and lag."""
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    if conn.dialect.name == "postgresql":
+                        lag = float(conn.execute(_POSTGRES_LAG).scalar() or 0)
+                    else:
+                        conn.execute(text("SELECT 1"))
+                        lag = 0.0
+            except Exception as exc:
+                self.mark_down(replica, exc)
+                continue
+            replica.lag_seconds = lag
+            replica_lag.set(lag, replica=replica.name)
+            if lag > REPLICA_MAX_LAG_SECONDS:
+                self.mark_down(replica, f"replay lag {lag:.1f}s")
+            else:
+                self.mark_up(replica)
+
+    def _start_checker(self):
+        # started on first use rather than at import, so each server worker
+        # process gets its own thread
+        if self._checker is not None or REPLICA_HEALTH_INTERVAL_SECONDS <= 0:
+            return
+        with self._lock:
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._check_forever, name="replica-health", daemon=True)
+                self._checker.start()
+
+    def _check_forever(self):
+        while True:
+            time.sleep(REPLICA_HEALTH_INTERVAL_SECONDS)
+            self.check()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            replica.name: {
+                "healthy": replica.healthy,
+                "in_rotation": replica.usable(now),
+                "lag_seconds": replica.lag_seconds,
+                "last_error": replica.last_error,
+                "retry_in_seconds": round(max(replica.down_until - now, 0.0), 1) if not replica.healthy else None,
+            }
+            for replica in self.replicas
+        }
+
+
+replica_set = ReplicaSet()
+
+
+def choose_for_read():
+    """The replica a read-only session should use, or None for the primary."""
+    if not replica_set:
+        return None
+    holder = current_user.get()
+    if holder is not None and holder.user_id is not None and recent_writers.get(holder.user_id):
+        read_sessions_total.inc(target="primary", reason="recent_write")
+        return None
+    replica = replica_set.choose()
+    if replica is None:
+        read_sessions_total.inc(target="primary", reason="no_replica")
+        return None
+    read_sessions_total.inc(target=replica.name, reason="replica")
+    return replica
+
+
+def stats() -> dict:
+    return {
+        "replicas": replica_set.stats(),
+        "sticky_seconds": REPLICA_STICKY_SECONDS,
+        "recent_writers": recent_writers.stats(),
+    }
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pure ASGI middleware restarting the user's primary-only window with the
+    response headers of a request that wrote (the window first starts with
+    the write, see track_writes), so it cannot run out before the client has
+    seen the result of a long request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not replica_set:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                holder = current_user.get()
+                if holder is not None and holder.wrote:
+                    recent_writers.set(holder.user_id, True)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,124 @@
+"""
+On-disk cache of rendered report files.
+
+Entries are addressed by a hash of (user, data_version, range, format). The
+data_version advances on every income/expense write, so an entry never has to
+be invalidated: a changed report simply gets a new key, and old entries age
+out. The directory is kept under REPORT_CACHE_MAX_BYTES by evicting the least
+recently used files (a hit refreshes the file's mtime). The directory and
+its files are private to the server's user (see app.private_files).
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+
+from app import private_files
+
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "expense-tracker-report-cache")
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def cache_key(user_id: int, data_version: int, start, end, format: str) -> str:
+    raw = f"{user_id}:{data_version}:{start or ''}:{end or ''}:{format}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _path(key: str) -> str:
+    return os.path.join(private_files.ensure_dir(REPORT_CACHE_DIR), key)
+
+
+def lookup(key: str):
+    """Path of the cached file, or None. A hit marks the entry as recently used."""
+    path = _path(key)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        _stats["hits"] += 1
+    return path
+
+
+def _entries():
+    try:
+        with os.scandir(REPORT_CACHE_DIR) as scan:
+            return [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                    for entry in scan if entry.is_file() and "." not in entry.name]
+    except FileNotFoundError:
+        return []
+
+
+def _evict():
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= REPORT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        with _lock:
+            _stats["evictions"] += 1
+
+
+def _commit(part_path: str, key: str):
+    os.replace(part_path, _path(key))
+    with _lock:
+        _stats["stores"] += 1
+    _evict()
+
+
+def store(key: str, data: bytes):
+    if len(data) > REPORT_CACHE_MAX_BYTES:
+        return
+    part_path = f"{_path(key)}.{uuid.uuid4().hex}.part"
+    with private_files.open_new(part_path) as f:
+        f.write(data)
+    _commit(part_path, key)
+
+
+def tee(key: str, chunks):
+    """
+    Pass `chunks` through while writing them to the cache. The entry only
+    becomes visible once the whole file has been produced; an interrupted
+    download leaves nothing behind.
+    """
+    part_path = f"{_path(key)}.{uuid.uuid4().hex}.part"
+    size = 0
+    completed = False
+    try:
+        with private_files.open_new(part_path) as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size <= REPORT_CACHE_MAX_BYTES:
+                    f.write(chunk)
+                yield chunk
+        completed = size <= REPORT_CACHE_MAX_BYTES
+    finally:
+        if completed:
+            _commit(part_path, key)
+        else:
+            try:
+                os.remove(part_path)
+            except FileNotFoundError:
+                pass
+
+
+def stats() -> dict:
+    entries = _entries()
+    with _lock:
+        return {
+            **_stats,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": REPORT_CACHE_MAX_BYTES,
+        }
@@ -0,0 +1,63 @@
+"""Row sources shared by the report writers. Rows are read in batches through a server-side cursor."""
+import heapq
+from operator import itemgetter
+
+from sqlalchemy import func, literal, select
+
+from app import models
+
+REPORT_COLUMNS = ("Type", "Amount", "Source/Title", "Date")
+REPORT_YIELD_PER = 2_000
+
+
+def _income_query(user_id, start=None, end=None):
+    query = select(
+        literal("Income"), models.Income.amount, models.Income.source, models.Income.received_date
+    ).where(models.Income.user_id == user_id)
+    if start is not None:
+        query = query.where(models.Income.received_date >= start)
+    if end is not None:
+        query = query.where(models.Income.received_date <= end)
+    return query.order_by(models.Income.received_date, models.Income.id)
+
+
+def _expense_query(user_id, start=None, end=None):
+    query = select(
+        literal("Expense"), models.Expense.amount, models.Expense.title, models.Expense.expense_date
+    ).where(models.Expense.user_id == user_id)
+    if start is not None:
+        query = query.where(models.Expense.expense_date >= start)
+    if end is not None:
+        query = query.where(models.Expense.expense_date <= end)
+    return query.order_by(models.Expense.expense_date, models.Expense.id)
+
+
+def _stream(db, query):
+    for row in db.execute(query.execution_options(yield_per=REPORT_YIELD_PER)):
+        yield tuple(row)
+
+
+def iter_report_rows(db, user_id, start=None, end=None):
+    """(type, amount, source/title, date) tuples: all incomes, then all expenses, each in date order."""
+    for query in (_income_query(user_id, start, end), _expense_query(user_id, start, end)):
+        yield from _stream(db, query)
+
+
+def iter_merged_rows(db, user_id, start=None, end=None):
+    """
+    The same rows as iter_report_rows, interleaved into one date-ordered
+    sequence (incomes first on the same day). Both tables are read through
+    their own server-side cursor at the same time, so nothing is sorted in memory.
+    """
+    return heapq.merge(
+        _stream(db, _income_query(user_id, start, end)),
+        _stream(db, _expense_query(user_id, start, end)),
+        key=itemgetter(3),
+    )
+
+
+def count_report_rows(db, user_id, start=None, end=None) -> int:
+    total = 0
+    for query in (_income_query(user_id, start, end), _expense_query(user_id, start, end)):
+        total += db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+    return total
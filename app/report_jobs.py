@@ -0,0 +1,235 @@
+"""
+Background report jobs.
+
+A job renders a report to a file under REPORT_JOBS_DIR on a local thread pool
+and records its state in a JSON file next to the artifact, so any server
+worker on the same host can report progress and serve the download. The
+directory and its files are private to the server's user (see
+app.private_files). Finished artifacts are kept for REPORT_JOB_TTL_SECONDS
+and deleted by a background thread every REPORT_JOB_PURGE_INTERVAL_SECONDS.
+
+Jobs run in the process that accepted them. Deduplication of identical
+in-flight jobs is therefore per server worker process.
+"""
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date
+
+from app import database, private_files
+from app.pdf_report import PDF_MAX_ROWS, render_pdf
+from app.report_data import REPORT_COLUMNS, count_report_rows, iter_report_rows
+from app.text_export import stream_csv
+from app.workers import BoundedPool
+from app.xlsx_stream import stream_xlsx
+
+REPORT_JOBS_DIR = os.getenv("REPORT_JOBS_DIR") or os.path.join(tempfile.gettempdir(), "expense-tracker-reports")
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_MAX_PENDING = int(os.getenv("REPORT_JOB_MAX_PENDING", "16"))
+REPORT_JOB_TTL_SECONDS = int(os.getenv("REPORT_JOB_TTL_SECONDS", "3600"))
+REPORT_JOB_PURGE_INTERVAL_SECONDS = float(os.getenv("REPORT_JOB_PURGE_INTERVAL_SECONDS", "300"))
+
+# job state is written to disk at most this often while rows are being produced
+PROGRESS_WRITE_INTERVAL_SECONDS = 1.0
+
+FORMATS = {
+    "excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "pdf": ("pdf", "application/pdf"),
+    "csv": ("csv", "text/csv"),
+}
+
+job_pool = BoundedPool("report_jobs", max_workers=REPORT_JOB_WORKERS, max_pending=REPORT_JOB_MAX_PENDING, kind="thread")
+
+_lock = threading.Lock()
+# dedup key -> job id, for jobs queued or running in this process
+_active = {}
+_purger = None
+
+log = logging.getLogger("app.report_jobs")
+
+
+def _meta_path(job_id):
+    return os.path.join(private_files.ensure_dir(REPORT_JOBS_DIR), f"{job_id}.json")
+
+
+def artifact_path(job):
+    return os.path.join(private_files.ensure_dir(REPORT_JOBS_DIR), f"{job['id']}.{FORMATS[job['format']][0]}")
+
+
+def _save(job):
+    tmp_path = _meta_path(job["id"]) + ".tmp"
+    with private_files.open_new(tmp_path, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, _meta_path(job["id"]))
+
+
+def load_job(job_id):
+    """Return the job's state, or None if it does not exist or has expired."""
+    try:
+        uuid.UUID(hex=job_id)
+    except ValueError:
+        return None
+    try:
+        with open(_meta_path(job_id)) as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if job.get("expires_at") and job["expires_at"] < time.time():
+        return None
+    return job
+
+
+def purge_expired():
+    """Delete the metadata and artifacts of jobs whose TTL has passed."""
+    try:
+        names = os.listdir(REPORT_JOBS_DIR)
+    except FileNotFoundError:
+        return
+    now = time.time()
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(REPORT_JOBS_DIR, name)
+        try:
+            with open(path) as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if job.get("expires_at") and job["expires_at"] < now:
+            for stale in (artifact_path(job), artifact_path(job) + ".part", path):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+
+def _start_purger():
+    # started on first use rather than at import, so each server worker
+    # process gets its own thread
+    global _purger
+    if _purger is not None or REPORT_JOB_PURGE_INTERVAL_SECONDS <= 0:
+        return
+    with _lock:
+        if _purger is None:
+            _purger = threading.Thread(target=_purge_forever, name="report-job-purge", daemon=True)
+            _purger.start()
+
+
+def _purge_forever():
+    while True:
+        try:
+            purge_expired()
+        except Exception:
+            log.exception("purging expired report jobs failed")
+        time.sleep(REPORT_JOB_PURGE_INTERVAL_SECONDS)
+
+
+def _write_csv(path, rows):
+    with private_files.open_new(path) as f:
+        for chunk in stream_csv(REPORT_COLUMNS, rows):
+            f.write(chunk)
+
+
+def _write_excel(path, rows):
+    with private_files.open_new(path) as f:
+        for chunk in stream_xlsx(REPORT_COLUMNS, rows):
+            f.write(chunk)
+
+
+def _write_pdf(path, rows):
+    with private_files.open_new(path) as f:
+        f.write(render_pdf(rows).getbuffer())
+
+
+_WRITERS = {"excel": _write_excel, "pdf": _write_pdf, "csv": _write_csv}
+
+
+def _parse_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def _run(job, key):
+    start, end = _parse_date(job["from_date"]), _parse_date(job["to_date"])
+    try:
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        with database.ReadSessionLocal() as db:
+            job["rows_total"] = count_report_rows(db, job["user_id"], start, end)
+            if job["format"] == "pdf" and job["rows_total"] > PDF_MAX_ROWS:
+                raise ValueError(f"Report has more than {PDF_MAX_ROWS} rows; narrow the date range or use excel or csv.")
+            _save(job)
+
+            last_write = time.monotonic()
+
+            def counted(rows):
+                nonlocal last_write
+                for row in rows:
+                    job["rows_done"] += 1
+                    yield row
+                    if time.monotonic() - last_write >= PROGRESS_WRITE_INTERVAL_SECONDS:
+                        last_write = time.monotonic()
+                        _save(job)
+
+            part_path = artifact_path(job) + ".part"
+            _WRITERS[job["format"]](part_path, counted(iter_report_rows(db, job["user_id"], start, end)))
+            os.replace(part_path, artifact_path(job))
+        job["status"] = "done"
+    except Exception as exc:
+        job["status"] = "failed"
+        job["error"] = str(exc) or exc.__class__.__name__
+    finally:
+        job["finished_at"] = time.time()
+        job["expires_at"] = job["finished_at"] + REPORT_JOB_TTL_SECONDS
+        _save(job)
+        with _lock:
+            _active.pop(key, None)
+
+
+def submit_job(user_id, kind, format, start=None, end=None):
+    """
+    Queue a report and return its state. An identical job already queued or
+    running for the same user is returned instead of starting a new one.
+    Raises app.workers.PoolOverloaded when the job pool is full.
+    """
+    key = (user_id, kind, format, start, end)
+    _start_purger()
+    with _lock:
+        job_id = _active.get(key)
+        if job_id is not None:
+            job = load_job(job_id)
+            if job is not None and job["status"] in ("queued", "running"):
+                return job
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "kind": kind,
+            "format": format,
+            "from_date": start.isoformat() if start else None,
+            "to_date": end.isoformat() if end else None,
+            "status": "queued",
+            "rows_done": 0,
+            "rows_total": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "expires_at": None,
+        }
+        _save(job)
+        snapshot = dict(job)
+        _active[key] = job["id"]
+        try:
+            # in a copy of the request's context, so the read session can tell
+            # whether the user has just written (see app.replicas)
+            job_pool.submit(contextvars.copy_context().run, _run, job, key)
+        except Exception:
+            _active.pop(key, None)
+            os.remove(_meta_path(job["id"]))
+            raise
+        return snapshot
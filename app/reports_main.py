@@ -0,0 +1,38 @@
+"""
+Separate app for /reports, for deployments that run report rendering on its
+own worker class:
+
+    REPORTS_ROUTER=remote uvicorn app.main:app --port 8000 --workers 4
+    uvicorn app.reports_main:app --port 8001 --workers 1
+
+with the proxy sending /reports/ to port 8001 and everything else to 8000.
+The API workers then never import the report stack, and report jobs,
+the report cache and the PDF process pool all live with the report workers.
+The PDF toolchain is loaded at startup (REPORTS_PRELOAD, on by default here),
+before the pool forks, so the first PDF does not pay for the import.
+"""
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+from app.middleware import install_middleware
+from app.pdf_report import preload
+from app.routes import metrics, reports
+
+REPORTS_PRELOAD = os.getenv("REPORTS_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if REPORTS_PRELOAD:
+        preload()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+install_middleware(app)
+
+app.include_router(reports.router)
+app.include_router(metrics.router)
@@ -0,0 +1,144 @@
+"""
+Per-request instrumentation.
+
+RequestMetricsMiddleware times every HTTP request and records it against the
+route template it matched (/expenses/{expense_id}, not /expenses/42), so the
+number of series stays bounded. Engine events attributed to the request
+through a context variable add the number of SQL statements and the time spent
+in them. That covers the threadpool and streaming iterators too, since both run
+in a copy of the request's context. Everything lands in app.metrics and is
+served by GET /metrics.
+
+Responses carry a Server-Timing header splitting the request into database
+time and the rest ("app"), e.g.
+
+    Server-Timing: db;dur=3.1;desc="4 queries", app;dur=1.7
+
+For streamed bodies the header only covers the work done before the first
+byte.
+"""
+import os
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+from app.metrics import Counter, Gauge, Histogram
+
+REQUEST_METRICS = os.getenv("REQUEST_METRICS", "true").lower() in ("1", "true", "yes")
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "true").lower() in ("1", "true", "yes")
+
+UNMATCHED_ROUTE = "unmatched"
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time to the end of the response body", ["method", "route"]
+)
+requests_total = Counter("http_requests_total", "Finished requests", ["method", "route", "status"])
+requests_in_flight = Gauge("http_requests_in_flight", "Requests being processed", ["method", "route"])
+request_db_duration = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL statements per request", ["method", "route"]
+)
+request_db_statements = Histogram(
+    "http_request_db_statements", "SQL statements per request", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000),
+)
+db_statements_total = Counter("db_statements_total", "SQL statements executed", ["engine"])
+db_statement_duration = Histogram("db_statement_duration_seconds", "Execution time of SQL statements", ["engine"])
+
+
+class RequestStats:
+    __slots__ = ("method", "route", "statements", "db_seconds", "queries")
+
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        self.statements = 0
+        self.db_seconds = 0.0
+        # per-statement detail, filled in by app.query_diagnostics when it is enabled
+        self.queries = None
+
+
+# Stats of the request being handled; None outside of a request (CLIs, jobs)
+current_request = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine, name: str):
+    """Count and time the statements an engine executes, per request and in total."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        db_statements_total.inc(engine=name)
+        db_statement_duration.observe(elapsed, engine=name)
+        stats = current_request.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_seconds += elapsed
+
+
+def route_template(app, scope) -> str:
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    # PARTIAL is a path match with the wrong method: a 405 on a known route
+    return partial or UNMATCHED_ROUTE
+
+
+def server_timing(stats: RequestStats, elapsed: float) -> bytes:
+    db_ms = stats.db_seconds * 1000
+    app_ms = max(elapsed * 1000 - db_ms, 0.0)
+    return f'db;dur={db_ms:.1f};desc="{stats.statements} queries", app;dur={app_ms:.1f}'.encode()
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to their last byte."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not REQUEST_METRICS:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope["app"], scope)
+        stats = RequestStats(method, route)
+        token = current_request.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING_HEADER:
+                    header = (b"server-timing", server_timing(stats, time.perf_counter() - start))
+                    message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        requests_in_flight.inc(method=method, route=route)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec(method=method, route=route)
+            request_duration.observe(elapsed, method=method, route=route)
+            requests_total.inc(method=method, route=route, status=status)
+            request_db_duration.observe(stats.db_seconds, method=method, route=route)
+            request_db_statements.observe(stats.statements, method=method, route=route)
+            current_request.reset(token)
@@ -0,0 +1,188 @@
+"""
+Per-user income/expense totals behind /summary/.
+
+Handlers call apply_delta() inside the same transaction as the row they write,
+so the totals can never drift on a successful commit. Each call also bumps the
+row's data_version, which caches use as their invalidation key (bill reminder
+writes bump bills_version the same way). The reconcile command rebuilds them
+from the raw tables and reports (or fixes) any mismatch:
+
+    python -m app.rollups reconcile           # verify only
+    python -m app.rollups reconcile --fix     # rewrite mismatched rows
+"""
+import argparse
+import sys
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import models, shards
+from app.database import SessionLocal, engine
+
+CENT = Decimal("0.01")
+RECONCILE_BATCH_SIZE = 500
+
+
+def to_money(value) -> Decimal:
+    """Round the way a Numeric(…, 2) column stores the value, so deltas match stored amounts."""
+    if value is None:
+        return Decimal(0)
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _upsert(values: dict, increment: bool):
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(models.UserTotals).values(**values, data_version=1, updated_at=func.now())
+    if increment:
+        new_income = models.UserTotals.total_income + stmt.excluded.total_income
+        new_expenses = models.UserTotals.total_expenses + stmt.excluded.total_expenses
+    else:
+        new_income = stmt.excluded.total_income
+        new_expenses = stmt.excluded.total_expenses
+    return stmt.on_conflict_do_update(
+        index_elements=[models.UserTotals.user_id],
+        set_={
+            "total_income": new_income,
+            "total_expenses": new_expenses,
+            "data_version": models.UserTotals.data_version + 1,
+            "updated_at": func.now(),
+        },
+    )
+
+
+async def apply_delta(db, user_id: int, income=0, expenses=0):
+    """Atomically add to a user's totals (creating the row if needed). Call before commit."""
+    await db.execute(_upsert(
+        {"user_id": user_id, "total_income": to_money(income), "total_expenses": to_money(expenses)},
+        increment=True,
+    ))
+
+
+def bills_version_upsert():
+    """Statement bumping bills_version for the bound :user_id; execute with one or many parameter sets."""
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(models.UserTotals).values(
+        user_id=bindparam("user_id"), total_income=0, total_expenses=0, data_version=0, bills_version=1,
+        updated_at=func.now(),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[models.UserTotals.user_id],
+        set_={"bills_version": models.UserTotals.bills_version + 1},
+    )
+
+
+async def bump_bills_version(db, user_id: int):
+    """Mark the user's bill reminders as changed. Call before commit."""
+    await db.execute(bills_version_upsert(), {"user_id": user_id})
+
+
+async def get_bills_version(db, user_id: int) -> int:
+    """Changes whenever the user's bill reminders change; 0 before the first write."""
+    totals = await db.get(models.UserTotals, user_id)
+    return totals.bills_version if totals is not None else 0
+
+
+async def get_data_version(db, user_id: int) -> int:
+    """Changes whenever the user's incomes or expenses change; 0 before the first write."""
+    totals = await db.get(models.UserTotals, user_id)
+    return totals.data_version if totals is not None else 0
+
+
+def read_data_version(db, user_id: int) -> int:
+    """get_data_version for a regular (sync) Session."""
+    totals = db.get(models.UserTotals, user_id)
+    return totals.data_version if totals is not None else 0
+
+
+async def get_version_and_totals(db, user_id: int):
+    """
+    (data_version, (total_income, total_expenses)) for a user from a single load
+    of the rollup row; the totals come from the raw tables if the row is missing.
+    """
+    totals = await db.get(models.UserTotals, user_id)
+    if totals is not None:
+        return totals.data_version, (totals.total_income, totals.total_expenses)
+    total_income = await db.scalar(select(func.coalesce(func.sum(models.Income.amount), 0))
+                                   .where(models.Income.user_id == user_id))
+    total_expenses = await db.scalar(select(func.coalesce(func.sum(models.Expense.amount), 0))
+                                     .where(models.Expense.user_id == user_id))
+    return 0, (total_income, total_expenses)
+
+
+def _actual_totals(db, user_ids):
+    incomes = dict(db.execute(
+        select(models.Income.user_id, func.sum(models.Income.amount))
+        .where(models.Income.user_id.in_(user_ids))
+        .group_by(models.Income.user_id)
+    ).all())
+    expenses = dict(db.execute(
+        select(models.Expense.user_id, func.sum(models.Expense.amount))
+        .where(models.Expense.user_id.in_(user_ids))
+        .group_by(models.Expense.user_id)
+    ).all())
+    return {
+        user_id: (to_money(incomes.get(user_id)), to_money(expenses.get(user_id)))
+        for user_id in user_ids
+    }
+
+
+def _reconcile_batch(db, user_ids, fix: bool, out) -> int:
+    mismatches = 0
+    # Lock the batch's rollup rows first: writers block on them until we
+    # commit, and the sums below (a fresh snapshot) see everything before.
+    stored_rows = db.execute(
+        select(models.UserTotals)
+        .where(models.UserTotals.user_id.in_(user_ids))
+        .with_for_update()
+    ).scalars().all()
+    stored = {row.user_id: (to_money(row.total_income), to_money(row.total_expenses)) for row in stored_rows}
+
+    for uid, actual in _actual_totals(db, user_ids).items():
+        # no row is fine for a user with no history: the first write creates it
+        if stored.get(uid, (Decimal(0), Decimal(0))) == actual:
+            continue
+        mismatches += 1
+        print(f"user {uid}: stored {stored.get(uid)} actual {actual}", file=out)
+        if fix:
+            db.execute(_upsert(
+                {"user_id": uid, "total_income": actual[0], "total_expenses": actual[1]},
+                increment=False,
+            ))
+    db.commit()
+    return mismatches
+
+
+def reconcile(fix: bool = False, user_id: int = None, out=sys.stdout) -> int:
+    """Compare every user's rollup row with the raw tables. Returns the number of mismatches found."""
+    mismatches = 0
+    last_id = 0
+    with SessionLocal() as directory:
+        while True:
+            query = select(models.User.id).where(models.User.id > last_id).order_by(models.User.id)
+            if user_id is not None:
+                query = query.where(models.User.id == user_id)
+            user_ids = directory.scalars(query.limit(RECONCILE_BATCH_SIZE)).all()
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+
+            for shard, shard_user_ids in shards.group_by_shard(directory, user_ids).items():
+                with shards.session_for(shard) as db:
+                    mismatches += _reconcile_batch(db, shard_user_ids, fix, out)
+            if user_id is not None:
+                break
+    print(f"{mismatches} mismatched user(s){' fixed' if fix and mismatches else ''}", file=out)
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = sub.add_parser("reconcile", help="verify (and optionally fix) user_totals")
+    reconcile_parser.add_argument("--fix", action="store_true")
+    reconcile_parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+
+    found = reconcile(fix=args.fix, user_id=args.user_id)
+    sys.exit(1 if found and not args.fix else 0)
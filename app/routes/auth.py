@@ -1,14 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from app import models, schemas, database
-from app.auth_utils import hash_password, verify_password, create_access_token, get_current_user
+from app import models, schemas, database, shards
+from app.auth_utils import (
+    hash_password,
+    verify_password,
+    verify_and_update_password,
+    create_access_token,
+    get_current_user,
+    invalidate_user,
+    load_user_row,
+)
+from app.rate_limit import limit_crud, limit_login, limit_register
 
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 
-@router.post("/register", response_model=schemas.UserResponse)
+@router.post("/register", response_model=schemas.UserResponse, dependencies=[Depends(limit_register)])
 def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
     existing_user = db.query(models.User).filter(models.User.email == user.email).first()
     if existing_user:
@@ -24,11 +33,14 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_d
         address=user.address,
     )
     db.add(new_user)
+    db.flush()
+    # the map row commits with the user, so no user is ever left without a shard
+    shards.assign(db, new_user)
     db.commit()
     db.refresh(new_user)
     return new_user
 
-@router.put("/update-profile", response_model=schemas.UserResponse)
+@router.put("/update-profile", response_model=schemas.UserResponse, dependencies=[Depends(limit_crud)])
 def update_profile(
     updates: schemas.UserUpdate,
     db: Session = Depends(database.get_db),
@@ -40,38 +52,51 @@ def update_profile(
         if email_user and email_user.id != current_user.id:
             raise HTTPException(status_code=400, detail="Email already in use")
 
+    # current_user may be a cached, detached copy; edit the row in this session
+    user = load_user_row(db, current_user)
+
     # Update fields only if values are provided
     if updates.name is not None:
-        current_user.name = updates.name
+        user.name = updates.name
     if updates.phonenumber is not None:
-        current_user.phonenumber = updates.phonenumber
+        user.phonenumber = updates.phonenumber
     if updates.email is not None:
-        current_user.email = updates.email
+        user.email = updates.email
     if updates.profileimage is not None:
-        current_user.profileimage = updates.profileimage
+        user.profileimage = updates.profileimage
     if updates.address is not None:
-        current_user.address = updates.address
+        user.address = updates.address
 
     db.commit()
-    db.refresh(current_user)
+    invalidate_user(user.id)
+    db.refresh(user)
 
-    return current_user
+    return user
 
 
-@router.post("/login", response_model=schemas.Token)
+@router.post("/login", response_model=schemas.Token, dependencies=[Depends(limit_login)])
 def login_user(login_data: schemas.LoginRequest, db: Session = Depends(database.get_db)):
     user = db.query(models.User).filter(models.User.email == login_data.email).first()
-    if not user or not verify_password(login_data.password, user.password_hash):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    verified, new_hash = verify_and_update_password(login_data.password, user.password_hash)
+    if not verified:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    token = create_access_token(data={"email": user.email})
+    # Transparently upgrade hashes made with an older cost factor
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+
+    token = create_access_token(data={"sub": str(user.id), "email": user.email})
     return {"access_token": token, "token_type": "bearer"}
 
-@router.get("/user-name")
+@router.get("/user-name", dependencies=[Depends(limit_crud)])
 def get_user_name(current_user: models.User = Depends(get_current_user)):
     return {"name": current_user.name}
 
-@router.get("/profile", response_model=schemas.UserResponse)
+@router.get("/profile", response_model=schemas.UserResponse, dependencies=[Depends(limit_crud)])
 def get_user_profile(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
@@ -79,37 +104,47 @@ def get_user_profile(
     return current_user
 
 
-@router.post("/change-password")
+@router.post("/change-password", dependencies=[Depends(limit_crud)])
 def change_password(
     payload: schemas.ChangePasswordRequest,
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    # The cached user carries no password hash, so load the row itself
+    user = load_user_row(db, current_user)
+
     # Step 1: Verify old password
-    if not verify_password(payload.old_password, current_user.password_hash):
+    if not verify_password(payload.old_password, user.password_hash):
         raise HTTPException(status_code=400, detail="Incorrect old password")
 
     # Step 2: Hash and update new password
     new_hashed_pw = hash_password(payload.new_password)
-    current_user.password_hash = new_hashed_pw
+    user.password_hash = new_hashed_pw
     db.commit()
+    invalidate_user(user.id)
 
     return {"message": "Password updated successfully"}
 
 
-@router.post("/logout", status_code=status.HTTP_200_OK)
+@router.post("/logout", status_code=status.HTTP_200_OK, dependencies=[Depends(limit_crud)])
 def logout(current_user: models.User = Depends(get_current_user)):
     """
     Dummy logout endpoint. Simply instruct client to delete JWT token.
     """
     return {"message": "Logout successful. Please delete the token on the client side."}
 
-@router.delete("/delete-account")
+@router.delete("/delete-account", dependencies=[Depends(limit_crud)])
 def delete_account(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Delete user record
-    db.delete(current_user)
+    user = load_user_row(db, current_user)
+    shard = shards.shard_of(db, current_user.id)
+    db.delete(user)
     db.commit()
+    if shard != shards.DIRECTORY:
+        # the directory's foreign keys do not reach the user's rows on another shard
+        shards.purge_user(current_user.id, shard)
+    invalidate_user(current_user.id)
     return {"message": "Your account has been deleted successfully"}
@@ -1,15 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app import models, schemas, database
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta
+from typing import Optional
+from app import models, schemas, database, rollups, fast_json, bill_scheduler
 from app.auth_utils import get_current_user
+from app.rate_limit import limit_crud
+from app.conditional import check_not_modified, version_etag
+from app.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, apply_keyset, split_page
 
-router = APIRouter(prefix="/bill-reminders", tags=["Bill Reminders"])
+router = APIRouter(prefix="/bill-reminders", tags=["Bill Reminders"], dependencies=[Depends(limit_crud)])
 
 # Create a bill reminder
 @router.post("/", response_model=schemas.BillReminderResponse)
-def create_bill_reminder(
+async def create_bill_reminder(
     bill: schemas.BillReminderCreate,
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
     new_bill = models.BillReminder(
@@ -22,30 +28,83 @@ def create_bill_reminder(
         user_id=current_user.id
     )
     db.add(new_bill)
-    db.commit()
-    db.refresh(new_bill)
+    await rollups.bump_bills_version(db, current_user.id)
+    await db.commit()
+    await db.refresh(new_bill)
     return new_bill
 
 
-# Get all bill reminders
+# Get bill reminders (soonest due first, keyset paginated when `limit` is given)
 @router.get("/", response_model=list[schemas.BillReminderResponse])
-def get_bills(
-    db: Session = Depends(database.get_db),
+async def get_bills(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    status: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    db: AsyncSession = Depends(database.get_async_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    bills = db.query(models.BillReminder).filter(models.BillReminder.user_id == current_user.id).all()
-    return bills
+    version = await rollups.get_bills_version(db, current_user.id)
+    unchanged = check_not_modified(request, response, version_etag(request, "bill-reminders", current_user.id, version))
+    if unchanged:
+        return unchanged
+
+    query = fast_json.select_for(schemas.BillReminderResponse, models.BillReminder).where(models.BillReminder.user_id == current_user.id)
+    if from_date:
+        query = query.where(models.BillReminder.due_date >= from_date)
+    if to_date:
+        query = query.where(models.BillReminder.due_date <= to_date)
+    if status:
+        query = query.where(models.BillReminder.status == status)
+    if min_amount is not None:
+        query = query.where(models.BillReminder.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(models.BillReminder.amount <= max_amount)
+
+    query = apply_keyset(query, models.BillReminder.due_date, models.BillReminder.id, cursor, order, limit)
+    bills, next_cursor = split_page(await fast_json.fetch_all(db, query), limit, "due_date")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return fast_json.list_response(schemas.BillReminderResponse, bills, response)
+
+
+# Upcoming and overdue bills, with recurring bills expanded into their next occurrences
+@router.get("/upcoming", response_model=list[schemas.UpcomingBill])
+async def get_upcoming_bills(
+    request: Request,
+    response: Response,
+    days: int = Query(30, ge=0, le=366),
+    db: AsyncSession = Depends(database.get_async_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    today = date.today()
+    # the result also depends on the date, not only on the user's writes
+    version = await rollups.get_bills_version(db, current_user.id)
+    etag = version_etag(request, "bill-reminders-upcoming", current_user.id, f"{version}:{today}")
+    unchanged = check_not_modified(request, response, etag)
+    if unchanged:
+        return unchanged
+
+    horizon = today + timedelta(days=days)
+    bills = (await db.execute(bill_scheduler.upcoming_query(current_user.id, horizon))).all()
+    return list(bill_scheduler.expand_upcoming(bills, today, horizon))
 
 
 # Get a bill reminder by ID
 @router.get("/{bill_id}", response_model=schemas.BillReminderResponse)
-def get_bill(bill_id: int,
-             db: Session = Depends(database.get_db),
-             current_user: models.User = Depends(get_current_user)):
-    bill = db.query(models.BillReminder).filter(
+async def get_bill(bill_id: int,
+                   db: AsyncSession = Depends(database.get_async_read_db),
+                   current_user: models.User = Depends(get_current_user)):
+    bill = await db.scalar(select(models.BillReminder).where(
         models.BillReminder.id == bill_id,
         models.BillReminder.user_id == current_user.id
-    ).first()
+    ))
     if not bill:
         raise HTTPException(status_code=404, detail="Bill reminder not found")
     return bill
@@ -53,14 +112,14 @@ def get_bill(bill_id: int,
 
 # Update a bill reminder
 @router.put("/{bill_id}", response_model=schemas.BillReminderResponse)
-def update_bill(bill_id: int,
-                updated: schemas.BillReminderCreate,
-                db: Session = Depends(database.get_db),
-                current_user: models.User = Depends(get_current_user)):
-    bill = db.query(models.BillReminder).filter(
+async def update_bill(bill_id: int,
+                      updated: schemas.BillReminderCreate,
+                      db: AsyncSession = Depends(database.get_async_db),
+                      current_user: models.User = Depends(get_current_user)):
+    bill = await db.scalar(select(models.BillReminder).where(
         models.BillReminder.id == bill_id,
         models.BillReminder.user_id == current_user.id
-    ).first()
+    ))
     if not bill:
         raise HTTPException(status_code=404, detail="Bill reminder not found")
 
@@ -71,23 +130,25 @@ def update_bill(bill_id: int,
     bill.status = updated.status
     bill.notes = updated.notes
 
-    db.commit()
-    db.refresh(bill)
+    await rollups.bump_bills_version(db, current_user.id)
+    await db.commit()
+    await db.refresh(bill)
     return bill
 
 
 # Delete a bill reminder
 @router.delete("/{bill_id}", response_model=schemas.BillReminderResponse)
-def delete_bill(bill_id: int,
-                db: Session = Depends(database.get_db),
-                current_user: models.User = Depends(get_current_user)):
-    bill = db.query(models.BillReminder).filter(
+async def delete_bill(bill_id: int,
+                      db: AsyncSession = Depends(database.get_async_db),
+                      current_user: models.User = Depends(get_current_user)):
+    bill = await db.scalar(select(models.BillReminder).where(
         models.BillReminder.id == bill_id,
         models.BillReminder.user_id == current_user.id
-    ).first()
+    ))
     if not bill:
         raise HTTPException(status_code=404, detail="Bill reminder not found")
 
-    db.delete(bill)
-    db.commit()
+    await db.delete(bill)
+    await rollups.bump_bills_version(db, current_user.id)
+    await db.commit()
     return bill
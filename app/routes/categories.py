@@ -0,0 +1,103 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models, schemas, database, rollups, categories
+from app.auth_utils import get_current_user
+from app.rate_limit import limit_crud
+
+router = APIRouter(prefix="/categories", tags=["Categories"], dependencies=[Depends(limit_crud)])
+
+
+async def _get_own_category(db, category_id: int, user_id: int):
+    category = await db.scalar(select(models.Category).where(
+        models.Category.id == category_id,
+        models.Category.user_id == user_id
+    ))
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return category
+
+
+# Create a category
+@router.post("/", response_model=schemas.CategoryResponse)
+async def create_category(
+    category: schemas.CategoryCreate,
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    new_category = models.Category(name=category.name, color=category.color, user_id=current_user.id)
+    db.add(new_category)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Category already exists")
+    await db.refresh(new_category)
+    return new_category
+
+
+# Get categories of the current user
+@router.get("/", response_model=list[schemas.CategoryResponse])
+async def get_categories(db: AsyncSession = Depends(database.get_async_read_db),
+                         current_user: models.User = Depends(get_current_user)):
+    return (await db.scalars(
+        select(models.Category).where(models.Category.user_id == current_user.id).order_by(models.Category.name)
+    )).all()
+
+
+# Get a category by ID
+@router.get("/{category_id}", response_model=schemas.CategoryResponse)
+async def get_category(category_id: int,
+                       db: AsyncSession = Depends(database.get_async_read_db),
+                       current_user: models.User = Depends(get_current_user)):
+    return await _get_own_category(db, category_id, current_user.id)
+
+
+# Rename / recolor a category; the name is carried over to its expenses
+@router.put("/{category_id}", response_model=schemas.CategoryResponse)
+async def update_category(category_id: int,
+                          updated: schemas.CategoryCreate,
+                          db: AsyncSession = Depends(database.get_async_db),
+                          current_user: models.User = Depends(get_current_user)):
+    category = await _get_own_category(db, category_id, current_user.id)
+    old_name = category.name
+
+    category.name = updated.name
+    category.color = updated.color
+    if updated.name != old_name:
+        await db.execute(
+            update(models.Expense)
+            .where(models.Expense.user_id == current_user.id, models.Expense.category_id == category_id)
+            .values(category=updated.name),
+            execution_options={"synchronize_session": False},
+        )
+        # expense listings and cached name -> id mappings change with it
+        await rollups.apply_delta(db, current_user.id)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Category already exists")
+    await db.refresh(category)
+    return category
+
+
+# Delete a category (only when no expense uses it)
+@router.delete("/{category_id}", response_model=schemas.CategoryResponse)
+async def delete_category(category_id: int,
+                          db: AsyncSession = Depends(database.get_async_db),
+                          current_user: models.User = Depends(get_current_user)):
+    category = await _get_own_category(db, category_id, current_user.id)
+    in_use = await db.scalar(select(func.count()).select_from(models.Expense).where(
+        models.Expense.user_id == current_user.id,
+        models.Expense.category_id == category_id
+    ))
+    if in_use:
+        raise HTTPException(status_code=409, detail=f"Category is used by {in_use} expense(s)")
+
+    await db.delete(category)
+    # drops cached name -> id mappings in every server worker
+    await rollups.apply_delta(db, current_user.id)
+    await db.commit()
+    return category
@@ -1,53 +1,120 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app import models, schemas, database
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy import false, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
+from typing import Optional
+from app import models, schemas, database, rollups, fast_json, categories
 from app.auth_utils import get_current_user
+from app.rate_limit import limit_crud
+from app.bulk_import import import_records
+from app.conditional import check_not_modified, version_etag
+from app.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, apply_keyset, split_page
 from fastapi.responses import JSONResponse
 
-router = APIRouter(prefix="/expenses", tags=["Expenses"])
+router = APIRouter(prefix="/expenses", tags=["Expenses"], dependencies=[Depends(limit_crud)])
 
 
 # ▶️ CREATE Expense
 @router.post("/", response_model=schemas.ExpenseResponse)
-def create_expense(
+async def create_expense(
     expense: schemas.ExpenseCreate,
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    category_id = await categories.resolve_category_id(db, current_user.id, expense.category)
     new_expense = models.Expense(
         title=expense.title,
         amount=expense.amount,
         category=expense.category,
+        category_id=category_id,
         expense_date=expense.expense_date,
         user_id=current_user.id
     )
     db.add(new_expense)
-    db.commit()
-    db.refresh(new_expense)
+    await rollups.apply_delta(db, current_user.id, expenses=expense.amount)
+    await db.commit()
+    await db.refresh(new_expense)
     return new_expense
 
 
-# 📥 READ All Expenses of Current User
+# 📦 BULK IMPORT Expenses (streamed CSV with a header row, or NDJSON)
+@router.post("/bulk", response_model=schemas.BulkImportReport)
+async def bulk_import_expenses(
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    async def add_to_totals(rows):
+        await rollups.apply_delta(db, current_user.id, expenses=sum(rollups.to_money(row["amount"]) for row in rows))
+
+    async def attach_category_ids(rows):
+        ids = await categories.resolve_category_ids(db, current_user.id, {row["category"] for row in rows})
+        for row in rows:
+            row["category_id"] = ids.get(row["category"])
+
+    return await import_records(request, db, schemas.ExpenseCreate, models.Expense, lambda expense: {
+        "title": expense.title,
+        "amount": expense.amount,
+        "category": expense.category,
+        "expense_date": expense.expense_date,
+        "user_id": current_user.id,
+    }, on_insert=add_to_totals, prepare=attach_category_ids)
+
+
+# 📥 READ Expenses of Current User (newest first, keyset paginated when `limit` is given)
 @router.get("/", response_model=list[schemas.ExpenseResponse])
-def get_expenses(
-    db: Session = Depends(database.get_db),
+async def get_expenses(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    category: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    db: AsyncSession = Depends(database.get_async_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    expenses = db.query(models.Expense).filter(models.Expense.user_id == current_user.id).all()
-    return expenses
+    version = await rollups.get_data_version(db, current_user.id)
+    unchanged = check_not_modified(request, response, version_etag(request, "expenses", current_user.id, version))
+    if unchanged:
+        return unchanged
+
+    query = fast_json.select_for(schemas.ExpenseResponse, models.Expense).where(models.Expense.user_id == current_user.id)
+    if from_date:
+        query = query.where(models.Expense.expense_date >= from_date)
+    if to_date:
+        query = query.where(models.Expense.expense_date <= to_date)
+    if category:
+        category_id = await categories.resolve_category_id(
+            db, current_user.id, category, create=False, data_version=version
+        )
+        query = query.where(models.Expense.category_id == category_id if category_id is not None else false())
+    if min_amount is not None:
+        query = query.where(models.Expense.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(models.Expense.amount <= max_amount)
+
+    query = apply_keyset(query, models.Expense.expense_date, models.Expense.id, cursor, order, limit)
+    expenses, next_cursor = split_page(await fast_json.fetch_all(db, query), limit, "expense_date")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return fast_json.list_response(schemas.ExpenseResponse, expenses, response)
 
 
 # 🔍 READ Single Expense by ID
 @router.get("/{expense_id}", response_model=schemas.ExpenseResponse)
-def get_expense(
+async def get_expense(
     expense_id: int,
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    expense = db.query(models.Expense).filter(
+    expense = await db.scalar(select(models.Expense).where(
         models.Expense.id == expense_id,
         models.Expense.user_id == current_user.id
-    ).first()
+    ))
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     return expense
@@ -55,26 +122,31 @@ def get_expense(
 
 # ✏️ UPDATE Expense
 @router.put("/{expense_id}", response_model=schemas.ExpenseResponse)
-def update_expense(
+async def update_expense(
     expense_id: int,
     updated_data: schemas.ExpenseCreate,
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    expense = db.query(models.Expense).filter(
+    category_id = await categories.resolve_category_id(db, current_user.id, updated_data.category)
+    expense = await db.scalar(select(models.Expense).where(
         models.Expense.id == expense_id,
         models.Expense.user_id == current_user.id
-    ).first()
+    ))
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
+    amount_change = rollups.to_money(updated_data.amount) - rollups.to_money(expense.amount)
+
     expense.title = updated_data.title
     expense.amount = updated_data.amount
     expense.category = updated_data.category
+    expense.category_id = category_id
     expense.expense_date = updated_data.expense_date
 
-    db.commit()
-    db.refresh(expense)
+    await rollups.apply_delta(db, current_user.id, expenses=amount_change)
+    await db.commit()
+    await db.refresh(expense)
     return expense
 
 
@@ -82,16 +154,16 @@ def update_expense(
 
 
 @router.delete("/{expense_id}", response_model=schemas.ExpenseResponse)
-def delete_expense(
+async def delete_expense(
     expense_id: int,
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Fetch the expense belonging to the current user
-    expense = db.query(models.Expense).filter(
+    expense = await db.scalar(select(models.Expense).where(
         models.Expense.id == expense_id,
         models.Expense.user_id == current_user.id
-    ).first()
+    ))
 
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
@@ -99,8 +171,9 @@ def delete_expense(
     # Copy the data to return before deleting
     deleted_expense = expense
 
-    db.delete(expense)
-    db.commit()
+    await db.delete(expense)
+    await rollups.apply_delta(db, current_user.id, expenses=-rollups.to_money(expense.amount))
+    await db.commit()
     
     return deleted_expense
 
@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app import models, schemas, database
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
+from typing import Optional
+from app import models, schemas, database, rollups, fast_json
 from app.auth_utils import get_current_user
+from app.rate_limit import limit_crud
+from app.bulk_import import import_records
+from app.conditional import check_not_modified, version_etag
+from app.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, apply_keyset, split_page
 
-router = APIRouter(prefix="/incomes", tags=["Incomes"])
+router = APIRouter(prefix="/incomes", tags=["Incomes"], dependencies=[Depends(limit_crud)])
 
 # Create income
 @router.post("/", response_model=schemas.IncomeResponse)
-def create_income(income: schemas.IncomeCreate,
-                  db: Session = Depends(database.get_db),
-                  current_user: models.User = Depends(get_current_user)):
+async def create_income(income: schemas.IncomeCreate,
+                        db: AsyncSession = Depends(database.get_async_db),
+                        current_user: models.User = Depends(get_current_user)):
     new_income = models.Income(
         amount=income.amount,
         source=income.source,
@@ -17,28 +24,75 @@ def create_income(income: schemas.IncomeCreate,
         user_id=current_user.id
     )
     db.add(new_income)
-    db.commit()
-    db.refresh(new_income)
+    await rollups.apply_delta(db, current_user.id, income=income.amount)
+    await db.commit()
+    await db.refresh(new_income)
     return new_income
 
 
-# Get all incomes of the current user
+# Bulk import incomes (streamed CSV with a header row, or NDJSON)
+@router.post("/bulk", response_model=schemas.BulkImportReport)
+async def bulk_import_incomes(request: Request,
+                              db: AsyncSession = Depends(database.get_async_db),
+                              current_user: models.User = Depends(get_current_user)):
+    async def add_to_totals(rows):
+        await rollups.apply_delta(db, current_user.id, income=sum(rollups.to_money(row["amount"]) for row in rows))
+
+    return await import_records(request, db, schemas.IncomeCreate, models.Income, lambda income: {
+        "amount": income.amount,
+        "source": income.source,
+        "received_date": income.received_date,
+        "user_id": current_user.id,
+    }, on_insert=add_to_totals)
+
+
+# Get incomes of the current user (newest first, keyset paginated when `limit` is given)
 @router.get("/", response_model=list[schemas.IncomeResponse])
-def get_incomes(db: Session = Depends(database.get_db),
-                current_user: models.User = Depends(get_current_user)):
-    incomes = db.query(models.Income).filter(models.Income.user_id == current_user.id).all()
-    return incomes
+async def get_incomes(request: Request,
+                      response: Response,
+                      limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                      cursor: Optional[str] = None,
+                      order: str = Query("desc", pattern="^(asc|desc)$"),
+                      from_date: Optional[date] = None,
+                      to_date: Optional[date] = None,
+                      source: Optional[str] = None,
+                      min_amount: Optional[float] = None,
+                      max_amount: Optional[float] = None,
+                      db: AsyncSession = Depends(database.get_async_read_db),
+                      current_user: models.User = Depends(get_current_user)):
+    version = await rollups.get_data_version(db, current_user.id)
+    unchanged = check_not_modified(request, response, version_etag(request, "incomes", current_user.id, version))
+    if unchanged:
+        return unchanged
+
+    query = fast_json.select_for(schemas.IncomeResponse, models.Income).where(models.Income.user_id == current_user.id)
+    if from_date:
+        query = query.where(models.Income.received_date >= from_date)
+    if to_date:
+        query = query.where(models.Income.received_date <= to_date)
+    if source:
+        query = query.where(models.Income.source == source)
+    if min_amount is not None:
+        query = query.where(models.Income.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(models.Income.amount <= max_amount)
+
+    query = apply_keyset(query, models.Income.received_date, models.Income.id, cursor, order, limit)
+    incomes, next_cursor = split_page(await fast_json.fetch_all(db, query), limit, "received_date")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return fast_json.list_response(schemas.IncomeResponse, incomes, response)
 
 
 # Get income by ID
 @router.get("/{income_id}", response_model=schemas.IncomeResponse)
-def get_income(income_id: int,
-               db: Session = Depends(database.get_db),
-               current_user: models.User = Depends(get_current_user)):
-    income = db.query(models.Income).filter(
+async def get_income(income_id: int,
+                     db: AsyncSession = Depends(database.get_async_read_db),
+                     current_user: models.User = Depends(get_current_user)):
+    income = await db.scalar(select(models.Income).where(
         models.Income.id == income_id,
         models.Income.user_id == current_user.id
-    ).first()
+    ))
     if not income:
         raise HTTPException(status_code=404, detail="Income not found")
     return income
@@ -46,38 +100,42 @@ def get_income(income_id: int,
 
 # Update income
 @router.put("/{income_id}", response_model=schemas.IncomeResponse)
-def update_income(income_id: int, updated: schemas.IncomeCreate,
-                  db: Session = Depends(database.get_db),
-                  current_user: models.User = Depends(get_current_user)):
-    income = db.query(models.Income).filter(
+async def update_income(income_id: int, updated: schemas.IncomeCreate,
+                        db: AsyncSession = Depends(database.get_async_db),
+                        current_user: models.User = Depends(get_current_user)):
+    income = await db.scalar(select(models.Income).where(
         models.Income.id == income_id,
         models.Income.user_id == current_user.id
-    ).first()
+    ))
     if not income:
         raise HTTPException(status_code=404, detail="Income not found")
 
+    amount_change = rollups.to_money(updated.amount) - rollups.to_money(income.amount)
+
     income.amount = updated.amount
     income.source = updated.source
     income.received_date = updated.received_date
 
-    db.commit()
-    db.refresh(income)
+    await rollups.apply_delta(db, current_user.id, income=amount_change)
+    await db.commit()
+    await db.refresh(income)
     return income
 
 
 # Delete income
 @router.delete("/{income_id}", response_model=schemas.IncomeResponse)
-def delete_income(income_id: int,
-                  db: Session = Depends(database.get_db),
-                  current_user: models.User = Depends(get_current_user)):
-    income = db.query(models.Income).filter(
+async def delete_income(income_id: int,
+                        db: AsyncSession = Depends(database.get_async_db),
+                        current_user: models.User = Depends(get_current_user)):
+    income = await db.scalar(select(models.Income).where(
         models.Income.id == income_id,
         models.Income.user_id == current_user.id
-    ).first()
+    ))
     if not income:
         raise HTTPException(status_code=404, detail="Income not found")
 
     deleted_income = income
-    db.delete(income)
-    db.commit()
+    await db.delete(income)
+    await rollups.apply_delta(db, current_user.id, income=-rollups.to_money(income.amount))
+    await db.commit()
     return deleted_income
@@ -0,0 +1,76 @@
+import os
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from typing import Optional
+
+from app import auth_utils, categories, pool_metrics, query_diagnostics, rate_limit, replicas, report_cache, shards
+from app import workers
+from app.routes import summary
+
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
+
+
+def require_internal_token(x_internal_token: Optional[str] = Header(None)):
+    """Internal endpoints are hidden unless INTERNAL_API_TOKEN is set and sent as X-Internal-Token."""
+    if not INTERNAL_API_TOKEN or not x_internal_token or not secrets.compare_digest(x_internal_token, INTERNAL_API_TOKEN):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["Internal"],
+    include_in_schema=False,
+    dependencies=[Depends(require_internal_token)],
+)
+
+
+@router.get("/cache")
+def get_cache_stats():
+    return {
+        "user_cache": auth_utils.user_cache.stats(),
+        "breakdown_cache": summary.breakdown_cache.stats(),
+        "category_cache": categories.category_cache.stats(),
+        "shard_cache": shards.shard_cache.stats(),
+        "report_cache": report_cache.stats(),
+    }
+
+
+@router.get("/workers")
+def get_worker_pool_stats():
+    return workers.pool_stats()
+
+
+@router.get("/pool")
+def get_db_pool_stats():
+    return pool_metrics.pool_stats()
+
+
+@router.get("/rate-limits")
+def get_rate_limit_stats():
+    return rate_limit.stats()
+
+
+@router.get("/replicas")
+def get_replica_stats():
+    return replicas.stats()
+
+
+@router.get("/shards")
+def get_shard_stats():
+    """Users, rows and totals per shard and across all of them (one query fan-out per shard)."""
+    return shards.stats()
+
+
+@router.get("/queries")
+def get_query_stats(
+    top: int = Query(20, ge=1, le=1000),
+    order: str = Query("total_time", pattern="^(" + "|".join(query_diagnostics.SORT_KEYS) + ")$"),
+):
+    return query_diagnostics.top(top, order)
+
+
+@router.delete("/queries")
+def reset_query_stats():
+    query_diagnostics.reset()
+    return {"message": "Query statistics cleared"}
@@ -0,0 +1,28 @@
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+
+from app import metrics
+from app.routes import internal
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def require_scrape_token(authorization: Optional[str] = Header(None),
+                         x_internal_token: Optional[str] = Header(None)):
+    """Like the /internal endpoints, but Prometheus can also send the token as `Authorization: Bearer`."""
+    token = x_internal_token
+    if authorization and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):]
+    expected = internal.INTERNAL_API_TOKEN
+    if not expected or not token or not secrets.compare_digest(token, expected):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+router = APIRouter(tags=["Internal"], include_in_schema=False, dependencies=[Depends(require_scrape_token)])
+
+
+@router.get("/metrics")
+def get_metrics():
+    return Response(metrics.render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
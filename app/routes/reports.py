@@ -1,70 +1,93 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Header, Query, HTTPException, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from datetime import datetime
-from io import BytesIO
-import pandas as pd
-from xhtml2pdf import pisa
-from app import database, models
+from datetime import date, datetime
+from typing import Optional
+import os
+from app import database, models, rate_limit, report_cache, report_jobs, rollups, schemas
 from app.auth_utils import get_current_user
+from app.conditional import REVALIDATE, etag_matches, make_etag, not_modified
+from app.pdf_report import PDF_MAX_ROWS, render_pdf
+from app.rate_limit import limit_crud, limit_reports
+from app.report_data import REPORT_COLUMNS, count_report_rows, iter_merged_rows, iter_report_rows
+from app.text_export import stream_csv, stream_ndjson
+from app.workers import PoolOverloaded
+from app.xlsx_stream import stream_xlsx
 
 router = APIRouter(prefix="/reports", tags=["Reports"])
 
+STREAM_NDJSON_KEYS = ("type", "amount", "description", "date")
+STREAM_MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
 
-def generate_excel(incomes, expenses):
-    income_df = pd.DataFrame([{
-        "Type": "Income",
-        "Amount": i.amount,
-        "Source/Title": i.source,
-        "Date": i.received_date
-    } for i in incomes])
 
-    expense_df = pd.DataFrame([{
-        "Type": "Expense",
-        "Amount": e.amount,
-        "Source/Title": e.title,
-        "Date": e.expense_date
-    } for e in expenses])
+def generate_excel(user_id, start=None, end=None):
+    """
+    Stream the workbook as it is written. Opens its own session because the
+    request's dependencies are closed before the response body is sent.
+    """
+    with database.ReadSessionLocal() as db:
+        yield from stream_xlsx(REPORT_COLUMNS, iter_report_rows(db, user_id, start, end))
 
-    df = pd.concat([income_df, expense_df])
-    output = BytesIO()
-    df.to_excel(output, index=False)
-    output.seek(0)
-    return output
 
+def generate_stream(user_id, format, start=None, end=None):
+    """CSV or NDJSON of all transactions in date order; like generate_excel, opens its own session."""
+    with database.ReadSessionLocal() as db:
+        rows = iter_merged_rows(db, user_id, start, end)
+        if format == "csv":
+            yield from stream_csv(REPORT_COLUMNS, rows)
+        else:
+            yield from stream_ndjson(STREAM_NDJSON_KEYS, rows, numeric=("amount",))
 
-def generate_pdf(incomes, expenses):
-    html = "<h2>Expense Tracker Report</h2><table border='1'><tr><th>Type</th><th>Amount</th><th>Source/Title</th><th>Date</th></tr>"
-    for i in incomes:
-        html += f"<tr><td>Income</td><td>{i.amount}</td><td>{i.source}</td><td>{i.received_date}</td></tr>"
-    for e in expenses:
-        html += f"<tr><td>Expense</td><td>{e.amount}</td><td>{e.title}</td><td>{e.expense_date}</td></tr>"
-    html += "</table>"
 
-    pdf_file = BytesIO()
-    pisa.CreatePDF(html, dest=pdf_file)
-    pdf_file.seek(0)
-    return pdf_file
+def generate_pdf(db, user_id, start=None, end=None):
+    if count_report_rows(db, user_id, start, end) > PDF_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Report has more than {PDF_MAX_ROWS} rows; narrow the date range or use format=excel.",
+        )
+    try:
+        return render_pdf(iter_report_rows(db, user_id, start, end))
+    except PoolOverloaded:
+        raise HTTPException(status_code=503, detail="Report service is busy, please try again shortly",
+                            headers={"Retry-After": "5"})
+
+
+def _report_response(db, user_id, format, start, end, filename, if_none_match):
+    """
+    Serve a report from the report cache when the user's data has not changed
+    since it was rendered; otherwise render it and store it on the way out.
+    Only a report that is sent takes a token from the user's report budget.
+    """
+    key = report_cache.cache_key(user_id, rollups.read_data_version(db, user_id), start, end, format)
+    etag = make_etag(key)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, headers)
+    rate_limit.admit_in_thread("report", user_id)
+
+    extension, media_type = report_jobs.FORMATS[format]
+    filename = f"{filename}.{extension}"
+    path = report_cache.lookup(key)
+    if path is not None:
+        return FileResponse(path, media_type=media_type, filename=filename, headers=headers)
+
+    headers["Content-Disposition"] = f"attachment; filename={filename}"
+    if format == "excel":
+        file = report_cache.tee(key, generate_excel(user_id, start, end))
+    else:
+        file = generate_pdf(db, user_id, start, end)
+        report_cache.store(key, file.getvalue())
+    return StreamingResponse(file, media_type=media_type, headers=headers)
 
 
 @router.get("/full")
 def download_full_report(
     format: str = Query(..., regex="^(excel|pdf)$"),
-    db: Session = Depends(database.get_db),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    incomes = db.query(models.Income).filter(models.Income.user_id == current_user.id).all()
-    expenses = db.query(models.Expense).filter(models.Expense.user_id == current_user.id).all()
-
-    if format == "excel":
-        file = generate_excel(incomes, expenses)
-        return StreamingResponse(file, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                 headers={"Content-Disposition": "attachment; filename=report.xlsx"})
-
-    elif format == "pdf":
-        file = generate_pdf(incomes, expenses)
-        return StreamingResponse(file, media_type="application/pdf",
-                                 headers={"Content-Disposition": "attachment; filename=report.pdf"})
+    return _report_response(db, current_user.id, format, None, None, "report", if_none_match)
 
 
 @router.get("/range")
@@ -72,7 +95,8 @@ def download_range_report(
     from_date: str,
     to_date: str,
     format: str = Query(..., regex="^(excel|pdf)$"),
-    db: Session = Depends(database.get_db),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
     try:
@@ -81,22 +105,91 @@ def download_range_report(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
 
-    incomes = db.query(models.Income).filter(
-        models.Income.user_id == current_user.id,
-        models.Income.received_date.between(start, end)
-    ).all()
+    return _report_response(db, current_user.id, format, start, end, "datewise_report", if_none_match)
 
-    expenses = db.query(models.Expense).filter(
-        models.Expense.user_id == current_user.id,
-        models.Expense.expense_date.between(start, end)
-    ).all()
 
-    if format == "excel":
-        file = generate_excel(incomes, expenses)
-        return StreamingResponse(file, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                 headers={"Content-Disposition": "attachment; filename=datewise_report.xlsx"})
-
-    elif format == "pdf":
-        file = generate_pdf(incomes, expenses)
-        return StreamingResponse(file, media_type="application/pdf",
-                                 headers={"Content-Disposition": "attachment; filename=datewise_report.pdf"})
+@router.get("/stream", dependencies=[Depends(limit_reports)])
+def stream_report(
+    format: str = Query(..., pattern="^(csv|ndjson)$"),
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Every income and expense, merged in date order, streamed as it is read.
+    Memory use does not depend on the number of rows.
+    """
+    if from_date and to_date and from_date > to_date:
+        raise HTTPException(status_code=400, detail="from_date must not be after to_date")
+    return StreamingResponse(
+        generate_stream(current_user.id, format, from_date, to_date),
+        media_type=STREAM_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=transactions.{format}"},
+    )
+
+
+def _job_response(job) -> schemas.ReportJobResponse:
+    progress = None
+    if job["status"] == "done":
+        progress = 1.0
+    elif job["rows_total"]:
+        progress = round(job["rows_done"] / job["rows_total"], 4)
+    elif job["rows_total"] == 0:
+        progress = 0.0
+    return schemas.ReportJobResponse(
+        **{key: job[key] for key in ("id", "kind", "format", "from_date", "to_date", "status",
+                                     "rows_done", "rows_total", "error")},
+        progress=progress,
+        created_at=datetime.fromtimestamp(job["created_at"]),
+        finished_at=datetime.fromtimestamp(job["finished_at"]) if job["finished_at"] else None,
+        expires_at=datetime.fromtimestamp(job["expires_at"]) if job["expires_at"] else None,
+        download_url=f"/reports/jobs/{job['id']}/download" if job["status"] == "done" else None,
+    )
+
+
+def _load_own_job(job_id: str, user_id: int):
+    job = report_jobs.load_job(job_id)
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return job
+
+
+@router.post(
+    "/jobs", response_model=schemas.ReportJobResponse, status_code=202, dependencies=[Depends(limit_reports)]
+)
+def create_report_job(
+    report: schemas.ReportJobCreate,
+    response: Response,
+    current_user: models.User = Depends(get_current_user)
+):
+    start = end = None
+    if report.kind == "range":
+        if report.from_date is None or report.to_date is None:
+            raise HTTPException(status_code=400, detail="from_date and to_date are required for range reports")
+        start, end = report.from_date, report.to_date
+    try:
+        job = report_jobs.submit_job(current_user.id, report.kind, report.format, start, end)
+    except PoolOverloaded:
+        raise HTTPException(status_code=503, detail="Report service is busy, please try again shortly",
+                            headers={"Retry-After": "5"})
+    response.headers["Location"] = f"/reports/jobs/{job['id']}"
+    return _job_response(job)
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.ReportJobResponse,
+            dependencies=[Depends(limit_crud)])
+def get_report_job(job_id: str, current_user: models.User = Depends(get_current_user)):
+    return _job_response(_load_own_job(job_id, current_user.id))
+
+
+@router.get("/jobs/{job_id}/download", dependencies=[Depends(limit_crud)])
+def download_report_job(job_id: str, current_user: models.User = Depends(get_current_user)):
+    job = _load_own_job(job_id, current_user.id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Report is not ready (status: {job['status']})")
+    path = report_jobs.artifact_path(job)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Report file has expired")
+    extension, media_type = report_jobs.FORMATS[job["format"]]
+    filename = "report" if job["kind"] == "full" else "datewise_report"
+    return FileResponse(path, media_type=media_type, filename=f"{filename}.{extension}")
@@ -1,24 +1,36 @@
 # app/routes/summary.py
 
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app import models, database, schemas
+import os
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import Date, cast, func, literal, null, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models, database, schemas, rollups
 from app.auth_utils import get_current_user
+from app.rate_limit import limit_crud
+from app.cache import TTLCache
+from app.conditional import check_not_modified, version_etag
 
-router = APIRouter(prefix="/summary", tags=["Summary"])
+router = APIRouter(prefix="/summary", tags=["Summary"], dependencies=[Depends(limit_crud)])
 
-@router.get("/", response_model=schemas.SummaryResponse)
-def get_summary(db: Session = Depends(database.get_db),
-                current_user: models.User = Depends(get_current_user)):
+BREAKDOWN_CACHE_TTL_SECONDS = float(os.getenv("BREAKDOWN_CACHE_TTL_SECONDS", "300"))
+BREAKDOWN_CACHE_MAX_SIZE = int(os.getenv("BREAKDOWN_CACHE_MAX_SIZE", "2048"))
 
-    # Total Income
-    total_income = db.query(func.coalesce(func.sum(models.Income.amount), 0)) \
-                     .filter(models.Income.user_id == current_user.id).scalar()
+# Keyed on the user's data_version, so any income/expense write makes old entries unreachable
+breakdown_cache = TTLCache(maxsize=BREAKDOWN_CACHE_MAX_SIZE, ttl=BREAKDOWN_CACHE_TTL_SECONDS)
 
-    # Total Expenses
-    total_expenses = db.query(func.coalesce(func.sum(models.Expense.amount), 0)) \
-                       .filter(models.Expense.user_id == current_user.id).scalar()
+@router.get("/", response_model=schemas.SummaryResponse)
+async def get_summary(request: Request,
+                      response: Response,
+                      db: AsyncSession = Depends(database.get_async_read_db),
+                      current_user: models.User = Depends(get_current_user)):
+    # Total Income and Expenses, from the per-user rollup row (one read for the ETag and the body)
+    version, (total_income, total_expenses) = await rollups.get_version_and_totals(db, current_user.id)
+    unchanged = check_not_modified(request, response, version_etag(request, "summary", current_user.id, version))
+    if unchanged:
+        return unchanged
 
     # Remaining Balance
     remaining_balance = total_income - total_expenses
@@ -28,3 +40,105 @@ def get_summary(db: Session = Depends(database.get_db),
         "total_expenses": total_expenses,
         "remaining_balance": remaining_balance
     }
+
+
+def _bucket(column, granularity: str):
+    """Start of the day/week/month/year containing `column`."""
+    if database.engine.dialect.name == "sqlite":
+        modifiers = {
+            "day": (),
+            "week": ("-6 days", "weekday 1"),
+            "month": ("start of month",),
+            "year": ("start of year",),
+        }[granularity]
+        return func.date(column, *modifiers)
+    return cast(func.date_trunc(granularity, column), Date)
+
+
+def _breakdown_query(user_id: int, granularity: str, dimension: Optional[str],
+                     from_date: Optional[date], to_date: Optional[date]):
+    incomes = select(
+        _bucket(models.Income.received_date, granularity).label("bucket"),
+        null().label("category"),
+        models.Income.amount.label("income"),
+        # typed like the amounts, or the union's sums come back as floats on SQLite
+        literal(0, models.Expense.amount.type).label("expense"),
+    ).where(models.Income.user_id == user_id)
+    expenses = select(
+        _bucket(models.Expense.expense_date, granularity).label("bucket"),
+        # grouped by id along ix_expenses_user_category_date; names are looked up afterwards
+        (models.Expense.category_id if dimension == "category" else null()).label("category"),
+        literal(0, models.Income.amount.type).label("income"),
+        models.Expense.amount.label("expense"),
+    ).where(models.Expense.user_id == user_id)
+
+    if from_date:
+        incomes = incomes.where(models.Income.received_date >= from_date)
+        expenses = expenses.where(models.Expense.expense_date >= from_date)
+    if to_date:
+        incomes = incomes.where(models.Income.received_date <= to_date)
+        expenses = expenses.where(models.Expense.expense_date <= to_date)
+
+    rows = union_all(incomes, expenses).subquery()
+    return (
+        select(rows.c.bucket, rows.c.category, func.sum(rows.c.income), func.sum(rows.c.expense))
+        .group_by(rows.c.bucket, rows.c.category)
+        .order_by(rows.c.bucket, rows.c.category)
+    )
+
+
+@router.get("/breakdown", response_model=schemas.BreakdownResponse)
+async def get_breakdown(request: Request,
+                        response: Response,
+                        from_date: Optional[date] = None,
+                        to_date: Optional[date] = None,
+                        granularity: str = Query("month", pattern="^(day|week|month|year)$"),
+                        dimension: Optional[str] = Query(None, pattern="^category$"),
+                        db: AsyncSession = Depends(database.get_async_read_db),
+                        current_user: models.User = Depends(get_current_user)):
+    """
+    Income, expense and net per time bucket in one grouped query. With
+    dimension=category, expenses are further split by category; income rows
+    have no category.
+    """
+    if from_date and to_date and from_date > to_date:
+        raise HTTPException(status_code=400, detail="from_date must not be after to_date")
+
+    version = await rollups.get_data_version(db, current_user.id)
+    unchanged = check_not_modified(request, response, version_etag(request, "summary-breakdown", current_user.id, version))
+    if unchanged:
+        return unchanged
+
+    cache_key = (current_user.id, version, from_date, to_date, granularity, dimension)
+    cached = breakdown_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = await db.execute(_breakdown_query(current_user.id, granularity, dimension, from_date, to_date))
+    names = {}
+    if dimension == "category":
+        names = dict((await db.execute(
+            select(models.Category.id, models.Category.name).where(models.Category.user_id == current_user.id)
+        )).all())
+    buckets = []
+    for bucket, category_id, income, expense in result:
+        if isinstance(bucket, str):
+            bucket = date.fromisoformat(bucket)
+        buckets.append({
+            "period_start": bucket,
+            "category": names.get(category_id),
+            "income": income or 0,
+            "expense": expense or 0,
+            "net": (income or 0) - (expense or 0),
+        })
+    buckets.sort(key=lambda item: (item["period_start"], item["category"] is not None, item["category"] or ""))
+
+    breakdown = {
+        "granularity": granularity,
+        "dimension": dimension,
+        "from_date": from_date,
+        "to_date": to_date,
+        "buckets": buckets,
+    }
+    breakdown_cache.set(cache_key, breakdown)
+    return breakdown
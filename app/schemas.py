@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Literal, Optional, List
 from datetime import date, datetime
 
 # ==== USER ====
@@ -57,6 +57,7 @@ class ExpenseCreate(BaseModel):
 class ExpenseResponse(ExpenseCreate):
     id: int
     created_at: datetime
+    category_id: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -138,6 +139,28 @@ class BillReminderResponse(BillReminderBase):
     class Config:
         from_attributes = True
 
+class UpcomingBill(BaseModel):
+    bill_id: int
+    title: str
+    amount: float
+    due_date: date
+    repeat_cycle: Optional[str]
+    status: Optional[str]
+    overdue: bool
+    projected: bool
+    days_until: int
+
+# ==== BULK IMPORT ====
+class BulkImportError(BaseModel):
+    row: int
+    error: str
+
+class BulkImportReport(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BulkImportError]
+    errors_truncated: bool = False
+
 # summary
 
 class SummaryResponse(BaseModel):
@@ -148,4 +171,39 @@ class SummaryResponse(BaseModel):
     class Config:
         from_attributes = True
 
-
+class BreakdownBucket(BaseModel):
+    period_start: date
+    category: Optional[str] = None
+    income: float
+    expense: float
+    net: float
+
+class BreakdownResponse(BaseModel):
+    granularity: str
+    dimension: Optional[str] = None
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
+    buckets: List[BreakdownBucket]
+
+# ==== REPORT JOBS ====
+class ReportJobCreate(BaseModel):
+    kind: Literal["full", "range"] = "full"
+    format: Literal["excel", "pdf", "csv"]
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
+
+class ReportJobResponse(BaseModel):
+    id: str
+    kind: str
+    format: str
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
+    status: str
+    rows_done: int
+    rows_total: Optional[int] = None
+    progress: Optional[float] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    download_url: Optional[str] = None
@@ -0,0 +1,319 @@
+"""
+Horizontal sharding by user.
+
+Every income, expense, bill reminder, category and totals row belongs to one
+user, so all of a user's rows can live in one of several databases while the
+queries stay as they are. DATABASE_URL is shard 0 and the directory: it keeps
+the users table and the user_shards map. DATABASE_SHARD_URLS adds shards 1..N.
+get_current_user looks up the shard of the request's user (cached per process
+for SHARD_MAP_CACHE_TTL_SECONDS), and every session of the request goes there
+(see app.database.RoutingSession). New users are placed by id modulo the
+number of shards; users without a map row are on shard 0. Read replicas
+(app.replicas) serve shard 0 only.
+
+Each shard needs the full schema (run the migrations against it) and a
+placeholder users row per user for the foreign keys: same id, no profile,
+and an email and phone number derived from the id, so it never goes stale
+and never collides with another user's. The directory's row is the real one.
+Ids are kept when a user moves, so they must not collide across shards: on
+PostgreSQL, `prepare` starts the id sequences of shard k at
+k * SHARD_ID_BLOCK. SQLite has no sequences, so moves between SQLite shards
+only work while ids happen not to collide.
+
+    python -m app.shards prepare                # id ranges on every shard
+    python -m app.shards stats                  # users, rows and totals per shard
+    python -m app.shards move --user-id 42 --to 2
+
+A move is online: the user's writes are refused with 503 + Retry-After while
+their rows are copied and compared, the map is switched, and the old copy is
+deleted once every server process has seen the new shard. Reads keep working
+throughout. Admin queries across all users go through fan_out().
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import delete, func, insert, select, text, update
+
+from app import database, models
+from app.cache import TTLCache
+
+SHARD_MAP_CACHE_TTL_SECONDS = float(os.getenv("SHARD_MAP_CACHE_TTL_SECONDS", "30"))
+SHARD_MAP_CACHE_MAX_SIZE = int(os.getenv("SHARD_MAP_CACHE_MAX_SIZE", "100000"))
+SHARD_ID_BLOCK = int(os.getenv("SHARD_ID_BLOCK", "100000000"))
+MOVE_BATCH_SIZE = 5_000
+
+DIRECTORY = 0
+SHARDED = len(database.shard_engines) > 1
+
+# Tables holding users' rows, parents before children
+SHARDED_MODELS = (models.Category, models.Income, models.Expense, models.BillReminder, models.UserTotals)
+
+# user id -> (shard, moving). A move waits for entries to expire before each step.
+shard_cache = TTLCache(maxsize=SHARD_MAP_CACHE_MAX_SIZE, ttl=SHARD_MAP_CACHE_TTL_SECONDS)
+
+
+def shard_ids():
+    return range(len(database.shard_engines))
+
+
+def session_for(shard: int):
+    """A session whose user data statements go to `shard` (users and user_shards still use the directory)."""
+    return database.SessionLocal(info={"shard": shard})
+
+
+async def resolve(db, user_id: int):
+    """(shard, moving) for a user, from the cache or the directory's map."""
+    if not SHARDED:
+        return DIRECTORY, False
+    entry = shard_cache.get(user_id)
+    if entry is None:
+        row = (await db.execute(
+            select(models.UserShard.shard, models.UserShard.moving).where(models.UserShard.user_id == user_id)
+        )).first()
+        entry = (row.shard, row.moving) if row else (DIRECTORY, False)
+        shard_cache.set(user_id, entry)
+    return entry
+
+
+def shard_of(db, user_id: int) -> int:
+    """The user's shard, read from the directory without the cache."""
+    if not SHARDED:
+        return DIRECTORY
+    return db.scalar(select(models.UserShard.shard).where(models.UserShard.user_id == user_id)) or DIRECTORY
+
+
+def group_by_shard(db, user_ids) -> dict:
+    """{shard: [user id, ...]} for the given users."""
+    if not SHARDED:
+        return {DIRECTORY: list(user_ids)} if user_ids else {}
+    placed = dict(db.execute(
+        select(models.UserShard.user_id, models.UserShard.shard).where(models.UserShard.user_id.in_(user_ids))
+    ).all())
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(placed.get(user_id, DIRECTORY), []).append(user_id)
+    return groups
+
+
+def moving_user_ids(db) -> list:
+    """Users being moved right now; batch jobs leave their rows alone."""
+    if not SHARDED:
+        return []
+    return db.scalars(select(models.UserShard.user_id).where(models.UserShard.moving)).all()
+
+
+def _placeholder_row(user) -> dict:
+    # only what the shard's foreign keys need; the unique columns are derived
+    # from the id, so profile changes never have to reach the shards
+    return {
+        "id": user.id,
+        "name": "",
+        "phonenumber": f"shard-{user.id}",
+        "email": f"user-{user.id}@shard.invalid",
+        "password_hash": "",
+        "created_at": user.created_at,
+    }
+
+
+def _clear_user(conn, user_id: int, shard: int):
+    for model in reversed(SHARDED_MODELS):
+        conn.execute(delete(model.__table__).where(model.__table__.c.user_id == user_id))
+    if shard != DIRECTORY:
+        conn.execute(delete(models.User.__table__).where(models.User.__table__.c.id == user_id))
+
+
+def _reset_user(conn, user, shard: int):
+    # drops whatever an interrupted move or purge left behind, which would
+    # collide with the rows about to be written
+    _clear_user(conn, user.id, shard)
+    if shard != DIRECTORY:
+        conn.execute(insert(models.User.__table__), [_placeholder_row(user)])
+
+
+def assign(db, user) -> int:
+    """
+    Place a newly added (flushed, not yet committed) user on a shard. The map
+    row is added to `db`, so it commits together with the user.
+    """
+    if not SHARDED:
+        return DIRECTORY
+    shard = user.id % len(database.shard_engines)
+    if shard != DIRECTORY:
+        with database.shard_engines[shard].begin() as conn:
+            _reset_user(conn, user, shard)
+    db.add(models.UserShard(user_id=user.id, shard=shard))
+    return shard
+
+
+def purge_user(user_id: int, shard: int):
+    """Delete a user's rows from a shard, along with the placeholder users row unless it is the directory."""
+    with database.shard_engines[shard].begin() as conn:
+        _clear_user(conn, user_id, shard)
+    shard_cache.pop(user_id)
+
+
+def fan_out(fn, shards=None) -> dict:
+    """Run fn(db) on every shard (or the given ones) in parallel, each in its own session: {shard: result}."""
+    shards = list(shard_ids() if shards is None else shards)
+
+    def run(shard):
+        with session_for(shard) as db:
+            return fn(db)
+
+    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard-fan-out") as pool:
+        return dict(zip(shards, pool.map(run, shards)))
+
+
+def shard_totals(db) -> dict:
+    users, income, expenses = db.execute(select(
+        func.count(),
+        func.coalesce(func.sum(models.UserTotals.total_income), 0),
+        func.coalesce(func.sum(models.UserTotals.total_expenses), 0),
+    )).one()
+    totals = {"users_with_totals": users, "total_income": income, "total_expenses": expenses}
+    for model in (models.Income, models.Expense, models.BillReminder, models.Category):
+        totals[model.__tablename__] = db.scalar(select(func.count()).select_from(model))
+    return totals
+
+
+def stats() -> dict:
+    """Row counts and money totals per shard and overall, plus the map's placements."""
+    per_shard = fan_out(shard_totals)
+    overall = {key: sum(totals[key] for totals in per_shard.values()) for key in per_shard[DIRECTORY]}
+    with session_for(DIRECTORY) as db:
+        placed = dict(db.execute(
+            select(models.UserShard.shard, func.count()).group_by(models.UserShard.shard)
+        ).all())
+        moving = moving_user_ids(db)
+    return {"shards": per_shard, "all": overall, "placed": placed, "moving": moving}
+
+
+def _fingerprint(conn, user_id: int) -> dict:
+    result = {}
+    for model in SHARDED_MODELS:
+        table = model.__table__
+        columns = [func.count()]
+        if "amount" in table.c:
+            columns.append(func.coalesce(func.sum(table.c.amount), 0))
+        result[table.name] = tuple(conn.execute(select(*columns).where(table.c.user_id == user_id)).one())
+    return result
+
+
+def _copy_user(user, source: int, target: int) -> dict:
+    """Copy a user's rows in one transaction, committed only if the copy matches the source."""
+    copied = {}
+    with database.shard_engines[source].connect() as src, database.shard_engines[target].begin() as dst:
+        _reset_user(dst, user, target)
+        for model in SHARDED_MODELS:
+            table = model.__table__
+            result = src.execution_options(yield_per=MOVE_BATCH_SIZE).execute(
+                select(table).where(table.c.user_id == user.id)
+            )
+            copied[table.name] = 0
+            for rows in result.mappings().partitions():
+                dst.execute(insert(table), [dict(row) for row in rows])
+                copied[table.name] += len(rows)
+        expected, actual = _fingerprint(src, user.id), _fingerprint(dst, user.id)
+        if expected != actual:
+            # a write got through after all; the transaction rolls back
+            raise RuntimeError(f"copy of user {user.id} does not match shard {source}: {expected} != {actual}")
+    return copied
+
+
+def _set_map(user_id: int, shard: int, moving: bool):
+    with session_for(DIRECTORY) as db:
+        updated = db.execute(
+            update(models.UserShard).where(models.UserShard.user_id == user_id).values(shard=shard, moving=moving)
+        ).rowcount
+        if not updated:
+            db.add(models.UserShard(user_id=user_id, shard=shard, moving=moving))
+        db.commit()
+    shard_cache.pop(user_id)
+
+
+def move_user(user_id: int, target: int, settle_seconds: float = None, out=sys.stdout) -> dict:
+    """
+    Move a user's rows to another shard while the app keeps serving them.
+    `settle_seconds` is how long each step waits for server processes to see
+    the map change; it defaults to the map cache TTL plus a second.
+    """
+    if target not in shard_ids():
+        raise ValueError(f"no shard {target}; shards are 0-{len(database.shard_engines) - 1}")
+    settle = SHARD_MAP_CACHE_TTL_SECONDS + 1 if settle_seconds is None else settle_seconds
+    with session_for(DIRECTORY) as db:
+        user = db.get(models.User, user_id)
+        if user is None:
+            raise ValueError(f"no user {user_id}")
+        source = shard_of(db, user_id)
+        db.expunge(user)
+    if source == target:
+        print(f"user {user_id} is already on shard {target}", file=out)
+        return {}
+
+    _set_map(user_id, source, moving=True)
+    print(f"user {user_id}: writes paused, waiting {settle:.0f}s for every process to notice", file=out)
+    time.sleep(settle)
+    try:
+        copied = _copy_user(user, source, target)
+    except Exception:
+        _set_map(user_id, source, moving=False)
+        raise
+    print(f"user {user_id}: copied {copied} from shard {source} to shard {target}", file=out)
+
+    # still paused: processes that have not seen the switch yet read the old
+    # copy, which is identical, and must not write to it
+    _set_map(user_id, target, moving=True)
+    time.sleep(settle)
+    _set_map(user_id, target, moving=False)
+    purge_user(user_id, source)
+    print(f"user {user_id}: now on shard {target}, writes resumed, shard {source} cleaned up", file=out)
+    return copied
+
+
+def prepare(out=sys.stdout):
+    """Start the id sequences of shard k at k * SHARD_ID_BLOCK (PostgreSQL); safe to re-run."""
+    for shard in shard_ids():
+        engine = database.shard_engines[shard]
+        if engine.dialect.name != "postgresql":
+            print(f"shard {shard}: {engine.dialect.name} has no sequences, skipped", file=out)
+            continue
+        if shard == DIRECTORY:
+            continue
+        low, high = shard * SHARD_ID_BLOCK, (shard + 1) * SHARD_ID_BLOCK
+        with engine.begin() as conn:
+            for model in SHARDED_MODELS:
+                table = model.__tablename__
+                if "id" not in model.__table__.c:
+                    continue
+                conn.execute(text(f"""
+                    SELECT setval(pg_get_serial_sequence('{table}', 'id'),
+                                  COALESCE((SELECT MAX(id) FROM {table} WHERE id >= :low AND id < :high), :low - 1) + 1,
+                                  false)
+                """), {"low": low, "high": high})
+        print(f"shard {shard}: ids start at {low}", file=out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("prepare", help="set per-shard id ranges")
+    sub.add_parser("stats", help="users, rows and totals per shard")
+    move_parser = sub.add_parser("move", help="move one user to another shard")
+    move_parser.add_argument("--user-id", type=int, required=True)
+    move_parser.add_argument("--to", type=int, required=True, dest="target")
+    move_parser.add_argument("--settle-seconds", type=float, help="default: SHARD_MAP_CACHE_TTL_SECONDS + 1")
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        prepare()
+    elif args.command == "stats":
+        print(json.dumps(stats(), indent=2, default=str))
+    else:
+        try:
+            move_user(args.user_id, args.target, args.settle_seconds)
+        except ValueError as exc:
+            sys.exit(str(exc))
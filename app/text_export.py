@@ -0,0 +1,55 @@
+"""Chunked CSV and NDJSON encoders for streamed exports."""
+import csv
+import io
+
+import orjson
+
+FLUSH_EVERY_ROWS = 1_000
+
+
+def _to_json(value):
+    # Decimal amounts are emitted as numbers, like the JSON API does
+    return float(value) if value is not None else None
+
+
+def stream_csv(header, rows):
+    """Yield UTF-8 CSV: the header immediately, then the rows in chunks of FLUSH_EVERY_ROWS."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= FLUSH_EVERY_ROWS:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue().encode()
+
+
+def stream_ndjson(keys, rows, numeric=()):
+    """
+    Yield one JSON object per row, keyed by `keys`; fields named in `numeric`
+    are encoded as numbers. The first row goes out on its own so clients see
+    data as soon as the query returns.
+    """
+    pending = []
+    first = True
+    for row in rows:
+        item = dict(zip(keys, row))
+        for key in numeric:
+            item[key] = _to_json(item[key])
+        pending.append(orjson.dumps(item))
+        if first or len(pending) >= FLUSH_EVERY_ROWS:
+            first = False
+            yield b"\n".join(pending) + b"\n"
+            pending = []
+    if pending:
+        yield b"\n".join(pending) + b"\n"
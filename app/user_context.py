@@ -0,0 +1,54 @@
+"""
+The authenticated user of the request being handled.
+
+get_current_user records the user and their shard here, so every session the
+request opens routes by user: the dependencies', threadpool work, streamed
+response bodies and report jobs submitted from it (those run in a copy of the
+request's context and see the same holder). Read by app.database.RoutingSession
+and app.replicas.
+"""
+from contextvars import ContextVar
+
+
+class RequestUser:
+    __slots__ = ("user_id", "shard", "wrote")
+
+    def __init__(self):
+        self.user_id = None
+        self.shard = None
+        # set once the request has written to the user's database (app.replicas)
+        self.wrote = False
+
+
+# None outside of a request (CLIs, batch jobs)
+current_user = ContextVar("current_user", default=None)
+
+
+def note_user(user_id: int, shard: int = 0):
+    holder = current_user.get()
+    if holder is not None:
+        holder.user_id = user_id
+        holder.shard = shard
+
+
+def current_shard():
+    """Shard of the request's user, or None when there is none."""
+    holder = current_user.get()
+    return holder.shard if holder is not None else None
+
+
+class UserContextMiddleware:
+    """Pure ASGI middleware giving each request its own RequestUser."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_user.set(RequestUser())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_user.reset(token)
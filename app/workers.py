@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+
+class PoolOverloaded(Exception):
+    """Raised when a pool has no free slot, or a job waited longer than its timeout."""
+
+
+_pools = []
+
+
+class BoundedPool:
+    """
+    Executor with an admission limit. At most `max_workers + max_pending` jobs
+    may be running or queued; further submissions fail immediately with
+    PoolOverloaded instead of piling up behind a long queue.
+
+    The underlying executor is created on first use so that process pools are
+    started inside each server worker, after any pre-fork. max_workers=0 runs
+    jobs inline in the caller's thread.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int, kind: str = "process"):
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(max_workers, 1) + max_pending)
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        _pools.append(self)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                executor_class = ProcessPoolExecutor if self.kind == "process" else ThreadPoolExecutor
+                self._executor = executor_class(max_workers=self.max_workers)
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _release(self, future=None):
+        # called without a future when the job never reached the executor
+        failed = future is None or future.cancelled() or future.exception() is not None
+        with self._lock:
+            self.pending -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolOverloaded(f"{self.name} pool is saturated")
+        with self._lock:
+            self.pending += 1
+            self.submitted += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self._reset_executor()
+            self._release()
+            raise PoolOverloaded(f"{self.name} pool is restarting")
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args, timeout: float = None):
+        """Run fn(*args) on the pool and wait for the result."""
+        if self.max_workers == 0:
+            return fn(*args)
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise PoolOverloaded(f"{self.name} pool did not finish in {timeout}s")
+        except BrokenProcessPool:
+            self._reset_executor()
+            raise PoolOverloaded(f"{self.name} pool is restarting")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self.pending,
+                "queue_depth": max(self.pending - self.max_workers, 0),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+def pool_stats() -> dict:
+    return {pool.name: pool.stats() for pool in _pools}
@@ -0,0 +1,36 @@
+"""
+Requests/sec and tail latency of the CRUD routes with DB_MODE=sync vs DB_MODE=async.
+
+    python -m benchmarks.bench_db_modes --expenses 5000 --concurrency 64
+
+Seeds one user, then starts the app once per mode and hammers the same routes.
+"""
+import argparse
+
+from benchmarks.loadgen import launch_server, login, run_load
+from benchmarks.seed import SEED_PASSWORD, seed
+
+PATHS = ["/summary/", "/expenses/?limit=50", "/incomes/?limit=50", "/bill-reminders/?limit=50"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expenses", type=int, default=5_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=3_000)
+    args = parser.parse_args()
+
+    (_, email), = seed(users=1, expenses=args.expenses)
+
+    results = {}
+    for mode in ("sync", "async"):
+        with launch_server(env={"DB_MODE": mode}) as base_url:
+            token = login(base_url, email, SEED_PASSWORD)
+            for path in PATHS:
+                results[(mode, path)] = run_load(base_url, token, path, concurrency=args.concurrency, total=args.requests)
+
+    print(f"{'route':28} {'mode':6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for path in PATHS:
+        for mode in ("sync", "async"):
+            r = results[(mode, path)]
+            print(f"{path:28} {mode:6} {r['rps']:>9} {r['p50_ms']:>9} {r['p99_ms']:>9}")
@@ -0,0 +1,79 @@
+"""
+Peak memory, time-to-first-byte and total time of the Excel export: the old
+pandas/BytesIO path vs the streaming writer in app/xlsx_stream.py.
+
+    python -m benchmarks.bench_excel_export --sizes 10000 100000 1000000
+
+Uses synthetic rows, so no database is needed. The pandas path is skipped if
+pandas/openpyxl are not installed. Memory is measured with tracemalloc, which
+slows both paths down by the same factor.
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO
+from types import SimpleNamespace
+
+from app.xlsx_stream import stream_xlsx
+
+# same header as app.report_data.REPORT_COLUMNS (not imported: that pulls in the DB engine)
+REPORT_COLUMNS = ("Type", "Amount", "Source/Title", "Date")
+
+
+def synthetic_rows(n):
+    start = date(2020, 1, 1)
+    for i in range(n):
+        kind = "Income" if i % 10 == 0 else "Expense"
+        yield (kind, Decimal(i % 50_000) / 100, f"Row {i}", start + timedelta(days=i % 2_000))
+
+
+def pandas_export(n):
+    import pandas as pd
+
+    # the old path materialised ORM objects, then DataFrames, then the workbook
+    objects = [SimpleNamespace(type=r[0], amount=r[1], title=r[2], date=r[3]) for r in synthetic_rows(n)]
+    df = pd.DataFrame([{"Type": o.type, "Amount": o.amount, "Source/Title": o.title, "Date": o.date} for o in objects])
+    output = BytesIO()
+    df.to_excel(output, index=False)
+    output.seek(0)
+    yield output.getvalue()
+
+
+def streaming_export(n):
+    yield from stream_xlsx(REPORT_COLUMNS, synthetic_rows(n))
+
+
+def measure(export, n):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+    for chunk in export(n):
+        if first_byte is None and chunk:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ttfb_s": first_byte, "total_s": total, "peak_mb": peak / 1e6, "size_mb": size / 1e6}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    try:
+        import pandas  # noqa: F401
+        import openpyxl  # noqa: F401
+        paths = {"pandas": pandas_export, "streaming": streaming_export}
+    except ImportError:
+        paths = {"streaming": streaming_export}
+
+    print(f"{'rows':>9} {'path':10} {'ttfb s':>8} {'total s':>8} {'peak MB':>9} {'file MB':>8}")
+    for n in args.sizes:
+        for name, export in paths.items():
+            r = measure(export, n)
+            print(f"{n:>9} {name:10} {r['ttfb_s']:>8.3f} {r['total_s']:>8.2f} {r['peak_mb']:>9.1f} {r['size_mb']:>8.1f}")
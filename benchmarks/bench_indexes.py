@@ -0,0 +1,98 @@
+"""
+Query plans and latencies for the per-user hot queries, without and with the
+composite and partial indexes from migration 0001. Every other index of the
+schema stays in place in both phases.
+
+    python -m benchmarks.bench_indexes --users 20 --expenses 50000
+
+Drops and recreates the indexes, so only run it against a scratch database.
+"""
+import argparse
+import statistics
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from app import models
+from app.database import engine
+from benchmarks.seed import seed
+
+INDEX_NAMES = {
+    "ix_expenses_user_date_id",
+    "ix_incomes_user_date_id",
+    "ix_bill_reminders_user_due_id",
+    # took the place of 0001's ix_bill_reminders_pending_user_due in migration 0005
+    "ix_bill_reminders_open_user_due",
+}
+INDEXES = [
+    index
+    for table in (models.Expense.__table__, models.Income.__table__, models.BillReminder.__table__)
+    for index in table.indexes
+    if index.name in INDEX_NAMES
+]
+
+QUERIES = {
+    "expenses page": (
+        "SELECT * FROM expenses WHERE user_id = :user_id "
+        "ORDER BY expense_date DESC, id DESC LIMIT 50"
+    ),
+    "expenses range": (
+        "SELECT * FROM expenses WHERE user_id = :user_id "
+        "AND expense_date BETWEEN :start AND :end"
+    ),
+    "incomes range": (
+        "SELECT * FROM incomes WHERE user_id = :user_id "
+        "AND received_date BETWEEN :start AND :end"
+    ),
+    "pending bills": (
+        "SELECT * FROM bill_reminders WHERE user_id = :user_id "
+        "AND status = 'pending' AND due_date <= :end ORDER BY due_date"
+    ),
+}
+
+
+def measure(conn, sql, params, repeat):
+    plan = "\n".join(row[0] for row in conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + sql), params))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(text(sql), params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return plan, statistics.median(timings), p95
+
+
+def run_phase(label, params, repeat):
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE expenses; ANALYZE incomes; ANALYZE bill_reminders"))
+        print(f"\n===== {label} =====")
+        for name, sql in QUERIES.items():
+            plan, median, p95 = measure(conn, sql, params, repeat)
+            print(f"\n--- {name}: median {median:.2f} ms, p95 {p95:.2f} ms")
+            print(plan)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--expenses", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    users = seed(args.users, args.expenses)
+    user_id = users[len(users) // 2][0]
+    params = {
+        "user_id": user_id,
+        "start": date.today() - timedelta(days=90),
+        "end": date.today() + timedelta(days=30),
+    }
+
+    for index in INDEXES:
+        index.drop(engine, checkfirst=True)
+    run_phase("before (without the migration 0001 indexes)", params, args.repeat)
+
+    for index in INDEXES:
+        index.create(engine, checkfirst=True)
+    run_phase("after (composite indexes)", params, args.repeat)
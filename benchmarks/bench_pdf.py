@@ -0,0 +1,73 @@
+"""
+PDF report rendering: the old single-document path (one HTML string built by
+repeated concatenation, one pisa call) vs the chunked renderer in
+app/pdf_report.py.
+
+    python -m benchmarks.bench_pdf --sizes 1000 5000 --workers 0 2 4
+
+Uses synthetic rows, so no database is needed. Worker count 0 renders the
+chunks inline, which isolates the effect of chunking from parallelism.
+"""
+import argparse
+import os
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO
+
+
+def synthetic_rows(n):
+    start = date(2020, 1, 1)
+    for i in range(n):
+        kind = "Income" if i % 10 == 0 else "Expense"
+        yield (kind, Decimal(i % 50_000) / 100, f"Row {i}", start + timedelta(days=i % 2_000))
+
+
+def single_document(n):
+    from xhtml2pdf import pisa
+
+    html = "<h2>Expense Tracker Report</h2><table border='1'><tr><th>Type</th><th>Amount</th><th>Source/Title</th><th>Date</th></tr>"
+    for kind, amount, label, day in synthetic_rows(n):
+        html += f"<tr><td>{kind}</td><td>{amount}</td><td>{label}</td><td>{day}</td></tr>"
+    html += "</table>"
+    output = BytesIO()
+    pisa.CreatePDF(html, dest=output)
+    return len(output.getvalue())
+
+
+def chunked(n, workers):
+    # PDF_WORKERS is read at import time, so each worker count runs in a fresh interpreter
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, time; from benchmarks.bench_pdf import synthetic_rows; "
+        "from app.pdf_report import render_pdf; "
+        f"out = render_pdf(synthetic_rows({n})); print(len(out.getvalue()))"
+    )
+    env = dict(os.environ, PDF_WORKERS=str(workers))
+    result = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True)
+    return int(result.stdout.strip().splitlines()[-1])
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    size = fn(*args)
+    return time.perf_counter() - start, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 5_000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--skip-single", action="store_true", help="skip the old single-document path")
+    args = parser.parse_args()
+
+    print(f"{'rows':>7} {'path':14} {'total s':>8} {'file KB':>8}")
+    for n in args.sizes:
+        if not args.skip_single:
+            elapsed, size = timed(single_document, n)
+            print(f"{n:>7} {'single':14} {elapsed:>8.2f} {size / 1e3:>8.0f}")
+        for workers in args.workers:
+            elapsed, size = timed(chunked, n, workers)
+            print(f"{n:>7} {f'chunked w={workers}':14} {elapsed:>8.2f} {size / 1e3:>8.0f}")
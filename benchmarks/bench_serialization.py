@@ -0,0 +1,61 @@
+"""
+List endpoint serialization: the default path (ORM instances validated into
+the response schema, then json.dumps, as FastAPI does for response_model)
+vs app/fast_json.py (column tuples encoded with orjson).
+
+    python -m benchmarks.bench_serialization --sizes 1000 10000 50000
+
+Seeds one user per size into DATABASE_URL, so point it at a scratch database.
+Both paths include the query; the outputs are checked to be byte-identical.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+
+from app import fast_json, models, schemas
+from app.database import SessionLocal
+from benchmarks.seed import seed
+
+
+def default_path(db, user_id):
+    adapter = TypeAdapter(list[schemas.ExpenseResponse])
+    expenses = db.scalars(select(models.Expense).where(models.Expense.user_id == user_id)
+                          .order_by(models.Expense.id)).all()
+    content = adapter.dump_python(adapter.validate_python(expenses, from_attributes=True), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def fast_path(db, user_id):
+    columns = [getattr(models.Expense, name) for name in schemas.ExpenseResponse.model_fields]
+    rows = db.execute(select(*columns).where(models.Expense.user_id == user_id)
+                      .order_by(models.Expense.id)).all()
+    return fast_json.encode_rows(schemas.ExpenseResponse, rows)
+
+
+def measure(path, user_id, repeat):
+    timings = []
+    for _ in range(repeat):
+        with SessionLocal() as db:
+            start = time.perf_counter()
+            body = path(db, user_id)
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings), body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>7} {'default ms':>11} {'fast ms':>9} {'speedup':>8} {'body KB':>8}")
+    for n in args.sizes:
+        [(user_id, _)] = seed(users=1, expenses=n, incomes=1, bills=1, seed_value=9_000 + n)
+        default_s, default_body = measure(default_path, user_id, args.repeat)
+        fast_s, fast_body = measure(fast_path, user_id, args.repeat)
+        assert fast_body == default_body, "fast path output differs from the default path"
+        print(f"{n:>7} {default_s * 1e3:>11.1f} {fast_s * 1e3:>9.1f} {default_s / fast_s:>7.1f}x {len(fast_body) / 1e3:>8.0f}")
@@ -0,0 +1,89 @@
+"""
+Local check of GET /summary/breakdown against a SQLite database.
+
+    python -m benchmarks.check_breakdown
+    python -m benchmarks.check_breakdown --db-mode async
+
+Seeds one user and asks for the breakdown at every granularity, with and
+without dimension=category. The app is driven in-process and the check fails
+(exit status 1) unless every request succeeds and, per bucket, net is income
+minus expense and the buckets add up to the user's income and expense totals.
+
+Everything lives in a temporary directory; DATABASE_URL from the environment
+is overridden.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from decimal import Decimal
+
+GRANULARITIES = ("day", "week", "month", "year")
+
+
+def configure(directory, db_mode):
+    path = os.path.join(directory, "breakdown.db")
+    os.environ.update({
+        "DB_MODE": db_mode,
+        "DATABASE_URL": f"sqlite:///{path}",
+        "ASYNC_DATABASE_URL": f"sqlite+aiosqlite:///{path}",
+        "RATE_LIMIT_ENABLED": "false",
+    })
+    for name, value in (("SECRET_KEY", "check-breakdown"), ("ALGORITHM", "HS256"),
+                        ("ACCESS_TOKEN_EXPIRE_MINUTES", "30"), ("BCRYPT_ROUNDS", "4")):
+        os.environ.setdefault(name, value)
+
+
+async def check():
+    import httpx
+
+    from app import auth_utils, database
+    from app.main import app
+    from benchmarks.seed import seed
+
+    [(user_id, email)] = seed(users=1, expenses=200, seed_value=11)
+    headers = {"Authorization": "Bearer " + auth_utils.create_access_token(data={"sub": str(user_id), "email": email})}
+
+    failures = []
+
+    def expect(condition, message):
+        print(("ok   " if condition else "FAIL ") + message)
+        if not condition:
+            failures.append(message)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+        summary = (await client.get("/summary/", headers=headers)).json()
+        for granularity in GRANULARITIES:
+            for dimension in (None, "category"):
+                params = {"granularity": granularity, **({"dimension": dimension} if dimension else {})}
+                label = f"granularity={granularity}" + (f"&dimension={dimension}" if dimension else "")
+                response = await client.get("/summary/breakdown", headers=headers, params=params)
+                expect(response.status_code == 200, f"{label} succeeds ({response.status_code})")
+                if response.status_code != 200:
+                    continue
+                buckets = response.json()["buckets"]
+                expect(all(Decimal(str(b["net"])) == Decimal(str(b["income"])) - Decimal(str(b["expense"]))
+                           for b in buckets), f"{label}: net is income - expense in every bucket")
+                income = sum(Decimal(str(b["income"])) for b in buckets)
+                expense = sum(Decimal(str(b["expense"])) for b in buckets)
+                expect(income == Decimal(str(summary["total_income"]))
+                       and expense == Decimal(str(summary["total_expenses"])),
+                       f"{label}: buckets add up to the summary totals")
+
+    # aiosqlite connections keep the interpreter alive until their engine is disposed
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-mode", choices=("sync", "async"), default="sync")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure(directory, args.db_mode)
+        failures = asyncio.run(check())
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,114 @@
+"""
+Cold-start budget check: how long a fresh interpreter takes to import an app
+module and run its startup, and how much memory that costs.
+
+    python -m benchmarks.check_import_time                        # app.main
+    python -m benchmarks.check_import_time --app app.reports_main --forbid \
+        --max-startup-ms 3000 --max-rss-mb 200
+
+Each run is a new interpreter, so nothing is warm except the OS page cache;
+the median of --runs is compared with the budget. The check also fails if any
+--forbid module (the report and dataframe stacks by default) has been imported
+by then: those must only load when a report needs them (the reports app
+preloads them on purpose, hence the bare --forbid above). Exits with status 1
+when over budget, so it can gate CI. Budgets depend on the machine; set them
+from a few runs on the machine that enforces them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+FORBIDDEN = ("pandas", "numpy", "xhtml2pdf", "reportlab", "pypdf", "openpyxl", "PIL", "lxml")
+
+# Enough configuration for the app modules to import; .env values and the
+# caller's environment take precedence.
+PLACEHOLDER_ENV = {
+    "DATABASE_URL": "sqlite://",
+    "SECRET_KEY": "import-time-check",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+}
+
+_PROBE = """
+import asyncio, importlib, json, resource, sys, time
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+async def startup():
+    async with module.app.router.lifespan_context(module.app):
+        pass
+asyncio.run(startup())
+done = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": (done - start) * 1000,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": sorted(sys.modules),
+}))
+"""
+
+
+def _slowest_imports(importtime_log, n):
+    """Modules with the largest self time from a -X importtime log."""
+    entries = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|", 2)
+        entries.append((int(self_us), name.strip()))
+    return sorted(entries, reverse=True)[:n]
+
+
+def measure(app_module, env):
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE, app_module],
+        capture_output=True, text=True, env=env,
+    )
+    if process.returncode != 0:
+        raise SystemExit(f"importing {app_module} failed:\n{process.stderr[-4000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app.main", help="module with an `app` attribute")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-startup-ms", type=float, default=1500.0)
+    parser.add_argument("--max-rss-mb", type=float, default=120.0)
+    parser.add_argument("--forbid", nargs="*", default=list(FORBIDDEN), help="modules that must not be loaded")
+    parser.add_argument("--top", type=int, default=10, help="show this many of the slowest imports")
+    args = parser.parse_args()
+
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    runs = [measure(args.app, env) for _ in range(args.runs)]
+    results = [result for result, _ in runs]
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    startup_ms = statistics.median(r["startup_ms"] for r in results)
+    rss_mb = statistics.median(r["rss_mb"] for r in results)
+    loaded = sorted({
+        name for r in results for name in r["modules"]
+        for forbidden in args.forbid if name == forbidden or name.startswith(forbidden + ".")
+    })
+
+    print(f"{args.app}: import {import_ms:.0f} ms, import + startup {startup_ms:.0f} ms "
+          f"(budget {args.max_startup_ms:.0f}), peak RSS {rss_mb:.1f} MB (budget {args.max_rss_mb:.0f}), "
+          f"{len(results[-1]['modules'])} modules")
+    if args.top:
+        print("slowest imports (self time, last run):")
+    for self_us, name in _slowest_imports(runs[-1][1], args.top):
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if startup_ms > args.max_startup_ms:
+        failures.append(f"startup took {startup_ms:.0f} ms, budget is {args.max_startup_ms:.0f} ms")
+    if rss_mb > args.max_rss_mb:
+        failures.append(f"peak RSS is {rss_mb:.1f} MB, budget is {args.max_rss_mb:.0f} MB")
+    if loaded:
+        top_level = sorted({name.split(".")[0] for name in loaded})
+        failures.append(f"loaded at startup but should load on first use: {', '.join(top_level)}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
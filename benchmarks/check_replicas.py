@@ -0,0 +1,139 @@
+"""
+Local check of read-replica routing, with SQLite files standing in for a
+primary and its replicas.
+
+    python -m benchmarks.check_replicas
+    python -m benchmarks.check_replicas --db-mode async
+
+Seeds a primary, copies it to a "replica" with SQLite's backup API and then
+writes a marker expense into the copy only, so a response tells which
+database served it. A second replica points at a path that cannot be opened.
+The app is driven in-process and the check fails (exit status 1) unless:
+
+- reads of a user who has not written are served by the working replica, and
+  the broken one leaves rotation after its first failed connection, without
+  any read failing: the read that hit it is served by the primary;
+- right after a write, that user's reads come from the primary and include it,
+  while other users keep reading from the replica;
+- after REPLICA_STICKY_SECONDS the writer is back on the replica.
+
+Everything lives in a temporary directory; DATABASE_URL and the replica
+settings from the environment are overridden.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+STICKY_SECONDS = 1.0
+MARKER = "replica-only marker"
+
+
+def configure(directory, db_mode):
+    primary = os.path.join(directory, "primary.db")
+    replica = os.path.join(directory, "replica.db")
+    missing = os.path.join(directory, "missing", "replica.db")
+    os.environ.update({
+        "DB_MODE": db_mode,
+        "DATABASE_URL": f"sqlite:///{primary}",
+        "ASYNC_DATABASE_URL": f"sqlite+aiosqlite:///{primary}",
+        "DATABASE_REPLICA_URLS": f"sqlite:///{replica},sqlite:///{missing}",
+        "ASYNC_DATABASE_REPLICA_URLS": f"sqlite+aiosqlite:///{replica},sqlite+aiosqlite:///{missing}",
+        "REPLICA_STICKY_SECONDS": str(STICKY_SECONDS),
+        "REPLICA_HEALTH_INTERVAL_SECONDS": "0",
+        "REPLICA_RETRY_SECONDS": "3600",
+    })
+    for name, value in (("SECRET_KEY", "check-replicas"), ("ALGORITHM", "HS256"),
+                        ("ACCESS_TOKEN_EXPIRE_MINUTES", "30"), ("BCRYPT_ROUNDS", "4")):
+        os.environ.setdefault(name, value)
+    return primary, replica
+
+
+def copy_database(source, target):
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+
+async def check(primary, replica):
+    import httpx
+
+    from app import auth_utils, database, replicas
+    from app.main import app
+    from benchmarks.seed import seed
+
+    users = seed(users=2, expenses=20, seed_value=7)
+    copy_database(primary, replica)
+    with sqlite3.connect(replica) as conn:
+        conn.execute(
+            "INSERT INTO expenses (user_id, title, amount, category, expense_date) "
+            "VALUES (?, ?, 1, 'Food', date('now'))",
+            (users[0][0], MARKER),
+        )
+    conn.close()
+    writer, reader = (
+        {"Authorization": "Bearer " + auth_utils.create_access_token(data={"sub": str(user_id), "email": email})}
+        for user_id, email in users
+    )
+
+    failures = []
+
+    def expect(condition, message):
+        print(("ok   " if condition else "FAIL ") + message)
+        if not condition:
+            failures.append(message)
+
+    async def titles(client, headers):
+        response = await client.get("/expenses/", headers=headers)
+        return response.status_code, [expense["title"] for expense in response.json()] \
+            if response.status_code == 200 else []
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+        statuses = [(await titles(client, writer))[0] for _ in range(4)]
+        expect(statuses == [200] * 4, f"no read fails on the broken replica (statuses {statuses})")
+        stats = replicas.replica_set.stats()
+        expect(not stats["replica1"]["in_rotation"], "broken replica is out of rotation")
+        expect(stats["replica0"]["in_rotation"], "working replica stays in rotation")
+
+        status, seen = await titles(client, writer)
+        expect(status == 200 and MARKER in seen, "reads before any write are served by the replica")
+
+        created = await client.post("/expenses/", headers=writer, json={
+            "title": "written to the primary", "amount": 5, "category": "Food",
+            "expense_date": time.strftime("%Y-%m-%d"),
+        })
+        expect(created.status_code == 200, f"write succeeds ({created.status_code})")
+        status, seen = await titles(client, writer)
+        expect("written to the primary" in seen and MARKER not in seen,
+               "the writer's next read comes from the primary and sees the write")
+        summary = await client.get("/summary/", headers=writer)
+        expect(summary.status_code == 200, "summary right after the write is served")
+
+        status, seen = await titles(client, reader)
+        expect(status == 200 and "written to the primary" not in seen, "other users keep reading from the replica")
+
+        await asyncio.sleep(STICKY_SECONDS + 0.2)
+        status, seen = await titles(client, writer)
+        expect(MARKER in seen, f"after {STICKY_SECONDS}s the writer reads from the replica again")
+
+    # aiosqlite connections keep the interpreter alive until their engine is disposed
+    for async_engine in [database.async_engine] + [r.async_engine for r in replicas.replica_set.replicas]:
+        if async_engine is not None:
+            await async_engine.dispose()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-mode", choices=("sync", "async"), default="sync")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        primary, replica = configure(directory, args.db_mode)
+        failures = asyncio.run(check(primary, replica))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,121 @@
+"""Shared helpers for HTTP load benchmarks: start the app, log in, drive requests."""
+import asyncio
+import contextlib
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+@contextlib.contextmanager
+def server_process(port=8765, env=None, workers=1):
+    """Run `uvicorn app.main:app` in a subprocess and yield (process, base URL) once it answers."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env={**os.environ, **(env or {})},
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(base_url + "/", timeout=1)
+                break
+            except httpx.TransportError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.2)
+        yield process, base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@contextlib.contextmanager
+def launch_server(port=8765, env=None, workers=1):
+    """Run `uvicorn app.main:app` in a subprocess and yield its base URL once it answers."""
+    with server_process(port, env, workers) as (_, base_url):
+        yield base_url
+
+
+def login(base_url, email, password):
+    response = httpx.post(base_url + "/auth/login", json={"email": email, "password": password}, timeout=30)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def _drive(client, method, path, concurrency, total, latencies, statuses, build=None, on_response=None):
+    issued = 0
+
+    async def worker():
+        nonlocal issued
+        while issued < total:
+            index = issued
+            issued += 1
+            request = build(index) if build else {"method": method, "url": path}
+            start = time.perf_counter()
+            try:
+                response = await client.request(**request)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if on_response:
+                    on_response(response)
+            except httpx.HTTPError:
+                statuses["error"] = statuses.get("error", 0) + 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def _result(path, method, total, concurrency, statuses, latencies, elapsed):
+    latencies.sort()
+    return {
+        "path": path,
+        "method": method,
+        "requests": total,
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+async def drive_load(client, path, method="GET", concurrency=32, total=2_000, build=None, on_response=None):
+    """
+    Like run_load, on an already open httpx.AsyncClient and event loop. `build`,
+    if given, maps the request index to keyword arguments for client.request();
+    `on_response` is called with every response received.
+    """
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    await _drive(client, method, path, concurrency, total, latencies, statuses, build, on_response)
+    return _result(path, method, total, concurrency, statuses, latencies, time.perf_counter() - start)
+
+
+def open_client(base_url, token=None, concurrency=32, transport=None):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    limits = httpx.Limits(max_connections=concurrency)
+    return httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60, transport=transport)
+
+
+def run_load(base_url, token, path, method="GET", concurrency=32, total=2_000, transport=None):
+    """
+    Send `total` requests with `concurrency` in flight; returns throughput and
+    latency percentiles. Pass an httpx.ASGITransport to drive the app in-process.
+    """
+    async def main():
+        async with open_client(base_url, token, concurrency, transport) as client:
+            return await drive_load(client, path, method, concurrency, total)
+
+    return asyncio.run(main())
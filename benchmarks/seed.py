@@ -0,0 +1,122 @@
+"""
+Realistic data generator for local benchmarking.
+
+    python -m benchmarks.seed --users 5 --expenses 100000
+
+Writes straight into DATABASE_URL with batched multi-row inserts, so point it
+at a scratch database. Every seeded user logs in with SEED_PASSWORD.
+"""
+import argparse
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import insert, select
+
+from app import models
+from app.auth_utils import hash_password
+from app.database import Base, engine
+
+SEED_PASSWORD = "bench-password"
+BATCH_SIZE = 10_000
+
+CATEGORIES = ["Food", "Rent", "Transport", "Utilities", "Shopping", "Health", "Travel", "Entertainment"]
+SOURCES = ["Salary", "Freelance", "Interest", "Dividends", "Gift"]
+BILLS = ["Electricity", "Internet", "Phone", "Insurance", "Rent", "Streaming"]
+CYCLES = [None, "weekly", "monthly", "monthly", "yearly"]
+
+
+def _random_date(rng, days_back):
+    return date.today() - timedelta(days=rng.randint(0, days_back))
+
+
+def _insert_batched(conn, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.execute(insert(model), batch)
+            batch = []
+    if batch:
+        conn.execute(insert(model), batch)
+
+
+def seed(users=1, expenses=1_000, incomes=None, bills=None, years=5, seed_value=42, bind=None):
+    """Create `users` users, each with the given row counts. Returns the seeded (id, email) pairs."""
+    bind = bind or engine
+    rng = random.Random(seed_value)
+    incomes = incomes if incomes is not None else max(expenses // 10, 1)
+    bills = bills if bills is not None else max(expenses // 100, 1)
+    days_back = years * 365
+    password_hash = hash_password(SEED_PASSWORD)
+
+    Base.metadata.create_all(bind)
+    seeded = []
+    with bind.begin() as conn:
+        for n in range(users):
+            email = f"bench{seed_value}-{n}@example.com"
+            existing = conn.execute(select(models.User.id).where(models.User.email == email)).scalar()
+            if existing:
+                seeded.append((existing, email))
+                continue
+            user_id = conn.execute(
+                insert(models.User).returning(models.User.id),
+                {
+                    "name": f"Bench User {n}",
+                    "phonenumber": f"9{seed_value:03d}{n:06d}",
+                    "email": email,
+                    "password_hash": password_hash,
+                },
+            ).scalar_one()
+            seeded.append((user_id, email))
+
+            conn.execute(insert(models.Category), [{"user_id": user_id, "name": name} for name in CATEGORIES])
+            category_ids = dict(conn.execute(
+                select(models.Category.name, models.Category.id).where(models.Category.user_id == user_id)
+            ).all())
+
+            def expense_row(i):
+                category = rng.choice(CATEGORIES)
+                return {
+                    "user_id": user_id,
+                    "title": f"{category} #{i}",
+                    "amount": round(rng.uniform(1, 500), 2),
+                    "category": category,
+                    "category_id": category_ids[category],
+                    "expense_date": _random_date(rng, days_back),
+                }
+
+            _insert_batched(conn, models.Expense, (expense_row(i) for i in range(expenses)))
+            _insert_batched(conn, models.Income, (
+                {
+                    "user_id": user_id,
+                    "amount": round(rng.uniform(100, 5000), 2),
+                    "source": rng.choice(SOURCES),
+                    "received_date": _random_date(rng, days_back),
+                }
+                for _ in range(incomes)
+            ))
+            _insert_batched(conn, models.BillReminder, (
+                {
+                    "user_id": user_id,
+                    "title": rng.choice(BILLS),
+                    "amount": round(rng.uniform(10, 300), 2),
+                    "due_date": date.today() + timedelta(days=rng.randint(-60, 120)),
+                    "repeat_cycle": rng.choice(CYCLES),
+                    "status": rng.choice(["pending", "pending", "paid"]),
+                }
+                for _ in range(bills)
+            ))
+    return seeded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--expenses", type=int, default=1_000, help="expenses per user (1k to 1M)")
+    parser.add_argument("--incomes", type=int, default=None, help="incomes per user (default expenses/10)")
+    parser.add_argument("--bills", type=int, default=None, help="bill reminders per user (default expenses/100)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for user_id, email in seed(args.users, args.expenses, args.incomes, args.bills, seed_value=args.seed):
+        print(f"user {user_id}: {email} / {SEED_PASSWORD}")
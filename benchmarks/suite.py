@@ -0,0 +1,418 @@
+"""
+Load benchmark of every route in app/routes/.
+
+    python -m benchmarks.suite --expenses 10000 --concurrency 16
+    python -m benchmarks.suite --expenses 10000 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --expenses 10000 --baseline benchmarks/baseline.json
+
+Seeds one user with --expenses rows (1k to 1M is the intended range) into
+DATABASE_URL, so point it at a scratch database, then sends --requests
+requests per route (--heavy-requests for reports, bulk imports and anything
+that hashes a password) with --concurrency in flight. For each route it
+reports req/s, p50/p95/p99 latency, SQL statements per request and the peak
+RSS of the serving process while that route ran.
+
+By default the app is driven in-process through httpx.ASGITransport, which
+lets the suite count SQL statements with engine events; RSS then includes the
+load generator itself. --server runs it under uvicorn in a subprocess instead
+(closer to production, but without SQL counts). DB_MODE is taken from the
+environment as usual. Per-user rate limits are turned off, as every request
+is made by the one seeded user; load shedding stays on and shows as 503s.
+
+With --baseline, routes whose throughput drops, whose p95 rises by more than
+--tolerance, or that issue more SQL statements per request than in the
+baseline are listed, and the exit status is 1. Baselines are only comparable
+on the same machine, database and options.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+
+import httpx
+from sqlalchemy import event, func, select
+
+from app import auth_utils, database, models
+from benchmarks.loadgen import drive_load, open_client, server_process
+from benchmarks.seed import SEED_PASSWORD, seed
+
+INTERNAL_TOKEN = os.getenv("INTERNAL_API_TOKEN") or "benchmark-suite"
+BULK_ROWS = 100
+# cache misses move the average a little between runs; an extra query per request does not hide under this
+SQL_TOLERANCE = 0.5
+
+# Route -> reason, for routes the suite deliberately leaves out
+NOT_BENCHMARKED = {}
+
+
+def _json_request(method, url, body, **kwargs):
+    return {"method": method, "url": url, "json": body, **kwargs}
+
+
+def _expense(i):
+    return {"title": f"Suite #{i}", "amount": 12.5, "category": "Food", "expense_date": date.today().isoformat()}
+
+
+def _income(i):
+    return {"amount": 1000, "source": "Salary", "received_date": date.today().isoformat()}
+
+
+def _bill(i):
+    return {"title": f"Suite bill #{i}", "amount": 40, "due_date": (date.today() + timedelta(days=i % 60)).isoformat(),
+            "repeat_cycle": "monthly", "status": "pending", "notes": None}
+
+
+def _ndjson(rows):
+    return {"content": b"".join(json.dumps(row).encode() + b"\n" for row in rows),
+            "headers": {"Content-Type": "application/x-ndjson"}}
+
+
+def scenarios(ctx):
+    """
+    One entry per route, in the order they run: (route, build, options).
+    `build(i)` returns the keyword arguments of request number i. Options:
+    heavy (use --heavy-requests), collect (append the id of each created
+    object to that pool), uses (a pool the requests consume, one item each)
+    and wait_for_jobs (let the queued report jobs finish first).
+    """
+    tag = ctx["tag"]
+    pools = ctx["pools"]
+    month_ago = (date.today() - timedelta(days=30)).isoformat()
+    today = date.today().isoformat()
+    internal = {"headers": {"X-Internal-Token": INTERNAL_TOKEN}}
+
+    def get(url, **kwargs):
+        return lambda i: {"method": "GET", "url": url, **kwargs}
+
+    def pooled(name, method, url, body=None):
+        def build(i):
+            request = {"method": method, "url": url.format(pools[name][i])}
+            if body:
+                request["json"] = body(i)
+            return request
+        return build
+
+    def as_user(method, url, body=None):
+        # requests on behalf of the users created by POST /auth/register
+        def build(i):
+            user_id, email = pools["user"][i]
+            token = auth_utils.create_access_token(data={"sub": str(user_id), "email": email})
+            request = {"method": method, "url": url, "headers": {"Authorization": f"Bearer {token}"}}
+            if body:
+                request["json"] = body(i)
+            return request
+        return build
+
+    def register(i):
+        # email and phone number are both unique per user
+        return {"name": "Suite", "email": f"suite-{tag}-{i}@example.com", "phonenumber": f"suite-{tag}-{i}",
+                "password": SEED_PASSWORD}
+
+    return [
+        ("GET /", get("/"), {}),
+        ("GET /users/", get("/users/"), {}),
+
+        ("POST /auth/register",
+         lambda i: _json_request("POST", "/auth/register", register(i)),
+         {"heavy": True, "collect": "user"}),
+        ("POST /auth/login",
+         lambda i: _json_request("POST", "/auth/login", {"email": ctx["email"], "password": SEED_PASSWORD}),
+         {"heavy": True}),
+        ("GET /auth/user-name", get("/auth/user-name"), {}),
+        ("GET /auth/profile", get("/auth/profile"), {}),
+        ("PUT /auth/update-profile",
+         as_user("PUT", "/auth/update-profile", lambda i: {"name": f"Suite {i}", "phonenumber": None, "email": None,
+                                                            "profileimage": None, "address": None}),
+         {"uses": "user"}),
+        ("POST /auth/change-password",
+         as_user("POST", "/auth/change-password", lambda i: {"old_password": SEED_PASSWORD,
+                                                              "new_password": SEED_PASSWORD}),
+         {"heavy": True, "uses": "user"}),
+        ("POST /auth/logout", lambda i: {"method": "POST", "url": "/auth/logout"}, {}),
+        ("DELETE /auth/delete-account", as_user("DELETE", "/auth/delete-account"), {"heavy": True, "uses": "user"}),
+
+        ("GET /expenses/", get("/expenses/?limit=50"), {}),
+        ("GET /expenses/{expense_id}", get(f"/expenses/{ctx['expense_id']}"), {}),
+        ("POST /expenses/", lambda i: _json_request("POST", "/expenses/", _expense(i)), {"collect": "expense"}),
+        ("PUT /expenses/{expense_id}", pooled("expense", "PUT", "/expenses/{}", _expense), {"uses": "expense"}),
+        ("DELETE /expenses/{expense_id}", pooled("expense", "DELETE", "/expenses/{}"), {"uses": "expense"}),
+        ("POST /expenses/bulk",
+         lambda i: {"method": "POST", "url": "/expenses/bulk", **_ndjson(_expense(j) for j in range(BULK_ROWS))},
+         {"heavy": True}),
+
+        ("GET /categories/", get("/categories/"), {}),
+        ("GET /categories/{category_id}", get(f"/categories/{ctx['category_id']}"), {}),
+        ("POST /categories/",
+         lambda i: _json_request("POST", "/categories/", {"name": f"Suite {tag} {i}", "color": None}),
+         {"collect": "category"}),
+        ("PUT /categories/{category_id}",
+         pooled("category", "PUT", "/categories/{}", lambda i: {"name": f"Suite {tag} {i} renamed", "color": None}),
+         {"uses": "category"}),
+        ("DELETE /categories/{category_id}", pooled("category", "DELETE", "/categories/{}"), {"uses": "category"}),
+
+        ("GET /incomes/", get("/incomes/?limit=50"), {}),
+        ("GET /incomes/{income_id}", get(f"/incomes/{ctx['income_id']}"), {}),
+        ("POST /incomes/", lambda i: _json_request("POST", "/incomes/", _income(i)), {"collect": "income"}),
+        ("PUT /incomes/{income_id}", pooled("income", "PUT", "/incomes/{}", _income), {"uses": "income"}),
+        ("DELETE /incomes/{income_id}", pooled("income", "DELETE", "/incomes/{}"), {"uses": "income"}),
+        ("POST /incomes/bulk",
+         lambda i: {"method": "POST", "url": "/incomes/bulk", **_ndjson(_income(j) for j in range(BULK_ROWS))},
+         {"heavy": True}),
+
+        ("GET /bill-reminders/", get("/bill-reminders/?limit=50"), {}),
+        ("GET /bill-reminders/upcoming", get("/bill-reminders/upcoming?days=60"), {}),
+        ("GET /bill-reminders/{bill_id}", get(f"/bill-reminders/{ctx['bill_id']}"), {}),
+        ("POST /bill-reminders/", lambda i: _json_request("POST", "/bill-reminders/", _bill(i)), {"collect": "bill"}),
+        ("PUT /bill-reminders/{bill_id}", pooled("bill", "PUT", "/bill-reminders/{}", _bill), {"uses": "bill"}),
+        ("DELETE /bill-reminders/{bill_id}", pooled("bill", "DELETE", "/bill-reminders/{}"), {"uses": "bill"}),
+
+        ("GET /summary/", get("/summary/"), {}),
+        ("GET /summary/breakdown", get("/summary/breakdown?granularity=month&dimension=category"), {}),
+
+        ("GET /reports/full", get("/reports/full?format=excel"), {"heavy": True}),
+        ("GET /reports/range", get(f"/reports/range?format=excel&from_date={month_ago}&to_date={today}"),
+         {"heavy": True}),
+        ("GET /reports/stream", get("/reports/stream?format=csv"), {"heavy": True}),
+        ("POST /reports/jobs",
+         lambda i: _json_request("POST", "/reports/jobs", {"kind": "range", "format": "csv",
+                                                           "from_date": month_ago, "to_date": today}),
+         {"heavy": True, "collect": "job"}),
+        ("GET /reports/jobs/{job_id}", pooled("job", "GET", "/reports/jobs/{}"), {"uses": "job"}),
+        ("GET /reports/jobs/{job_id}/download", pooled("job", "GET", "/reports/jobs/{}/download"),
+         {"uses": "job", "wait_for_jobs": True}),
+
+        ("GET /internal/cache", get("/internal/cache", **internal), {}),
+        ("GET /internal/workers", get("/internal/workers", **internal), {}),
+        ("GET /internal/pool", get("/internal/pool", **internal), {}),
+        ("GET /internal/rate-limits", get("/internal/rate-limits", **internal), {}),
+        ("GET /internal/replicas", get("/internal/replicas", **internal), {}),
+        ("GET /internal/shards", get("/internal/shards", **internal), {"heavy": True}),
+        ("GET /internal/queries", get("/internal/queries?top=20", **internal), {}),
+        ("DELETE /internal/queries", lambda i: {"method": "DELETE", "url": "/internal/queries", **internal}, {}),
+        ("GET /metrics", get("/metrics", headers={"Authorization": f"Bearer {INTERNAL_TOKEN}"}), {}),
+    ]
+
+
+def check_coverage(routes):
+    """Print the app's routes that have no scenario, so new endpoints are not silently left out."""
+    from fastapi.routing import APIRoute
+
+    from app.main import app
+
+    covered = {name for name, _, _ in routes} | set(NOT_BENCHMARKED)
+    missing = [
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in sorted(route.methods)
+        if f"{method} {route.path}" not in covered
+    ]
+    for name in missing:
+        print(f"warning: no benchmark scenario for {name}", file=sys.stderr)
+    return missing
+
+
+class StatementCounter:
+    """Counts statements sent to the database by this process, through engine events."""
+
+    def __init__(self):
+        self.count = 0
+        self.engines = [database.engine]
+        if database.async_engine is not None:
+            self.engines.append(database.async_engine.sync_engine)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._on_execute)
+
+
+def reset_peak_rss(pid="self"):
+    """Restart the kernel's peak-RSS counter of a process (Linux only; a no-op elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb(pid="self"):
+    """Peak RSS since the last reset_peak_rss(), from /proc; falls back to this process's lifetime peak."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if pid != "self":
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def _record_created(pool, name):
+    def on_response(response):
+        if response.is_success:
+            body = response.json()
+            pool.append((body["id"], body["email"]) if name == "user" else body["id"])
+    return on_response
+
+
+async def _wait_for_jobs(client, job_ids, timeout=300):
+    deadline = asyncio.get_running_loop().time() + timeout
+    for job_id in set(job_ids):
+        while asyncio.get_running_loop().time() < deadline:
+            response = await client.get(f"/reports/jobs/{job_id}")
+            if not response.is_success or response.json()["status"] not in ("queued", "running"):
+                break
+            await asyncio.sleep(0.2)
+
+
+async def run_suite(client, ctx, args, counter=None, pid="self", only=None):
+    results = {}
+    for name, build, options in scenarios(ctx):
+        if only and not any(part in name for part in only):
+            continue
+        total = args.heavy_requests if options.get("heavy") else args.requests
+        if options.get("uses"):
+            total = min(total, len(ctx["pools"][options["uses"]]))
+            if total == 0:
+                print(f"skipped {name}: nothing left in the {options['uses']!r} pool", file=sys.stderr)
+                continue
+        if options.get("wait_for_jobs"):
+            await _wait_for_jobs(client, ctx["pools"]["job"])
+        on_response = _record_created(ctx["pools"][options["collect"]], options["collect"]) \
+            if options.get("collect") else None
+
+        reset_peak_rss(pid)
+        statements_before = counter.count if counter else 0
+        result = await drive_load(client, name, concurrency=min(args.concurrency, total), total=total,
+                                  build=build, on_response=on_response)
+        result["sql_per_request"] = round((counter.count - statements_before) / total, 2) if counter else None
+        result["peak_rss_mb"] = peak_rss_mb(pid)
+        results[name] = result
+        print(f"  {name:40} {result['rps']:>8} req/s  p95 {result['p95_ms']:>8} ms", file=sys.stderr)
+    return results
+
+
+def prepare(args):
+    [(user_id, email)] = seed(users=1, expenses=args.expenses, seed_value=args.expenses)
+    with database.SessionLocal() as db:
+        def first(model):
+            return db.scalar(select(func.min(model.id)).where(model.user_id == user_id))
+        ctx = {
+            "user_id": user_id,
+            "email": email,
+            "expense_id": first(models.Expense),
+            "income_id": first(models.Income),
+            "bill_id": first(models.BillReminder),
+            "category_id": first(models.Category),
+        }
+    ctx["tag"] = uuid.uuid4().hex[:8]
+    ctx["pools"] = defaultdict(list)
+    ctx["token"] = auth_utils.create_access_token(data={"sub": str(user_id), "email": email})
+    return ctx
+
+
+def in_process(args, ctx):
+    from app import rate_limit
+    from app.main import app
+    from app.routes import internal
+
+    internal.INTERNAL_API_TOKEN = internal.INTERNAL_API_TOKEN or INTERNAL_TOKEN
+    rate_limit.RATE_LIMIT_ENABLED = False
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        with StatementCounter() as counter:
+            async with open_client("http://suite", ctx["token"], args.concurrency, transport) as client:
+                return await run_suite(client, ctx, args, counter=counter, only=args.only)
+
+    return asyncio.run(main())
+
+
+def in_server(args, ctx):
+    env = {"INTERNAL_API_TOKEN": INTERNAL_TOKEN, "RATE_LIMIT_ENABLED": "false"}
+    with server_process(port=args.port, env=env) as (process, base_url):
+        async def main():
+            async with open_client(base_url, ctx["token"], args.concurrency) as client:
+                return await run_suite(client, ctx, args, pid=process.pid, only=args.only)
+
+        return asyncio.run(main())
+
+
+def print_table(results):
+    print(f"{'route':40} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'SQL/req':>8} {'RSS MB':>8}  statuses")
+    for name, r in results.items():
+        sql = "-" if r["sql_per_request"] is None else r["sql_per_request"]
+        rss = "-" if r["peak_rss_mb"] is None else r["peak_rss_mb"]
+        statuses = " ".join(f"{code}x{count}" for code, count in sorted(r["statuses"].items(), key=str))
+        print(f"{name:40} {r['rps']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} "
+              f"{sql:>8} {rss:>8}  {statuses}")
+
+
+def compare(results, baseline, tolerance):
+    """Return a line per regression against `baseline` (a saved run of this suite)."""
+    regressions = []
+    for name, r in results.items():
+        old = baseline["routes"].get(name)
+        if old is None:
+            continue
+        if r["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {old['rps']} -> {r['rps']} req/s")
+        if r["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']} -> {r['p95_ms']} ms")
+        if r["sql_per_request"] is not None and old.get("sql_per_request") is not None \
+                and r["sql_per_request"] > old["sql_per_request"] + SQL_TOLERANCE:
+            regressions.append(f"{name}: {old['sql_per_request']} -> {r['sql_per_request']} SQL statements/request")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expenses", type=int, default=10_000, help="expenses seeded for the benchmark user")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--heavy-requests", type=int, default=20, help="requests per report/bulk/password route")
+    parser.add_argument("--server", action="store_true", help="run the app under uvicorn instead of in-process")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--only", nargs="+", help="only routes whose name contains one of these strings")
+    parser.add_argument("--baseline", help="compare against this saved run")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change before flagging")
+    parser.add_argument("--save-baseline", help="write this run's results to a JSON file")
+    args = parser.parse_args()
+
+    all_routes = scenarios({"tag": "", "pools": {}, "expense_id": 0, "income_id": 0, "bill_id": 0, "category_id": 0})
+    check_coverage(all_routes)
+
+    context = prepare(args)
+    results = (in_server if args.server else in_process)(args, context)
+    print_table(results)
+
+    if args.save_baseline:
+        options = {key: getattr(args, key)
+                   for key in ("expenses", "concurrency", "requests", "heavy_requests", "server")}
+        with open(args.save_baseline, "w") as f:
+            json.dump({"options": {**options, "db_mode": database.DB_MODE}, "routes": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against the baseline")
@@ -0,0 +1,49 @@
+"""composite per-user date indexes
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Indexes are built with CREATE INDEX CONCURRENTLY so the tables stay writable
+while they build. CONCURRENTLY cannot run inside a transaction, hence the
+autocommit block.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_expenses_user_date_id", "expenses", ["user_id", "expense_date", "id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            "ix_incomes_user_date_id", "incomes", ["user_id", "received_date", "id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            "ix_bill_reminders_user_due_id", "bill_reminders", ["user_id", "due_date", "id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            "ix_bill_reminders_pending_user_due", "bill_reminders", ["user_id", "due_date"],
+            postgresql_where=sa.text("status = 'pending'"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table in (
+            ("ix_bill_reminders_pending_user_due", "bill_reminders"),
+            ("ix_bill_reminders_user_due_id", "bill_reminders"),
+            ("ix_incomes_user_date_id", "incomes"),
+            ("ix_expenses_user_date_id", "expenses"),
+        ):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
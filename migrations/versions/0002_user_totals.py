@@ -0,0 +1,39 @@
+"""per-user totals rollup
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+Backfills every existing user from the raw tables. Writes that land between
+the backfill and the new code going live are not counted, so run
+`python -m app.rollups reconcile --fix` once after deploying.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user_totals",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("total_income", sa.Numeric(14, 2), nullable=False, server_default="0"),
+        sa.Column("total_expenses", sa.Numeric(14, 2), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.TIMESTAMP, server_default=sa.func.now()),
+    )
+    op.execute("""
+        INSERT INTO user_totals (user_id, total_income, total_expenses, updated_at)
+        SELECT u.id,
+               COALESCE((SELECT SUM(amount) FROM incomes i WHERE i.user_id = u.id), 0),
+               COALESCE((SELECT SUM(amount) FROM expenses e WHERE e.user_id = u.id), 0),
+               now()
+        FROM users u
+    """)
+
+
+def downgrade():
+    op.drop_table("user_totals")
@@ -0,0 +1,21 @@
+"""user_totals.data_version
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("user_totals", sa.Column("data_version", sa.BigInteger, nullable=False, server_default="0"))
+
+
+def downgrade():
+    op.drop_column("user_totals", "data_version")
@@ -0,0 +1,21 @@
+"""user_totals.bills_version
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("user_totals", sa.Column("bills_version", sa.BigInteger, nullable=False, server_default="0"))
+
+
+def downgrade():
+    op.drop_column("user_totals", "bills_version")
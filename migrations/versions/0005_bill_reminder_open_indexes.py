@@ -0,0 +1,52 @@
+"""partial indexes for the bill reminder scheduler
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+ix_bill_reminders_open_user_due replaces ix_bill_reminders_pending_user_due
+from 0001: pending reminders are a subset of the open ones, so queries on
+status = 'pending' use the new index and the old one would only add to every
+reminder write.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_bill_reminders_open_user_due", "bill_reminders", ["user_id", "due_date"],
+            postgresql_where=sa.text("status <> 'paid'"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            "ix_bill_reminders_pending_user_due", table_name="bill_reminders",
+            postgresql_concurrently=True, if_exists=True,
+        )
+        op.create_index(
+            "ix_bill_reminders_open_due", "bill_reminders", ["due_date"],
+            postgresql_where=sa.text("status <> 'paid'"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            "ix_bill_reminders_paid_recurring", "bill_reminders", ["due_date"],
+            postgresql_where=sa.text("status = 'paid' AND repeat_cycle IN ('weekly', 'monthly', 'yearly')"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_bill_reminders_pending_user_due", "bill_reminders", ["user_id", "due_date"],
+            postgresql_where=sa.text("status = 'pending'"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        for name in ("ix_bill_reminders_paid_recurring", "ix_bill_reminders_open_due", "ix_bill_reminders_open_user_due"):
+            op.drop_index(name, table_name="bill_reminders", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,71 @@
+"""expenses.category_id
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+Adds the foreign key, makes category names unique per user, creates a category
+for every distinct (user, name) already used by expenses and links the
+expenses to it in id-range batches, each committed on its own so the table is
+never locked as a whole. Expenses written by the old code while this runs are
+linked afterwards with `python -m app.categories backfill`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10_000
+
+
+def upgrade():
+    with op.batch_alter_table("expenses") as batch:
+        batch.add_column(sa.Column("category_id", sa.Integer, nullable=True))
+        batch.create_foreign_key(
+            "fk_expenses_category_id", "categories", ["category_id"], ["id"], ondelete="SET NULL"
+        )
+
+    # keep the oldest of any duplicate names before the unique constraint goes on
+    op.execute("""
+        DELETE FROM categories
+        WHERE id NOT IN (SELECT MIN(id) FROM categories GROUP BY user_id, name)
+    """)
+    with op.batch_alter_table("categories") as batch:
+        batch.create_unique_constraint("uq_categories_user_name", ["user_id", "name"])
+    op.execute("""
+        INSERT INTO categories (user_id, name, created_at)
+        SELECT DISTINCT e.user_id, e.category, CURRENT_TIMESTAMP
+        FROM expenses e
+        WHERE e.category IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.user_id = e.user_id AND c.name = e.category)
+    """)
+
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        low, high = conn.execute(sa.text("SELECT MIN(id), MAX(id) FROM expenses")).one()
+        if low is not None:
+            for start in range(low, high + 1, BATCH_SIZE):
+                conn.execute(sa.text("""
+                    UPDATE expenses
+                    SET category_id = (SELECT c.id FROM categories c
+                                       WHERE c.user_id = expenses.user_id AND c.name = expenses.category)
+                    WHERE id >= :start AND id < :stop AND category IS NOT NULL AND category_id IS NULL
+                """), {"start": start, "stop": start + BATCH_SIZE})
+        op.create_index(
+            "ix_expenses_user_category_date", "expenses", ["user_id", "category_id", "expense_date"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_expenses_user_category_date", table_name="expenses",
+                      postgresql_concurrently=True, if_exists=True)
+    with op.batch_alter_table("categories") as batch:
+        batch.drop_constraint("uq_categories_user_name", type_="unique")
+    with op.batch_alter_table("expenses") as batch:
+        batch.drop_constraint("fk_expenses_category_id", type_="foreignkey")
+        batch.drop_column("category_id")
@@ -0,0 +1,32 @@
+"""user_shards map
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+The shard map for horizontal sharding (see app/shards.py). Only the
+directory database (DATABASE_URL) uses it; run the migrations against every
+shard all the same, since shards share the schema. Users without a row live
+on shard 0, so existing data needs no backfill.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user_shards",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("shard", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("moving", sa.Boolean, nullable=False, server_default=sa.false()),
+        sa.Column("updated_at", sa.TIMESTAMP, server_default=sa.func.now()),
+    )
+
+
+def downgrade():
+    op.drop_table("user_shards")